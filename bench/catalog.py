@@ -0,0 +1,87 @@
+"""
+Synthetic catalogs and search queries, reproducible from a seed
+"""
+import random
+
+WORDS = (
+    "dark night rising star wars return king lord rings fellowship tower dune blade runner "
+    "mad max fury road matrix reloaded revolutions alien aliens predator terminator judgment "
+    "day kill bill jurassic park world lost empire strikes back new hope force awakens last "
+    "jedi skywalker iron man captain america winter soldier civil infinity endgame avengers "
+    "guardians galaxy black panther doctor strange spider home coming far from way no time "
+    "die casino royale quantum solace skyfall spectre mission impossible ghost protocol rogue "
+    "nation fallout dead reckoning top gun maverick interstellar inception tenet memento "
+    "prestige dunkirk oppenheimer godfather part pulp fiction fight club seven gone girl "
+    "social network zodiac arrival sicario prisoners enemy incendies gladiator kingdom heaven "
+    "martian prometheus covenant hunger games catching fire mockingjay harry potter chamber "
+    "secrets prisoner azkaban goblet phoenix prince deathly hallows fantastic beasts crimes "
+    "grindelwald toy story monsters inc finding nemo dory cars up inside out coco soul luca "
+    "frozen moana tangled encanto zootopia wreck ralph big hero six bolt dragon train shrek "
+    "madagascar panda ice age rio despicable minions hotel transylvania storm city river"
+).split()
+
+QUALITIES = ["480p", "720p", "1080p", "2160p"]
+
+
+def make_catalog(size: int, seed: int = 1) -> list:
+    """size movies as {"code", "title", "parts", "qualities"}, about 10% multi-part"""
+    rng = random.Random(seed)
+    movies, codes = [], set()
+    while len(movies) < size:
+        words = rng.sample(WORDS, rng.choice((1, 2, 2, 3, 3, 4)))
+        title = " ".join(w.capitalize() for w in words) + f" {rng.randint(1950, 2025)}"
+        code = title.lower().replace(" ", "_")
+        if code in codes:
+            continue
+        codes.add(code)
+        movies.append({
+            "code": code,
+            "title": title,
+            "parts": rng.choice((2, 3)) if rng.random() < 0.1 else 1,
+            "qualities": sorted(rng.sample(QUALITIES, rng.randint(1, 3)), key=QUALITIES.index)
+        })
+    return movies
+
+
+def file_items(movies: list) -> list:
+    """bulk_add_files items for a catalog, every file gets its own fake file_id"""
+    items = []
+    for movie in movies:
+        for part in range(1, movie["parts"] + 1):
+            for quality in movie["qualities"]:
+                unique_id = f"bench_{movie['code']}_{part}_{quality}"
+                items.append({
+                    "code": movie["code"],
+                    "title": movie["title"],
+                    "part": part,
+                    "quality": quality,
+                    "media": {
+                        "file_id": f"file_{unique_id}",
+                        "file_unique_id": unique_id,
+                        "file_size": 700 * 1024 * 1024,
+                        "mime_type": "video/x-matroska",
+                        "duration": 7200
+                    },
+                    "source": {"chat_id": -1001, "message_id": len(items) + 1}
+                })
+    return items
+
+
+def make_query(rng: random.Random, movie: dict) -> str:
+    """What a user types looking for a movie: full title, a prefix or a typo"""
+    words = movie["title"].split()
+    roll = rng.random()
+    if roll < 0.6:
+        return movie["title"]
+    if roll < 0.8:
+        return " ".join(words[:-1]) if len(words) > 2 else words[0]
+    if roll < 0.9:
+        return words[0][:max(3, len(words[0]) - 2)]
+
+    # Swap two letters of the longest word
+    word = max(words, key=len)
+    if len(word) > 3:
+        i = rng.randrange(1, len(word) - 2)
+        typo = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+        words[words.index(word)] = typo
+    return " ".join(words)
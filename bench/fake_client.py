@@ -0,0 +1,108 @@
+"""
+Fake Pyrogram client - captures registered handlers and answers API calls locally
+"""
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+
+class ApiCounter:
+    """Telegram API calls made by the bot, with a simulated round trip"""
+
+    def __init__(self, latency: float = 0, tally=None):
+        self.latency = latency
+        self.tally = tally
+        self.calls = 0
+
+    async def call(self):
+        self.calls += 1
+        if self.tally:
+            self.tally("api")
+        await asyncio.sleep(self.latency)
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, api: ApiCounter, user: SimpleNamespace, text: str = ""):
+        self.api = api
+        self.id = next(self._ids)
+        self.from_user = user
+        self.chat = SimpleNamespace(id=user.id)
+        self.text = text
+        self.reply_markup = None
+
+    async def reply_text(self, text: str, reply_markup=None, **kwargs):
+        await self.api.call()
+        reply = FakeMessage(self.api, self.from_user, text)
+        reply.reply_markup = reply_markup
+        return reply
+
+    async def reply_photo(self, photo, caption: str = "", reply_markup=None, **kwargs):
+        return await self.reply_text(caption, reply_markup)
+
+    async def edit_text(self, text: str, reply_markup=None, **kwargs):
+        await self.api.call()
+        self.text = text
+        self.reply_markup = reply_markup
+        return self
+
+    async def delete(self):
+        await self.api.call()
+
+
+class FakeCallbackQuery:
+    def __init__(self, api: ApiCounter, user: SimpleNamespace, data: str):
+        self.api = api
+        self.from_user = user
+        self.data = data
+        self.message = FakeMessage(api, user)
+
+    async def answer(self, text: str = None, show_alert: bool = False):
+        await self.api.call()
+
+
+class FakeClient:
+    """Stands in for the bot: decorators record handlers, API methods only count"""
+
+    def __init__(self, latency: float = 0, tally=None):
+        self.api = ApiCounter(latency, tally)
+        self.me = SimpleNamespace(id=1, username="benchbot")
+        self.handlers = {}
+
+    def _register(self, *args, **kwargs):
+        def decorator(func):
+            self.handlers[func.__name__] = func
+            return func
+        return decorator
+
+    on_message = _register
+    on_callback_query = _register
+    on_chat_member_updated = _register
+
+    def add_handler(self, handler, group: int = 0):
+        self.handlers[handler.callback.__name__] = handler.callback
+
+    def user(self, user_id: int) -> SimpleNamespace:
+        return SimpleNamespace(id=user_id, username=f"user{user_id}", first_name="Bench")
+
+    def message(self, user_id: int, text: str) -> FakeMessage:
+        return FakeMessage(self.api, self.user(user_id), text)
+
+    def callback(self, user_id: int, data: str) -> FakeCallbackQuery:
+        return FakeCallbackQuery(self.api, self.user(user_id), data)
+
+    async def get_chat_member(self, chat_id: int, user_id: int):
+        await self.api.call()
+        return SimpleNamespace(status="ChatMemberStatus.MEMBER")
+
+    async def send_cached_media(self, chat_id: int, file_id: str, **kwargs):
+        await self.api.call()
+        return FakeMessage(self.api, self.user(chat_id))
+
+    async def send_document(self, chat_id: int, document: str, **kwargs):
+        return await self.send_cached_media(chat_id, document)
+
+    async def get_messages(self, chat_id: int, message_ids: int):
+        await self.api.call()
+        return SimpleNamespace(empty=True)
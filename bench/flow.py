@@ -0,0 +1,321 @@
+"""
+Benchmark of the search -> quality -> token -> delivery flow
+
+Runs the real handlers against a fake client and a throwaway SQLite
+database, or a local MongoDB with --backend mongo (MONGO_DB_URL, database
+moviebot_bench, dropped first):
+
+    python -m bench.flow --movies 1000 10000 100000 --users 500 --flows 2000
+
+Simulated users search for a movie, open it, pick a part and quality and
+redeem the token. Movies are picked with Zipf popularity so caches see
+realistic reuse. Each catalog size runs in its own process.
+
+--save writes the results as JSON. --compare fails when p95 latency or
+DB ops per request grew past --tolerance against such a file.
+"""
+import argparse
+import asyncio
+import contextvars
+import inspect
+import json
+import logging
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from bench.catalog import make_catalog, file_items, make_query
+from bench.fake_client import FakeClient
+
+HANDLERS = ("search_cmd", "movie_cb", "part_cb", "quality_cb", "handle_token_verification")
+
+# Token in the link quality_cb shows, direct or through the ad page
+TOKEN_RE = re.compile(r"(?:start=token_|token=)([\w-]+)")
+
+# Files written per bulk_add_files call while loading a catalog
+LOAD_BATCH = 1000
+
+# p95 changes below this are noise, whatever the tolerance
+NOISE_MS = 1.0
+
+_request = contextvars.ContextVar("bench_request", default=None)
+
+
+def tally(kind: str):
+    """Count a DB op or API call against the request being measured"""
+    request = _request.get()
+    if request is not None:
+        request[kind] += 1
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def count_storage_ops(storage, base):
+    """Wrap every public storage method so calls are tallied per request"""
+    def wrap(method):
+        if inspect.isasyncgenfunction(method):
+            async def stream(*args, **kwargs):
+                tally("db")
+                async for item in method(*args, **kwargs):
+                    yield item
+            return stream
+
+        async def call(*args, **kwargs):
+            tally("db")
+            return await method(*args, **kwargs)
+        return call
+
+    for name, member in vars(base).items():
+        if not name.startswith("_") and callable(member):
+            setattr(storage, name, wrap(getattr(storage, name)))
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {name: [] for name in HANDLERS}    # name -> [(seconds, db ops, api calls)]
+        self.errors = {name: 0 for name in HANDLERS}
+
+    async def measure(self, name: str, handler, *args):
+        request = {"db": 0, "api": 0}
+        token = _request.set(request)
+        started = time.perf_counter()
+        try:
+            await handler(*args)
+        except Exception as e:
+            self.errors[name] += 1
+            logging.getLogger(__name__).warning(f"{name} failed: {e!r}")
+        finally:
+            _request.reset(token)
+        self.samples[name].append((time.perf_counter() - started, request["db"], request["api"]))
+
+    def summary(self) -> dict:
+        summary = {}
+        for name, samples in self.samples.items():
+            if not samples:
+                continue
+            latencies = [s[0] * 1000 for s in samples]
+            summary[name] = {
+                "requests": len(samples),
+                "errors": self.errors[name],
+                "p50_ms": round(percentile(latencies, 50), 3),
+                "p95_ms": round(percentile(latencies, 95), 3),
+                "p99_ms": round(percentile(latencies, 99), 3),
+                "db_ops": round(sum(s[1] for s in samples) / len(samples), 2),
+                "api_calls": round(sum(s[2] for s in samples) / len(samples), 2)
+            }
+        return summary
+
+
+async def run_flow(bot: FakeClient, handlers: dict, recorder: Recorder, rng: random.Random, movie: dict, user_id: int):
+    code = movie["code"]
+    await recorder.measure("search_cmd", handlers["search_cmd"], bot, bot.message(user_id, make_query(rng, movie)))
+    await recorder.measure("movie_cb", handlers["movie_cb"], bot, bot.callback(user_id, f"movie:{code}"))
+
+    part = 1
+    if movie["parts"] > 1:
+        part = rng.randint(1, movie["parts"])
+        await recorder.measure("part_cb", handlers["part_cb"], bot, bot.callback(user_id, f"part:{code}:{part}"))
+
+    query = bot.callback(user_id, f"quality:{code}:{part}:{rng.choice(movie['qualities'])}")
+    await recorder.measure("quality_cb", handlers["quality_cb"], bot, query)
+
+    markup = query.message.reply_markup
+    match = markup and TOKEN_RE.search(markup.inline_keyboard[0][0].url or "")
+    if not match:
+        recorder.errors["handle_token_verification"] += 1
+        return
+    token = match.group(1)
+    message = bot.message(user_id, f"/start token_{token}")
+    await recorder.measure("handle_token_verification", handlers["handle_token_verification"], bot, message, token, user_id)
+
+
+async def run(args) -> dict:
+    """One catalog size, in this process"""
+    # Imported late, Config reads the environment set up by main()
+    from database import db
+    from handlers.callbacks import register_callback_handlers
+    from handlers.user import register_user_handlers, handle_token_verification
+    from storage import MongoStorage, Storage
+    from utils import tracing
+
+    bot = FakeClient(args.api_latency / 1000, tally)
+    register_user_handlers(bot)
+    register_callback_handlers(bot)
+    handlers = dict(bot.handlers, handle_token_verification=handle_token_verification)
+
+    if isinstance(db.storage, MongoStorage):
+        await db.storage.client.drop_database(db.storage.db.name)
+    await db.start()
+
+    movies = make_catalog(args.movies[0], args.seed)
+    items = file_items(movies)
+    started = time.perf_counter()
+    for i in range(0, len(items), LOAD_BATCH):
+        await db.bulk_add_files(items[i:i + LOAD_BATCH])
+    load_seconds = time.perf_counter() - started
+    count_storage_ops(db.storage, Storage)
+
+    rng = random.Random(args.seed)
+    picks = rng.choices(movies, weights=[1 / (rank + 1) for rank in range(len(movies))], k=args.flows)
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def flow(movie, user_id, flow_rng):
+        async with semaphore:
+            await run_flow(bot, handlers, recorder, flow_rng, movie, user_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        flow(movie, 1000 + rng.randrange(args.users), random.Random(rng.random()))
+        for movie in picks
+    ))
+    elapsed = time.perf_counter() - started
+    await db.stop()
+    await tracing.shutdown()
+
+    handlers_summary = recorder.summary()
+    requests = sum(h["requests"] for h in handlers_summary.values())
+    return {
+        "backend": args.backend,
+        "token_mode": args.token_mode,
+        "token_issue": args.token_issue,
+        "movies": len(movies),
+        "files": len(items),
+        "users": args.users,
+        "flows": args.flows,
+        "concurrency": args.concurrency,
+        "load_seconds": round(load_seconds, 2),
+        "seconds": round(elapsed, 3),
+        "flows_per_second": round(args.flows / elapsed, 1),
+        "requests_per_second": round(requests / elapsed, 1),
+        "handlers": handlers_summary
+    }
+
+
+def print_report(report: dict):
+    print(
+        f"\n{report['movies']:,} movies ({report['files']:,} files, loaded in {report['load_seconds']}s) - "
+        f"{report['users']:,} users, {report['flows']:,} flows x {report['concurrency']} concurrent - "
+        f"{report['backend']}, {report['token_mode']} tokens issued on {report['token_issue']}"
+    )
+    print(f"{'handler':<28}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'db ops':>8}{'api':>6}")
+    for name, h in report["handlers"].items():
+        print(
+            f"{name:<28}{h['requests']:>9}{h['errors']:>8}{h['p50_ms']:>9.2f}{h['p95_ms']:>9.2f}"
+            f"{h['p99_ms']:>9.2f}{h['db_ops']:>8.2f}{h['api_calls']:>6.2f}"
+        )
+    print(f"throughput: {report['flows_per_second']} flows/s, {report['requests_per_second']} requests/s")
+
+
+def compare(reports: list, baseline: list, tolerance: float) -> list:
+    """Regressions against a saved run with the same catalog size, backend and token settings"""
+    def key(report):
+        return report["movies"], report["backend"], report["token_mode"], report.get("token_issue", "click")
+
+    problems = []
+    previous = {key(r): r for r in baseline}
+    for report in reports:
+        base = previous.get(key(report))
+        if not base:
+            continue
+        for name, h in report["handlers"].items():
+            old = base["handlers"].get(name)
+            if not old:
+                continue
+            if h["p95_ms"] > old["p95_ms"] * (1 + tolerance) and h["p95_ms"] - old["p95_ms"] > NOISE_MS:
+                problems.append(f"{report['movies']:,} movies {name}: p95 {old['p95_ms']} -> {h['p95_ms']} ms")
+            if h["db_ops"] > old["db_ops"] * (1 + tolerance) + 0.01:
+                problems.append(f"{report['movies']:,} movies {name}: db ops {old['db_ops']} -> {h['db_ops']}")
+            if h["errors"] > old["errors"]:
+                problems.append(f"{report['movies']:,} movies {name}: errors {old['errors']} -> {h['errors']}")
+    return problems
+
+
+def configure(args, workdir: str):
+    """Point the bot config at throwaway storage before anything imports it"""
+    os.environ.update({
+        "STORAGE_BACKEND": args.backend,
+        "SQLITE_PATH": os.path.join(workdir, "bench.db"),
+        "DB_NAME": "moviebot_bench",
+        "TOKEN_MODE": args.token_mode,
+        "TOKEN_ISSUE": args.token_issue,
+        "BACKUP_CHANNEL_ID": "-1001",
+        "TMDB_API_KEY": "",
+        "STATS_FLUSH_INTERVAL": "3600"
+    })
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+
+
+def run_child(args, size: int, workdir: str) -> dict:
+    """Run one catalog size in a fresh process so no state carries over"""
+    path = os.path.join(workdir, f"report-{size}.json")
+    subprocess.run([
+        sys.executable, "-m", "bench.flow",
+        "--movies", str(size),
+        "--users", str(args.users),
+        "--flows", str(args.flows),
+        "--concurrency", str(args.concurrency),
+        "--api-latency", str(args.api_latency),
+        "--seed", str(args.seed),
+        "--backend", args.backend,
+        "--token-mode", args.token_mode,
+        "--token-issue", args.token_issue,
+        "--save", path
+    ], check=True)
+    with open(path) as f:
+        return json.load(f)[0]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the search to delivery flow")
+    parser.add_argument("--movies", type=int, nargs="+", default=[1000, 10000], help="catalog sizes")
+    parser.add_argument("--users", type=int, default=500, help="distinct users")
+    parser.add_argument("--flows", type=int, default=2000, help="search to delivery flows per catalog")
+    parser.add_argument("--concurrency", type=int, default=50, help="flows running at once")
+    parser.add_argument("--api-latency", type=float, default=0, help="simulated Telegram round trip in ms")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--backend", choices=("sqlite", "mongo"), default="sqlite")
+    parser.add_argument("--token-mode", choices=("db", "signed"), default="db")
+    parser.add_argument("--token-issue", choices=("click", "prefetch"), default="click")
+    parser.add_argument("--save", help="write results as JSON")
+    parser.add_argument("--compare", help="fail on regressions against a saved JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative growth")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="moviebot-bench-") as workdir:
+        if len(args.movies) == 1:
+            configure(args, workdir)
+            reports = [asyncio.run(run(args))]
+            print_report(reports[0])
+        else:
+            reports = [run_child(args, size, workdir) for size in args.movies]
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(reports, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(reports, json.load(f), args.tolerance)
+        if problems:
+            print("\nRegressions:")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
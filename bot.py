@@ -2,13 +2,22 @@
 """
 Movie Bot - Main Entry Point
 Run: python bot.py
+
+With WORKERS > 1 one receiver takes the bot's updates and WORKERS worker
+processes handle them, sharded by user (see utils/workers.py). The memory
+coordination store runs all of them in this process, mongo and redis start
+one process per role:
+
+    python bot.py --role receiver
+    python bot.py --role worker --index 0
 """
-import telebot
+import argparse
 import asyncio
 import logging
+import signal
+import subprocess
 import sys
-import threading
-from flask import Flask
+import time
 
 # Event loop fix
 try:
@@ -16,11 +25,18 @@ try:
 except RuntimeError:
     asyncio.set_event_loop(asyncio.new_event_loop())
 
-from pyrogram import Client
 from pyrogram.enums import ParseMode
 from config import Config
+from coordination import create_store
 from handlers import register_all_handlers
 from database import db
+from helpers import close_http_session
+from utils import metrics, tracing
+from utils.broadcast import resume_broadcasts
+from utils.delivery import delivery
+from utils.invalidation import InvalidationBus
+from utils.web import WebServer
+from utils.workers import ReceiverClient, WorkerClient, Receiver, Feeder
 
 # Logging
 logging.basicConfig(
@@ -31,58 +47,297 @@ logger = logging.getLogger(__name__)
 logging.getLogger("pyrogram").setLevel(logging.WARNING)
 
 
-async def main():
-    # Validate config
+# Seconds between restarts of a worker process that keeps exiting
+RESTART_DELAY = 5
+
+
+def validate_config():
     try:
         Config.validate()
         logger.info("✅ Config OK")
     except ValueError as e:
         logger.error(f"❌ Config Error: {e}")
         sys.exit(1)
+
+
+def stop_event() -> asyncio.Event:
+    """Set on Ctrl+C and on the platform's SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    return stop
+
+
+def owns_jobs(index: int) -> bool:
+    """The worker that gets the admin's updates also runs the once-per-bot jobs"""
+    return index == Config.ADMIN_ID % Config.WORKERS
+
+
+async def main():
+    validate_config()
+    stop = stop_event()
     
     # Create bot
-    app = Client(
+    app = metrics.InstrumentedClient(
         name="movie_bot",
         api_id=Config.API_ID,
         api_hash=Config.API_HASH,
         bot_token=Config.BOT_TOKEN
     )
     
-    # Register handlers
-    register_all_handlers(app)
-    logger.info("✅ Handlers registered")
+    # Health checks answer (as unavailable) while the rest starts up
+    web = WebServer(app, Config.PORT)
+    await web.start()
     
     # Start
     try:
+        # Database
+        await db.start()
+        logger.info("✅ Database ready")
+        
+        # Register handlers
+        register_all_handlers(app)
+        logger.info("✅ Handlers registered")
+        
         await app.start()
         me = await app.get_me()
         logger.info(f"✅ Bot started: @{me.username}")
         
+        await resume_broadcasts(app)
+        db.file_registry.start(app)
+        delivery.start(app)
+        
         # Keep running
-        await asyncio.Event().wait()
+        await stop.wait()
+        logger.info("Shutting down...")
+        
+    except Exception as e:
+        logger.error(f"❌ Error: {e}")
+    finally:
+        if app.is_connected:
+            await app.stop()
+        await delivery.stop()
+        await db.stop()
+        await close_http_session()
+        await tracing.shutdown()
+        await web.stop()
+
+
+# ============ WORKERS ============
+
+def receiver_client() -> ReceiverClient:
+    return ReceiverClient(
+        name="movie_bot",
+        api_id=Config.API_ID,
+        api_hash=Config.API_HASH,
+        bot_token=Config.BOT_TOKEN
+    )
+
+
+def worker_client(index: int) -> WorkerClient:
+    app = WorkerClient(
+        name=f"movie_bot_worker{index}",
+        api_id=Config.API_ID,
+        api_hash=Config.API_HASH,
+        bot_token=Config.BOT_TOKEN
+    )
+    register_all_handlers(app)
+    return app
+
+
+async def start_jobs(app, index: int):
+    if owns_jobs(index):
+        await resume_broadcasts(app)
+        db.file_registry.start(app)
+        delivery.start(app)
+
+
+async def run_receiver():
+    """Receiver process - forwards the bot's updates to the workers"""
+    validate_config()
+    stop = stop_event()
+    store = create_store()
+    app = receiver_client()
+    web = WebServer(app, Config.PORT)
+    receiver = Receiver(app, store, Config.WORKERS, on_update=web.mark_update)
+    await web.start()
+    
+    try:
+        await store.setup()
+        await app.start()
+        receiver.start()
+        me = await app.get_me()
+        logger.info(f"✅ Receiver started: @{me.username}, {Config.WORKERS} workers")
+        
+        await stop.wait()
+        logger.info("Shutting down...")
+        
+    except Exception as e:
+        logger.error(f"❌ Error: {e}")
+    finally:
+        await receiver.stop()
+        if app.is_connected:
+            await app.stop()
+        await store.close()
+        await web.stop()
+
+
+async def run_worker(index: int):
+    """Worker process - handles the updates of its shard"""
+    validate_config()
+    stop = stop_event()
+    store = create_store()
+    app = worker_client(index)
+    feeder = Feeder(app, store, index)
+    bus = InvalidationBus(store, db, origin=f"worker{index}")
+    web = WebServer(app, Config.PORT + 1 + index)
+    await web.start()
+    
+    try:
+        await store.setup()
+        await db.start()
+        bus.start()
+        logger.info("✅ Database ready")
+        
+        await app.start()
+        feeder.start()
+        logger.info(f"✅ Worker {index} started")
+        
+        await start_jobs(app, index)
+        
+        await stop.wait()
+        logger.info("Shutting down...")
+        
+    except Exception as e:
+        logger.error(f"❌ Error: {e}")
+    finally:
+        await feeder.stop()
+        if app.is_connected:
+            await app.stop()
+        await bus.stop()
+        await delivery.stop()
+        await db.stop()
+        await store.close()
+        await close_http_session()
+        await tracing.shutdown()
+        await web.stop()
+
+
+async def run_inline():
+    """Receiver and every worker in this process, sharing one database"""
+    validate_config()
+    stop = stop_event()
+    store = create_store()
+    app = receiver_client()
+    workers = [worker_client(i) for i in range(Config.WORKERS)]
+    feeders = [Feeder(worker, store, i) for i, worker in enumerate(workers)]
+    web = WebServer(app, Config.PORT)
+    receiver = Receiver(app, store, Config.WORKERS, on_update=web.mark_update)
+    await web.start()
+    
+    try:
+        await db.start()
+        logger.info("✅ Database ready")
+        
+        for i, worker in enumerate(workers):
+            await worker.start()
+            feeders[i].start()
+            await start_jobs(worker, i)
+        
+        await app.start()
+        receiver.start()
+        me = await app.get_me()
+        logger.info(f"✅ Bot started: @{me.username}, {Config.WORKERS} workers")
+        
+        await stop.wait()
+        logger.info("Shutting down...")
         
     except Exception as e:
         logger.error(f"❌ Error: {e}")
     finally:
-        await app.stop()
+        await receiver.stop()
+        if app.is_connected:
+            await app.stop()
+        for feeder in feeders:
+            await feeder.stop()
+        for worker in workers:
+            if worker.is_connected:
+                await worker.stop()
+        await delivery.stop()
+        await db.stop()
+        await close_http_session()
+        await tracing.shutdown()
+        await web.stop()
+
 
-app = Flask(__name__)
+def supervise():
+    """Run the receiver and every worker as child processes, restarting any that exit"""
+    validate_config()
+    roles = [["--role", "receiver"]] + [
+        ["--role", "worker", "--index", str(i)] for i in range(Config.WORKERS)
+    ]
+    stopping = False
+    
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+    
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    
+    def spawn(role):
+        return subprocess.Popen([sys.executable, __file__, *role])
+    
+    processes = [spawn(role) for role in roles]
+    started = [time.monotonic()] * len(processes)
+    logger.info(f"✅ Started receiver and {Config.WORKERS} workers ({Config.COORDINATION_STORE})")
+    
+    while not stopping:
+        time.sleep(1)
+        for i, process in enumerate(processes):
+            if process.poll() is None or stopping:
+                continue
+            if time.monotonic() - started[i] < RESTART_DELAY:
+                continue
+            logger.warning(f"{' '.join(roles[i][1:])} exited with {process.returncode}, restarting")
+            processes[i] = spawn(roles[i])
+            started[i] = time.monotonic()
+    
+    logger.info("Shutting down...")
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        process.wait()
 
-@app.route('/')
-def home():
-    return "Bot is running!"
 
-def run_flask():
-    app.run(host='0.0.0.0', port=10000)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Movie Bot")
+    parser.add_argument("--role", choices=("all", "receiver", "worker"), default="all")
+    parser.add_argument("--index", type=int, default=0, help="worker index")
+    return parser.parse_args()
 
-# Start Flask in background thread
-threading.Thread(target=run_flask).start()
 
 if __name__ == "__main__":
-    print("""
+    args = parse_args()
+    if args.role == "receiver":
+        asyncio.run(run_receiver())
+    elif args.role == "worker":
+        asyncio.run(run_worker(args.index))
+    else:
+        print("""
 ╔════════════════════════════════╗
 ║     🎬 MOVIE BOT STARTING      ║
 ╚════════════════════════════════╝
-    """)
-    asyncio.run(main())
+        """)
+        if Config.WORKERS <= 1:
+            asyncio.run(main())
+        elif Config.COORDINATION_STORE == "memory":
+            asyncio.run(run_inline())
+        else:
+            supervise()
     
@@ -15,10 +15,44 @@ class Config:
     # Channel
     BACKUP_CHANNEL_ID = int(os.environ.get("BACKUP_CHANNEL_ID", 0))
     BACKUP_CHANNEL_LINK = os.environ.get("BACKUP_CHANNEL_LINK", "")
+    AUTO_INDEX = os.environ.get("AUTO_INDEX", "false").lower() == "true"
+    INDEX_DELAY = float(os.environ.get("INDEX_DELAY", 1))
+    SUB_CACHE_SIZE = int(os.environ.get("SUB_CACHE_SIZE", 100000))
+    SUB_CACHE_TTL = int(os.environ.get("SUB_CACHE_TTL", 600))
+    SUB_NEGATIVE_TTL = int(os.environ.get("SUB_NEGATIVE_TTL", 15))
     
     # Database
+    STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongo")  # mongo or sqlite
     MONGO_DB_URL = os.environ.get("MONGO_DB_URL", "")
     DB_NAME = os.environ.get("DB_NAME", "MovieBot")
+    SQLITE_PATH = os.environ.get("SQLITE_PATH", "moviebot.db")
+    MOVIE_CACHE_SIZE = int(os.environ.get("MOVIE_CACHE_SIZE", 2000))
+    MOVIE_CACHE_TTL = int(os.environ.get("MOVIE_CACHE_TTL", 600))
+    TOKEN_TTL = int(os.environ.get("TOKEN_TTL", 600))
+    TOKEN_MODE = os.environ.get("TOKEN_MODE", "db")  # db or signed
+    TOKEN_ISSUE = os.environ.get("TOKEN_ISSUE", "click")  # click or prefetch
+    TOKEN_PREFETCH_SIZE = int(os.environ.get("TOKEN_PREFETCH_SIZE", 20000))
+    TOKEN_SECRET = os.environ.get("TOKEN_SECRET", "")
+    SPENT_TOKEN_STORE = os.environ.get("SPENT_TOKEN_STORE", "memory")  # memory or mongo
+    USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 200000))
+    USER_FLUSH_INTERVAL = int(os.environ.get("USER_FLUSH_INTERVAL", 10))
+    STATS_FLUSH_INTERVAL = int(os.environ.get("STATS_FLUSH_INTERVAL", 30))
+    FILE_REFRESH_INTERVAL = int(os.environ.get("FILE_REFRESH_INTERVAL", 3600))
+    
+    # Broadcast (Telegram allows about 30 messages per second)
+    BROADCAST_RATE = int(os.environ.get("BROADCAST_RATE", 25))
+    BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", 10))
+    
+    # Delivery retries (failed sends are retried with doubling delays)
+    DELIVERY_MAX_ATTEMPTS = int(os.environ.get("DELIVERY_MAX_ATTEMPTS", 6))
+    DELIVERY_RETRY_BASE = float(os.environ.get("DELIVERY_RETRY_BASE", 10))
+    DELIVERY_RETRY_MAX = float(os.environ.get("DELIVERY_RETRY_MAX", 900))
+    DELIVERY_KEEP = int(os.environ.get("DELIVERY_KEEP", 86400))  # seconds a failed delivery can be retried from its link
+    FILE_ALERT_FAILURES = int(os.environ.get("FILE_ALERT_FAILURES", 3))  # failed sends in a row before the admin is told
+    
+    # Per-user rate limits
+    RATE_LIMIT = os.environ.get("RATE_LIMIT", "true").lower() == "true"
+    RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "memory")  # memory or mongo
     
     # GP Links
     GPLINKS_API_KEY = os.environ.get("GPLINKS_API_KEY", "")
@@ -26,6 +60,32 @@ class Config:
     
     # TMDB
     TMDB_API_KEY = os.environ.get("TMDB_API_KEY", "")
+    TMDB_CACHE_SIZE = int(os.environ.get("TMDB_CACHE_SIZE", 5000))
+    TMDB_CACHE_TTL = int(os.environ.get("TMDB_CACHE_TTL", 6 * 3600))
+    TMDB_NEGATIVE_TTL = int(os.environ.get("TMDB_NEGATIVE_TTL", 1800))
+    
+    # HTTP
+    HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 20))
+    
+    # Web server (health and metrics)
+    PORT = int(os.environ.get("PORT", 10000))
+    
+    # Workers (updates are sharded by user across WORKERS processes)
+    WORKERS = int(os.environ.get("WORKERS", 1))
+    COORDINATION_STORE = os.environ.get("COORDINATION_STORE", "memory")  # memory, mongo or redis
+    REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+    
+    # Tracing (span trees per update, off by default)
+    TRACING = os.environ.get("TRACING", "false").lower() == "true"
+    TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 1.0))
+    TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", 0))  # export only traces at least this slow
+    TRACE_EXPORT = os.environ.get("TRACE_EXPORT", "json")  # json or otlp
+    TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+    TRACE_OTLP_ENDPOINT = os.environ.get("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+    TRACE_SERVICE = os.environ.get("TRACE_SERVICE", "movie_bot")
+    
+    # Search
+    SEARCH_INDEX_MAX = int(os.environ.get("SEARCH_INDEX_MAX", 50000))
     
     @classmethod
     def validate(cls):
@@ -34,8 +94,17 @@ class Config:
             ("API_HASH", cls.API_HASH),
             ("BOT_TOKEN", cls.BOT_TOKEN),
             ("ADMIN_ID", cls.ADMIN_ID),
-            ("MONGO_DB_URL", cls.MONGO_DB_URL),
         ]
+        if cls.STORAGE_BACKEND == "mongo":
+            required.append(("MONGO_DB_URL", cls.MONGO_DB_URL))
+        elif cls.STORAGE_BACKEND != "sqlite":
+            raise ValueError(f"Unknown STORAGE_BACKEND: {cls.STORAGE_BACKEND}")
+        if cls.COORDINATION_STORE == "mongo" and cls.WORKERS > 1:
+            required.append(("MONGO_DB_URL", cls.MONGO_DB_URL))
+        elif cls.COORDINATION_STORE not in ("memory", "mongo", "redis"):
+            raise ValueError(f"Unknown COORDINATION_STORE: {cls.COORDINATION_STORE}")
+        if cls.TRACE_EXPORT not in ("json", "otlp"):
+            raise ValueError(f"Unknown TRACE_EXPORT: {cls.TRACE_EXPORT}")
         missing = [name for name, value in required if not value]
         if missing:
             raise ValueError(f"Missing: {', '.join(missing)}")
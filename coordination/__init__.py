@@ -0,0 +1,14 @@
+from config import Config
+from coordination.base import CoordinationStore
+from coordination.memory import MemoryStore
+from coordination.mongo import MongoStore
+
+
+def create_store() -> CoordinationStore:
+    """Coordination backend selected by COORDINATION_STORE"""
+    if Config.COORDINATION_STORE == "mongo":
+        return MongoStore(Config.MONGO_DB_URL, Config.DB_NAME)
+    if Config.COORDINATION_STORE == "redis":
+        from coordination.redis import RedisStore
+        return RedisStore(Config.REDIS_URL)
+    return MemoryStore()
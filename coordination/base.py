@@ -0,0 +1,32 @@
+"""
+Coordination interface - work queues and broadcast channels shared by bot processes
+"""
+
+
+class CoordinationStore:
+    """Base class for coordination backends
+
+    Queue payloads are bytes, delivered to exactly one consumer in push order.
+    Channel messages are JSON-able dicts, delivered to every subscriber.
+    """
+
+    async def setup(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def push(self, queue: str, payload: bytes):
+        raise NotImplementedError
+
+    async def pop(self, queue: str, timeout: float = 1) -> bytes:
+        """Oldest payload of a queue, None if nothing arrived within timeout"""
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: dict):
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str):
+        """Stream messages published on a channel from now on"""
+        raise NotImplementedError
+        yield
@@ -0,0 +1,34 @@
+"""
+In-process coordination - for running every role in one process
+"""
+import asyncio
+from collections import defaultdict
+from coordination.base import CoordinationStore
+
+
+class MemoryStore(CoordinationStore):
+    def __init__(self):
+        self.queues = defaultdict(asyncio.Queue)
+        self.subscribers = defaultdict(set)
+
+    async def push(self, queue: str, payload: bytes):
+        self.queues[queue].put_nowait(payload)
+
+    async def pop(self, queue: str, timeout: float = 1) -> bytes:
+        try:
+            return await asyncio.wait_for(self.queues[queue].get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def publish(self, channel: str, message: dict):
+        for subscriber in self.subscribers[channel]:
+            subscriber.put_nowait(message)
+
+    async def subscribe(self, channel: str):
+        inbox = asyncio.Queue()
+        self.subscribers[channel].add(inbox)
+        try:
+            while True:
+                yield await inbox.get()
+        finally:
+            self.subscribers[channel].discard(inbox)
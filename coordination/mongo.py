@@ -0,0 +1,72 @@
+"""
+MongoDB coordination - a polled queue collection and a capped collection tailed for messages
+"""
+import asyncio
+import logging
+import time
+from bson import Binary
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+from coordination.base import CoordinationStore
+
+logger = logging.getLogger(__name__)
+
+# Empty queues are polled with backoff up to this interval
+MAX_POLL_INTERVAL = 0.05
+
+# Size of the capped collection carrying channel messages
+EVENTS_SIZE = 8 * 1024 * 1024
+
+
+class MongoStore(CoordinationStore):
+    def __init__(self, url: str, name: str):
+        self.client = AsyncIOMotorClient(url)
+        self.db = self.client[name]
+        self.queue = self.db["work_queue"]
+        self.events = self.db["events"]
+
+    async def setup(self):
+        await self.queue.create_index([("queue", 1), ("_id", 1)])
+        try:
+            await self.db.create_collection("events", capped=True, size=EVENTS_SIZE)
+        except CollectionInvalid:
+            pass
+
+    async def close(self):
+        self.client.close()
+
+    async def push(self, queue: str, payload: bytes):
+        await self.queue.insert_one({"queue": queue, "payload": Binary(payload), "created_at": time.time()})
+
+    async def pop(self, queue: str, timeout: float = 1) -> bytes:
+        deadline = time.monotonic() + timeout
+        interval = 0.005
+        while True:
+            job = await self.queue.find_one_and_delete({"queue": queue}, sort=[("_id", 1)])
+            if job:
+                return bytes(job["payload"])
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    async def publish(self, channel: str, message: dict):
+        await self.events.insert_one({"channel": channel, "message": message})
+
+    async def subscribe(self, channel: str):
+        last = await self.events.find_one({}, sort=[("$natural", -1)])
+        query = {"channel": channel}
+        if last:
+            query["_id"] = {"$gt": last["_id"]}
+
+        while True:
+            # A tailable cursor dies when it starts on an empty result, so retry
+            cursor = self.events.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                async for event in cursor:
+                    query["_id"] = {"$gt": event["_id"]}
+                    yield event["message"]
+            except Exception as e:
+                logger.warning(f"Event cursor on {channel} failed: {e}")
+            await asyncio.sleep(0.5)
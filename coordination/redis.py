@@ -0,0 +1,40 @@
+"""
+Redis coordination - lists as queues and pub/sub for messages, works with any Redis-compatible server
+"""
+import json
+from coordination.base import CoordinationStore
+
+try:
+    import redis.asyncio as redis
+except ImportError:    # Optional, only needed with COORDINATION_STORE=redis
+    redis = None
+
+
+class RedisStore(CoordinationStore):
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("COORDINATION_STORE=redis needs the redis package (pip install redis)")
+        self.client = redis.from_url(url)
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def push(self, queue: str, payload: bytes):
+        await self.client.rpush(queue, payload)
+
+    async def pop(self, queue: str, timeout: float = 1) -> bytes:
+        item = await self.client.blpop([queue], timeout=timeout)
+        return item[1] if item else None
+
+    async def publish(self, channel: str, message: dict):
+        await self.client.publish(channel, json.dumps(message))
+
+    async def subscribe(self, channel: str):
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            async for event in pubsub.listen():
+                if event["type"] == "message":
+                    yield json.loads(event["data"])
+        finally:
+            await pubsub.aclose()
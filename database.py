@@ -1,30 +1,147 @@
+import asyncio
 import logging
 import time
+import hashlib
 import secrets
-from motor.motor_asyncio import AsyncIOMotorClient
+from collections import Counter
+from bson import ObjectId
 from config import Config
+from helpers import search_tokens, format_size
+from storage import create_storage, MongoStorage
+from utils import metrics, render
+from utils.cache import TTLCache
+from utils.file_registry import FileRegistry, unique_id_for, quality_entry, movie_refs
+from utils.search_index import SearchIndex
+from utils.user_registry import UserRegistry
+from utils.ratelimit import MemoryRateStore, MongoRateStore
+from utils.signed_token import (
+    sign_token,
+    read_token,
+    is_signed_token,
+    SpentTokens,
+    MongoSpentTokens
+)
 
 logger = logging.getLogger(__name__)
 
+# Search results returned to handlers
+SEARCH_LIMIT = 10
+# Candidates fetched from the token index before ranking
+SEARCH_CANDIDATES = 50
 
+
+@metrics.timed_methods(metrics.DB_LATENCY)
 class Database:
     def __init__(self):
-        self.client = AsyncIOMotorClient(Config.MONGO_DB_URL)
-        self.db = self.client[Config.DB_NAME]
-        self.movies = self.db["movies"]
-        self.users = self.db["users"]
-        self.tokens = self.db["tokens"]
+        self.storage = create_storage()
+        self.search_index = SearchIndex(Config.SEARCH_INDEX_MAX)
+        self.movie_cache = TTLCache(Config.MOVIE_CACHE_SIZE, Config.MOVIE_CACHE_TTL)
+        metrics.track_cache("movie", self.movie_cache)
+        self.user_registry = UserRegistry(
+            self.storage,
+            max_known=Config.USER_CACHE_SIZE,
+            flush_interval=Config.USER_FLUSH_INTERVAL
+        )
+        self.file_registry = FileRegistry(
+            self.storage,
+            cache_size=Config.MOVIE_CACHE_SIZE,
+            cache_ttl=Config.MOVIE_CACHE_TTL,
+            refresh_interval=Config.FILE_REFRESH_INTERVAL
+        )
+        
+        # Signed (stateless) download tokens
+        secret = Config.TOKEN_SECRET or f"token:{Config.BOT_TOKEN}"
+        self.token_secret = hashlib.sha256(secret.encode()).digest()
+        # Shared stores need Mongo, other backends keep them in memory
+        shared = self.storage.db if isinstance(self.storage, MongoStorage) else None
+        if Config.SPENT_TOKEN_STORE == "mongo" and shared is not None:
+            self.spent_tokens = MongoSpentTokens(shared["spent_tokens"])
+        else:
+            self.spent_tokens = SpentTokens()
+        
+        # (user_id, code) -> task minting tokens for every choice on the screen the user sees
+        # Taken while at least half of the token lifetime is left
+        self.prefetched = TTLCache(Config.TOKEN_PREFETCH_SIZE, Config.TOKEN_TTL / 2)
+        
+        # Per-user request limits, shared through Mongo when several instances run
+        if Config.RATE_LIMIT_STORE == "mongo" and shared is not None:
+            self.rate_limits = MongoRateStore(shared["rate_limits"])
+        else:
+            self.rate_limits = MemoryRateStore()
+        
+        # Called with ("movies", code) on every change, set when workers share the database
+        self.on_invalidate = None
+        
+        # (event, hour) -> count, added to the stats collection periodically
+        self.counters = Counter()
+        self._stats_task = None
+    
+    async def start(self):
+        """Prepare indexes, warm in-memory state and start background work"""
+        await self.ensure_indexes()
+        await self.cleanup_tokens()
+        await self.load_search_index()
+        self.user_registry.start()
+        self._stats_task = asyncio.create_task(self._flush_stats_loop())
+    
+    async def stop(self):
+        """Flush pending writes and stop background work"""
+        if self._stats_task is not None:
+            self._stats_task.cancel()
+            self._stats_task = None
+        await self.flush_counters()
+        await self.user_registry.stop()
+        await self.file_registry.stop()
+        await self.storage.close()
+    
+    async def ping(self) -> bool:
+        return await self.storage.ping()
+    
+    async def ensure_indexes(self):
+        """Prepare the storage backend and migrate older data"""
+        await self.storage.setup()
+        if isinstance(self.spent_tokens, MongoSpentTokens):
+            await MongoStorage.create_index(self.spent_tokens.collection, "expires_at", expireAfterSeconds=0)
+        if isinstance(self.rate_limits, MongoRateStore):
+            await MongoStorage.create_index(self.rate_limits.collection, "expires_at", expireAfterSeconds=0)
+        await self.migrate_files()
+    
+    async def migrate_files(self):
+        """Move file_ids embedded in older movies into the file registry"""
+        migrated = 0
+        batch = []
+        async for movie in self.storage.iter_embedded_files():
+            batch.append(movie)
+            if len(batch) >= 500:
+                migrated += (await self.bulk_upsert_movies(batch))[0]
+                batch = []
+        if batch:
+            migrated += (await self.bulk_upsert_movies(batch))[0]
+        if migrated:
+            logger.info(f"Moved files of {migrated} movies into the file registry")
+    
+    async def load_search_index(self):
+        """Load catalog titles into the in-memory fuzzy index"""
+        self.search_index.clear()
+        async for movie in self.storage.iter_titles():
+            self.search_index.add(movie)
+        logger.info(f"Search index loaded: {len(self.search_index)} movies")
+    
+    @staticmethod
+    def _movie_tokens(movie: dict) -> list:
+        return search_tokens(f"{movie.get('title', '')} {movie.get('code', '')}")
     
     # Movie operations
     async def add_movie(self, data: dict) -> bool:
         try:
             code = data["code"].lower().strip()
             data["code"] = code
-            await self.movies.update_one(
-                {"code": code},
-                {"$set": data},
-                upsert=True
-            )
+            data["search_tokens"] = self._movie_tokens(data)
+            # Before the write in case it fails, after it for readers in between
+            self.invalidate_movie(code)
+            await self.storage.upsert_movie(data)
+            self.invalidate_movie(code)
+            self.search_index.add(data)
             return True
         except Exception as e:
             logger.error(f"Add movie error: {e}")
@@ -33,77 +150,432 @@ class Database:
     async def get_movie(self, code: str) -> dict:
         if not code:
             return None
-        return await self.movies.find_one({"code": code.lower().strip()})
+        
+        code = code.lower().strip()
+        movie = self.movie_cache.get(code)
+        if movie is None:
+            movie = await self.storage.get_movie(code)
+            if movie:
+                self.movie_cache.set(code, movie)
+        return movie
+    
+    async def get_movie_by_id(self, movie_id) -> dict:
+        movie = await self.storage.get_movie_by_id(movie_id)
+        if movie:
+            self.movie_cache.set(movie["code"], movie)
+        return movie
+    
+    def invalidate_movie(self, code: str):
+        """Drop a movie from the read caches after it changed"""
+        self.movie_cache.pop(code)
+        render.invalidate(code)
+        if self.on_invalidate:
+            self.on_invalidate("movies", code)
+    
+    async def reload_movies(self, codes: list):
+        """Apply movie changes made by another worker to the local caches and search index"""
+        for code in codes:
+            self.movie_cache.pop(code)
+            render.invalidate(code)
+        
+        movies = {movie["code"]: movie for movie in await self.storage.get_movies(codes)}
+        for code in codes:
+            if code in movies:
+                self.search_index.add(movies[code])
+            else:
+                self.search_index.remove(code)
     
     async def search_movies(self, query: str) -> list:
-        if not query:
+        tokens = search_tokens(query or "")
+        if not tokens:
             return []
         
-        # Search by code or title (case-insensitive)
-        # Also search with underscores replaced by spaces
-        search_query = query.replace("_", " ").replace(" ", "_")
+        # Whole-word matches first, then fill up with prefix matches
+        movies = await self.storage.find_movies(tokens, limit=SEARCH_CANDIDATES)
+        
+        if len(movies) < SEARCH_LIMIT:
+            movies += await self.storage.find_movies(
+                tokens,
+                prefix=True,
+                exclude_ids=[m["_id"] for m in movies],
+                limit=SEARCH_CANDIDATES - len(movies)
+            )
+        
+        if not movies:
+            return await self._fuzzy_search(query)
         
-        cursor = self.movies.find({
-            "$or": [
-                {"code": {"$regex": query.replace(" ", "_"), "$options": "i"}},
-                {"title": {"$regex": query, "$options": "i"}},
-                {"code": {"$regex": query, "$options": "i"}}
-            ]
-        }).limit(10)
-        return await cursor.to_list(length=10)
+        code = "_".join(tokens)
+        
+        def rank(movie):
+            movie_tokens = movie.get("search_tokens", [])
+            return (
+                movie.get("code") != code,
+                -sum(t in movie_tokens for t in tokens),
+                movie_tokens[:len(tokens)] != tokens,
+                len(movie_tokens)
+            )
+        
+        movies.sort(key=rank)
+        for movie in movies:
+            movie.pop("search_tokens", None)
+        return movies[:SEARCH_LIMIT]
+    
+    async def _fuzzy_search(self, query: str) -> list:
+        """Typo tolerant fallback served from the in-memory index"""
+        codes = self.search_index.search(query, SEARCH_LIMIT)
+        if not codes:
+            return []
+        
+        movies = await self.storage.get_movies(codes)
+        order = {code: i for i, code in enumerate(codes)}
+        movies.sort(key=lambda m: order.get(m["code"], SEARCH_LIMIT))
+        return movies
     
     async def delete_movie(self, code: str) -> bool:
-        result = await self.movies.delete_one({"code": code.lower().strip()})
-        return result.deleted_count > 0
+        code = code.lower().strip()
+        movie = await self.storage.delete_movie(code)
+        self.invalidate_movie(code)
+        if movie:
+            self.search_index.remove(code)
+            await self.file_registry.adjust(removed=movie_refs(movie))
+            return True
+        return False
+    
+    async def iter_movies(self):
+        """Stream every movie without internal fields"""
+        async for movie in self.storage.iter_movies():
+            yield movie
+    
+    def _link_files(self, movie: dict) -> list:
+        """Swap embedded file_ids for registry references, returns the files to register"""
+        groups = [movie.get("qualities") or {}]
+        groups += [p.get("qualities") or {} for p in (movie.get("parts_data") or {}).values()]
+        
+        files = []
+        for qualities in groups:
+            for quality, entry in qualities.items():
+                unique_id = entry.get("file_id") and unique_id_for(entry["file_id"])
+                if not unique_id:
+                    continue
+                files.append(({
+                    "file_id": entry["file_id"],
+                    "file_unique_id": unique_id,
+                    "file_size": entry.get("file_size", 0),
+                    "mime_type": entry.get("mime_type", ""),
+                    "duration": entry.get("duration", 0)
+                }, None))
+                qualities[quality] = {"file": unique_id, "size": entry.get("size", "")}
+        return files
+    
+    async def _movie_refs(self, codes) -> dict:
+        """code -> file references currently stored for those movies"""
+        return {movie["code"]: movie for movie in await self.storage.get_movies(list(codes))}
+    
+    async def bulk_upsert_movies(self, movies: list, ordered: bool = False) -> tuple:
+        """Upsert validated movies by code, returns (written, [(index, error)])"""
+        files = []
+        for movie in movies:
+            files += self._link_files(movie)
+        await self.file_registry.register_many(files)
+        before = await self._movie_refs(m["code"] for m in movies)
+        
+        for movie in movies:
+            movie["search_tokens"] = self._movie_tokens(movie)
+        written, failed = await self.storage.upsert_movies(movies, ordered)
+        
+        failed_indexes = {index for index, _ in failed}
+        if ordered and failed:
+            # Nothing after the first error was written
+            failed_indexes |= set(range(min(failed_indexes), len(movies)))
+        
+        added, removed = Counter(), Counter()
+        for index, movie in enumerate(movies):
+            movie.pop("search_tokens", None)
+            self.invalidate_movie(movie["code"])
+            if index not in failed_indexes:
+                self.search_index.add(movie)
+                # $set replaces qualities, parts_data only when the import has it
+                old = before.get(movie["code"], {})
+                added += movie_refs({**old, **movie})
+                removed += movie_refs(old)
+                before[movie["code"]] = {**old, **movie}
+        await self.file_registry.adjust(added, removed)
+        return written, failed
+    
+    @staticmethod
+    def _file_entry(media: dict) -> dict:
+        return {"file": media["file_unique_id"], "size": format_size(media["file_size"])}
+    
+    def _file_added(self, code: str, title: str, part: int = None):
+        self.invalidate_movie(code)
+        if code not in self.search_index.movies:
+            self.search_index.add({"code": code, "title": title, "parts": part or 1})
+    
+    async def add_file(self, code: str, title: str, quality: str, media: dict, part: int = None, source: dict = None) -> dict:
+        """
+        Add one quality file in a single atomic round trip
+        Returns the movie as it was before (None if it was just created)
+        """
+        code = code.lower().strip()
+        unique_id = await self.file_registry.register(media, source)
+        before = await self.storage.add_file(
+            code, title, quality, self._file_entry(media), part,
+            self._movie_tokens({"code": code, "title": title})
+        )
+        self._file_added(code, title, part)
+        
+        old = quality_entry(before, quality, part).get("file")
+        if old != unique_id:
+            await self.file_registry.adjust(Counter([unique_id]), Counter([old] if old else []))
+        return before
     
-    async def get_all_movies(self) -> list:
-        cursor = self.movies.find({})
-        return await cursor.to_list(length=1000)
+    async def remove_quality(self, code: str, quality: str) -> dict:
+        """Unset one main quality, returns the updated movie or None if absent"""
+        code = code.lower().strip()
+        movie = await self.storage.remove_quality(code, quality)
+        self.invalidate_movie(code)
+        if not movie:
+            return None
+        
+        removed = movie["qualities"].pop(quality)
+        if removed.get("file"):
+            await self.file_registry.adjust(removed=Counter([removed["file"]]))
+        return movie
+    
+    async def bulk_add_files(self, files: list) -> int:
+        """
+        Add many files in one batched write
+        Each item: {"code", "title", "part", "quality", "media": {...}, "source": {...}}
+        """
+        if not files:
+            return 0
+        
+        writes = []
+        slots = {}    # (code, part, quality) -> item, the last item for a slot wins
+        for item in files:
+            part = item.get("part", 1) if item.get("part", 1) > 1 else None
+            writes.append((
+                item["code"], item["title"], item["quality"], self._file_entry(item["media"]), part,
+                self._movie_tokens(item)
+            ))
+            slots[(item["code"], part, item["quality"])] = item
+        
+        await self.file_registry.register_many([(item["media"], item.get("source")) for item in slots.values()])
+        before = await self._movie_refs(item["code"] for item in files)
+        
+        written = await self.storage.add_files(writes)
+        
+        added, removed = Counter(), Counter()
+        for (code, part, quality), item in slots.items():
+            unique_id = item["media"]["file_unique_id"]
+            old = quality_entry(before.get(code), quality, part).get("file")
+            if old != unique_id:
+                added[unique_id] += 1
+                if old:
+                    removed[old] += 1
+        await self.file_registry.adjust(added, removed)
+        
+        for item in files:
+            self._file_added(item["code"], item["title"], item.get("part", 1))
+        return written
+    
+    async def list_movies(self, after_id=None, before_id=None, prefix: str = "", limit: int = 20) -> tuple:
+        """One page of movies in _id order (code order under a prefix), returns (movies, has_more)"""
+        return await self.storage.list_movies(after_id, before_id, prefix, limit)
     
     # User operations
     async def add_user(self, user_id: int, username: str = None):
-        await self.users.update_one(
-            {"user_id": user_id},
-            {"$set": {"user_id": user_id, "username": username}},
-            upsert=True
-        )
+        # Written in batches by the registry, known users cost nothing
+        self.user_registry.touch(user_id, username)
     
     async def get_user_count(self) -> int:
-        return await self.users.count_documents({})
+        return await self.storage.user_count()
+    
+    async def iter_users(self, after_id=None):
+        """Stream reachable users in _id order, starting after after_id"""
+        async for user in self.storage.iter_users(after_id):
+            yield user
+    
+    async def mark_users_blocked(self, user_ids: list):
+        await self.storage.mark_users_blocked(user_ids)
+        # Forget them so their next message is written and clears the flag
+        for user_id in user_ids:
+            self.user_registry.forget(user_id)
+    
+    # Channel indexer operations
+    async def get_index_state(self, channel_id: int) -> dict:
+        return await self.storage.get_index_state(channel_id) or {"_id": channel_id, "last_message_id": 0}
+    
+    async def set_index_state(self, channel_id: int, fields: dict):
+        await self.storage.set_index_state(channel_id, fields)
+    
+    # Broadcast operations
+    async def create_broadcast(self, job: dict):
+        return await self.storage.create_broadcast(job)
+    
+    async def update_broadcast(self, broadcast_id, fields: dict):
+        await self.storage.update_broadcast(broadcast_id, fields)
     
-    async def get_all_users(self) -> list:
-        cursor = self.users.find({})
-        return await cursor.to_list(length=100000)
+    async def get_running_broadcasts(self) -> list:
+        return await self.storage.get_running_broadcasts()
+    
+    # Delivery queue operations
+    async def save_delivery(self, delivery: dict):
+        await self.storage.save_delivery(delivery)
+    
+    async def get_delivery(self, token: str) -> dict:
+        return await self.storage.get_delivery(token)
+    
+    async def claim_delivery(self, token: str, lease: float) -> dict:
+        """Take a due delivery for the next lease seconds, None if it is not due or taken"""
+        now = time.time()
+        return await self.storage.claim_delivery(token, now, now + lease)
+    
+    async def due_deliveries(self, limit: int) -> list:
+        return await self.storage.due_deliveries(time.time(), limit)
     
     # Token operations - Now includes quality
-    async def create_token(self, user_id: int, movie_code: str, part: int = 1, quality: str = "") -> str:
-        token = secrets.token_urlsafe(16)
-        await self.tokens.insert_one({
-            "token": token,
-            "user_id": user_id,
-            "movie_code": movie_code,
-            "part": part,
-            "quality": quality,
-            "created_at": time.time(),
-            "used": False
-        })
-        return token
+    async def create_token(self, user_id: int, movie_code: str, part: int = 1, quality: str = "", movie_id=None) -> str:
+        tokens = await self.create_tokens(user_id, movie_code, [(part, quality)], movie_id)
+        return tokens[(part, quality)]
     
-    async def verify_token(self, token: str, user_id: int) -> dict:
-        ten_min_ago = time.time() - 600
-        return await self.tokens.find_one_and_update(
-            {
-                "token": token,
+    async def create_tokens(self, user_id: int, movie_code: str, choices: list, movie_id=None) -> dict:
+        """Tokens for many (part, quality) choices, stored with a single write"""
+        tokens = {}
+        # Signed tokens need the movie _id, the code is too long for a start link
+        if Config.TOKEN_MODE == "signed" and isinstance(movie_id, ObjectId):
+            for part, quality in choices:
+                token = sign_token(self.token_secret, movie_id.binary, part, quality, user_id, Config.TOKEN_TTL)
+                if token:
+                    tokens[(part, quality)] = token
+        
+        now = time.time()
+        docs = []
+        for part, quality in choices:
+            if (part, quality) in tokens:
+                continue
+            tokens[(part, quality)] = secrets.token_urlsafe(16)
+            docs.append({
+                "token": tokens[(part, quality)],
                 "user_id": user_id,
-                "used": False,
-                "created_at": {"$gte": ten_min_ago}
-            },
-            {"$set": {"used": True}}
-        )
+                "movie_code": movie_code,
+                "part": part,
+                "quality": quality,
+                "created_at": now,
+                "expires_at": now + Config.TOKEN_TTL,
+                "used": False
+            })
+        if docs:
+            await self.storage.insert_tokens(docs)
+        return tokens
+    
+    def prefetch_tokens(self, user_id: int, movie: dict):
+        """Start minting tokens for every part and quality of a movie the user is browsing"""
+        key = (user_id, movie["code"])
+        if Config.TOKEN_ISSUE != "prefetch" or key in self.prefetched:
+            return
+        
+        choices = [
+            (part, quality)
+            for part in range(1, movie.get("parts", 1) + 1)
+            for quality in render.part_qualities(movie, part)
+        ]
+        if choices:
+            self.prefetched.set(key, asyncio.ensure_future(self._prefetch(user_id, movie, choices)))
+    
+    async def _prefetch(self, user_id: int, movie: dict, choices: list) -> dict:
+        try:
+            tokens = await self.create_tokens(user_id, movie["code"], choices, movie.get("_id"))
+            self.count("tokens_prefetched", len(tokens))
+            return tokens
+        except Exception as e:
+            logger.error(f"Token prefetch error: {e}")
+            return {}
+    
+    async def take_token(self, user_id: int, movie_code: str, part: int = 1, quality: str = "", movie_id=None) -> str:
+        """The prefetched token for this choice, or a new one"""
+        # Only tokens handed to the user count as issued, prefetched ones may never be shown
+        self.count("tokens_issued")
+        task = self.prefetched.get((user_id, movie_code))
+        if task is not None:
+            # Each token is handed out once, a second click gets a new one
+            token = (await asyncio.shield(task)).pop((part, quality), None)
+            if token:
+                return token
+        return await self.create_token(user_id, movie_code, part, quality, movie_id)
+    
+    async def verify_token(self, token: str, user_id: int) -> dict:
+        if is_signed_token(token):
+            return await self._verify_signed_token(token, user_id)
+        
+        valid_since = time.time() - Config.TOKEN_TTL
+        token_data = await self.storage.redeem_token(token, user_id, valid_since)
+        if token_data:
+            self.count("tokens_redeemed")
+        return token_data
+    
+    async def _verify_signed_token(self, token: str, user_id: int) -> dict:
+        data = read_token(self.token_secret, token)
+        if not data or data["user_id"] != user_id:
+            return None
+        
+        if not await self.spent_tokens.spend(data["key"], data["expires_at"]):
+            return None
+        
+        self.count("tokens_redeemed")
+        movie = await self.get_movie_by_id(ObjectId(data["movie_id"]))
+        return {
+            "token": token,
+            "user_id": user_id,
+            "movie_code": movie["code"] if movie else None,
+            "part": data["part"],
+            "quality": data["quality"]
+        }
     
     async def cleanup_tokens(self):
+        """Remove old tokens, including ones created before the TTL index"""
         one_hour_ago = time.time() - 3600
-        await self.tokens.delete_many({"created_at": {"$lt": one_hour_ago}})
+        await self.storage.delete_tokens(one_hour_ago)
+    
+    
+    # Stats operations
+    def count(self, event: str, amount: int = 1):
+        """Bump an hourly counter (kept in memory until the next flush)"""
+        self.counters[(event, int(time.time() // 3600))] += amount
+        metrics.EVENTS.labels(event=event).inc(amount)
+    
+    async def flush_counters(self):
+        if not self.counters:
+            return
+        
+        counters, self.counters = self.counters, Counter()
+        try:
+            await self.storage.add_counts(counters)
+        except Exception as e:
+            logger.error(f"Stats flush error: {e}")
+            self.counters.update(counters)
+    
+    async def _flush_stats_loop(self):
+        while True:
+            await asyncio.sleep(Config.STATS_FLUSH_INTERVAL)
+            await self.flush_counters()
+            try:
+                await self.storage.purge_expired()
+            except Exception as e:
+                logger.error(f"Purge error: {e}")
+    
+    async def get_event_count(self, event: str, hours: int = 24) -> int:
+        """Total of an hourly counter over the last `hours` hours"""
+        now = int(time.time() // 3600)
+        total = await self.storage.get_counts(event, list(range(now - hours + 1, now + 1)))
+        return total + sum(n for (e, hour), n in self.counters.items() if e == event and hour > now - hours)
+    
+    async def get_catalog_stats(self) -> dict:
+        """Movie, file and per-quality totals computed by the storage engine"""
+        return await self.storage.catalog_stats()
+    
+    async def get_active_user_count(self, hours: int = 24) -> int:
+        return await self.storage.active_user_count(time.time() - hours * 3600)
 
 
 # Global instance
@@ -1,9 +1,13 @@
+from handlers.ratelimit import register_ratelimit_handlers
 from handlers.admin import register_admin_handlers
 from handlers.user import register_user_handlers
 from handlers.callbacks import register_callback_handlers
+from handlers.channel import register_channel_handlers
 
 def register_all_handlers(app):
     """Register all handlers"""
+    register_ratelimit_handlers(app)
     register_admin_handlers(app)
     register_user_handlers(app)
-    register_callback_handlers(app)
\ No newline at end of file
+    register_callback_handlers(app)
+    register_channel_handlers(app)
\ No newline at end of file
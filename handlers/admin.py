@@ -1,18 +1,42 @@
 if __name__ == "__main__":
     exit("Run bot.py instead!")
 
+import asyncio
 import logging
+import os
+import tempfile
+import time
 from pyrogram import Client, filters
 from pyrogram.enums import ParseMode
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from bson import ObjectId
 from config import Config
 from database import db
-from helpers import normalize_name, check_subscription
+from helpers import (
+    normalize_name,
+    normalize_quality,
+    check_subscription,
+    extract_media,
+    message_source,
+    format_size,
+    QUALITY_OPTIONS
+)
+from utils.broadcast import start_broadcast, is_broadcasting
+from utils.catalog import export_catalog, import_catalog
+from utils.channel_indexer import start_scan, is_scanning
+from utils.metrics import timed
 
 logger = logging.getLogger(__name__)
 
-# Available quality options
-QUALITY_OPTIONS = ["360p", "480p", "720p", "1080p", "1440p", "2160p", "4K"]
+# /list page size
+LIST_PAGE_SIZE = 20
+
+# Bytes of callback data left for the /list prefix: Telegram allows 64 and
+# "list:n:<24 hex _id>:<page up to 6 digits>:" takes the rest
+LIST_PREFIX_BYTES = 64 - len("list:n:") - 24 - len(":999999:")
+
+# Keeps references to fire-and-forget admin jobs
+_background_tasks = set()
 
 
 def register_admin_handlers(app: Client):
@@ -43,18 +67,9 @@ def register_admin_handlers(app: Client):
             )
             return
         
-        replied = message.reply_to_message
-        file_id = None
-        file_size = 0
+        media = extract_media(message.reply_to_message)
         
-        if replied.video:
-            file_id = replied.video.file_id
-            file_size = replied.video.file_size or 0
-        elif replied.document:
-            file_id = replied.document.file_id
-            file_size = replied.document.file_size or 0
-        
-        if not file_id:
+        if not media:
             await message.reply_text("❌ Reply to a video or document file!")
             return
         
@@ -87,10 +102,8 @@ def register_admin_handlers(app: Client):
             return
         
         # Validate quality
-        quality = quality.upper() if quality.upper() == "4K" else quality.lower()
-        valid_qualities = [q.lower() for q in QUALITY_OPTIONS]
-        
-        if quality.lower() not in valid_qualities and quality != "4K":
+        valid_quality = normalize_quality(quality)
+        if not valid_quality:
             await message.reply_text(
                 f"❌ **Invalid quality:** `{quality}`\n\n"
                 f"**Available:** {', '.join(QUALITY_OPTIONS)}",
@@ -102,25 +115,19 @@ def register_admin_handlers(app: Client):
             await message.reply_text("❌ Movie title cannot be empty!")
             return
         
+        quality = valid_quality
+        
         # Generate code from title (lowercase, spaces to underscores)
         code = normalize_name(title).replace(" ", "_")
         
-        # Format file size
-        size_mb = round(file_size / (1024 * 1024), 2) if file_size else 0
-        size_text = f"{size_mb} MB" if size_mb < 1024 else f"{round(size_mb/1024, 2)} GB"
+        size_text = format_size(media["file_size"])
         
-        # Check if movie exists
-        existing = await db.get_movie(code)
+        existing = await db.add_file(code, title, quality, media, source=message_source(message.reply_to_message))
         
         if existing:
-            # Add quality to existing movie
+            # Quality added to existing movie
             qualities = existing.get("qualities", {})
-            qualities[quality] = {
-                "file_id": file_id,
-                "size": size_text
-            }
-            existing["qualities"] = qualities
-            await db.add_movie(existing)
+            qualities[quality] = {"size": size_text}
             
             available = ", ".join(qualities.keys())
             await message.reply_text(
@@ -132,20 +139,6 @@ def register_admin_handlers(app: Client):
                 parse_mode=ParseMode.MARKDOWN
             )
         else:
-            # Create new movie
-            movie_data = {
-                "code": code,
-                "title": title,
-                "qualities": {
-                    quality: {
-                        "file_id": file_id,
-                        "size": size_text
-                    }
-                },
-                "parts": 1
-            }
-            await db.add_movie(movie_data)
-            
             await message.reply_text(
                 f"✅ **Movie Added!**\n\n"
                 f"📽️ **Title:** {title}\n"
@@ -179,18 +172,9 @@ def register_admin_handlers(app: Client):
             )
             return
         
-        replied = message.reply_to_message
-        file_id = None
-        file_size = 0
+        media = extract_media(message.reply_to_message)
         
-        if replied.video:
-            file_id = replied.video.file_id
-            file_size = replied.video.file_size or 0
-        elif replied.document:
-            file_id = replied.document.file_id
-            file_size = replied.document.file_size or 0
-        
-        if not file_id:
+        if not media:
             await message.reply_text("❌ Reply to a video or document file!")
             return
         
@@ -216,11 +200,10 @@ def register_admin_handlers(app: Client):
             return
         
         quality = parts[2].strip().lower()
-        quality = quality.upper() if quality.upper() == "4K" else quality.lower()
         
         # Validate quality
-        valid_qualities = [q.lower() for q in QUALITY_OPTIONS]
-        if quality.lower() not in valid_qualities and quality != "4K":
+        valid_quality = normalize_quality(quality)
+        if not valid_quality:
             await message.reply_text(
                 f"❌ **Invalid quality:** `{quality}`\n\n"
                 f"**Available:** {', '.join(QUALITY_OPTIONS)}",
@@ -228,44 +211,24 @@ def register_admin_handlers(app: Client):
             )
             return
         
-        code = normalize_name(title).replace(" ", "_")
-        
-        # Format file size
-        size_mb = round(file_size / (1024 * 1024), 2) if file_size else 0
-        size_text = f"{size_mb} MB" if size_mb < 1024 else f"{round(size_mb/1024, 2)} GB"
+        quality = valid_quality
         
-        # Get or create movie
-        movie = await db.get_movie(code)
+        code = normalize_name(title).replace(" ", "_")
         
-        if not movie:
-            movie = {
-                "code": code,
-                "title": title,
-                "qualities": {},
-                "parts": part_num,
-                "parts_data": {}
-            }
+        size_text = format_size(media["file_size"])
         
-        # Initialize parts_data if not exists
-        if "parts_data" not in movie:
-            movie["parts_data"] = {}
+        movie = await db.add_file(
+            code, title, quality, media,
+            part=part_num,
+            source=message_source(message.reply_to_message)
+        ) or {}
         
-        # Add part with quality
         part_key = f"part_{part_num}"
-        if part_key not in movie["parts_data"]:
-            movie["parts_data"][part_key] = {"qualities": {}}
-        
-        movie["parts_data"][part_key]["qualities"][quality] = {
-            "file_id": file_id,
-            "size": size_text
-        }
+        part_qualities = movie.get("parts_data", {}).get(part_key, {}).get("qualities", {})
+        part_qualities[quality] = {"size": size_text}
         
-        # Update parts count
         movie["parts"] = max(movie.get("parts", 1), part_num)
-        
-        await db.add_movie(movie)
-        
-        available_qualities = ", ".join(movie["parts_data"][part_key]["qualities"].keys())
+        available_qualities = ", ".join(part_qualities.keys())
         
         await message.reply_text(
             f"✅ **Part {part_num} Added!**\n\n"
@@ -307,30 +270,26 @@ def register_admin_handlers(app: Client):
             quality = quality.upper() if quality.upper() == "4K" else quality
             
             code = normalize_name(title).replace(" ", "_")
-            movie = await db.get_movie(code)
+            movie = await db.remove_quality(code, quality)
             
             if not movie:
-                await message.reply_text(f"❌ Movie `{title}` not found!", parse_mode=ParseMode.MARKDOWN)
+                if await db.get_movie(code):
+                    await message.reply_text(f"❌ Quality `{quality}` not found!", parse_mode=ParseMode.MARKDOWN)
+                else:
+                    await message.reply_text(f"❌ Movie `{title}` not found!", parse_mode=ParseMode.MARKDOWN)
                 return
             
             qualities = movie.get("qualities", {})
-            if quality in qualities:
-                del qualities[quality]
-                movie["qualities"] = qualities
-                
-                if not qualities:
-                    # No qualities left, delete movie
-                    await db.delete_movie(code)
-                    await message.reply_text(f"✅ `{title}` deleted (no qualities left)!", parse_mode=ParseMode.MARKDOWN)
-                else:
-                    await db.add_movie(movie)
-                    await message.reply_text(
-                        f"✅ **Quality `{quality}` removed from `{title}`!**\n\n"
-                        f"Remaining: {', '.join(qualities.keys())}",
-                        parse_mode=ParseMode.MARKDOWN
-                    )
+            if not qualities:
+                # No qualities left, delete movie
+                await db.delete_movie(code)
+                await message.reply_text(f"✅ `{title}` deleted (no qualities left)!", parse_mode=ParseMode.MARKDOWN)
             else:
-                await message.reply_text(f"❌ Quality `{quality}` not found!", parse_mode=ParseMode.MARKDOWN)
+                await message.reply_text(
+                    f"✅ **Quality `{quality}` removed from `{title}`!**\n\n"
+                    f"Remaining: {', '.join(qualities.keys())}",
+                    parse_mode=ParseMode.MARKDOWN
+                )
         else:
             # Delete entire movie
             code = normalize_name(text).replace(" ", "_")
@@ -344,45 +303,68 @@ def register_admin_handlers(app: Client):
     # ============ /list COMMAND ============
     @app.on_message(filters.command("list") & filters.private & filters.user(Config.ADMIN_ID))
     async def list_movies(bot: Client, message: Message):
-        movies = await db.get_all_movies()
+        """
+        List movies page by page
+        Usage: /list [name prefix]
+        """
+        prefix = normalize_name(message.text.replace("/list", "", 1)).replace(" ", "_")
+        text, keyboard = await render_movie_list(trim_list_prefix(prefix))
         
-        if not movies:
-            await message.reply_text("📭 No movies yet!")
+        if not text:
+            await message.reply_text("📭 No movies found!" if prefix else "📭 No movies yet!")
             return
         
-        text = "📽️ **All Movies:**\n\n"
-        
-        for i, m in enumerate(movies[:50], 1):
-            qualities = m.get("qualities", {})
-            quality_list = ", ".join(qualities.keys()) if qualities else "No qualities"
-            parts = m.get("parts", 1)
-            parts_text = f" ({parts} parts)" if parts > 1 else ""
-            
-            text += f"{i}. **{m['title']}**{parts_text}\n"
-            text += f"   Code: `{m['code']}`\n"
-            text += f"   Qualities: {quality_list}\n\n"
-        
-        if len(movies) > 50:
-            text += f"\n_...and {len(movies) - 50} more_"
+        await message.reply_text(text, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+    
+    
+    @app.on_callback_query(filters.regex(r"^list:") & filters.user(Config.ADMIN_ID))
+    @timed
+    async def list_page_cb(bot: Client, query: CallbackQuery):
+        # list:<n|p>:<cursor _id>:<page>:<prefix>
+        _, direction, cursor, page, prefix = query.data.split(":", 4)
+        cursor = ObjectId(cursor)
+        prefix = trim_list_prefix(prefix)
+        
+        if direction == "n":
+            text, keyboard = await render_movie_list(prefix, after_id=cursor, page=int(page))
+        else:
+            text, keyboard = await render_movie_list(prefix, before_id=cursor, page=int(page))
         
-        await message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+        if text:
+            await query.message.edit_text(text, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+        await query.answer()
     
     
     # ============ /stats COMMAND ============
     @app.on_message(filters.command("stats") & filters.private & filters.user(Config.ADMIN_ID))
     async def stats(bot: Client, message: Message):
         users = await db.get_user_count()
-        movies = await db.get_all_movies()
-        
-        total_qualities = 0
-        for m in movies:
-            total_qualities += len(m.get("qualities", {}))
+        active = await db.get_active_user_count()
+        catalog = await db.get_catalog_stats()
+        issued = await db.get_event_count("tokens_issued")
+        prefetched = await db.get_event_count("tokens_prefetched")
+        redeemed = await db.get_event_count("tokens_redeemed")
+        files, stale = await db.file_registry.get_counts()
+        queued = await db.get_event_count("deliveries_queued")
+        retried = await db.get_event_count("deliveries_retried")
+        undelivered = await db.get_event_count("deliveries_failed")
+        
+        quality_text = "\n".join(f"   • {q}: {n}" for q, n in catalog["qualities"])
+        redeem_rate = f" ({redeemed / issued:.0%})" if issued else ""
+        cache = db.movie_cache
         
         await message.reply_text(
             f"📊 **Bot Statistics**\n\n"
             f"👥 Users: {users}\n"
-            f"🎬 Movies: {len(movies)}\n"
-            f"🎞️ Total Files: {total_qualities}",
+            f"🟢 Active (24h): {active}\n"
+            f"🎬 Movies: {catalog['movies']}\n"
+            f"🎞️ Total Files: {catalog['files']}\n"
+            f"{quality_text}\n"
+            f"🗂️ Unique Files: {files} ({stale} stale)\n\n"
+            f"🎟️ Tokens (24h): {issued} issued, {redeemed} redeemed{redeem_rate}, {prefetched} prefetched\n"
+            f"📦 Retried Deliveries (24h): {queued} queued, {retried} sent, {undelivered} failed\n\n"
+            f"🗃️ Movie Cache: {len(cache)} cached, "
+            f"{cache.hits} hits / {cache.misses} misses ({cache.hit_ratio:.0%})",
             parse_mode=ParseMode.MARKDOWN
         )
     
@@ -394,26 +376,135 @@ def register_admin_handlers(app: Client):
             await message.reply_text("❌ Reply to a message to broadcast!")
             return
         
-        users = await db.get_all_users()
-        sent, failed = 0, 0
+        if is_broadcasting():
+            await message.reply_text("❌ A broadcast is already running!")
+            return
         
         status = await message.reply_text("📢 Broadcasting...")
+        await start_broadcast(bot, message.reply_to_message, status)
+    
+    
+    # ============ /export COMMAND ============
+    @app.on_message(filters.command("export") & filters.private & filters.user(Config.ADMIN_ID))
+    async def export_cmd(bot: Client, message: Message):
+        """Send the whole catalog as an NDJSON file"""
+        status = await message.reply_text("📤 Exporting catalog...")
+        progress = throttled_progress(status)
+        
+        async def on_progress(count):
+            await progress(f"📤 Exporting... {count} movies")
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "catalog.ndjson")
+            with open(path, "w", encoding="utf-8") as fp:
+                count = await export_catalog(fp, on_progress)
+            
+            await message.reply_document(
+                path,
+                caption=f"✅ **Exported {count} movies**",
+                parse_mode=ParseMode.MARKDOWN
+            )
+        await status.delete()
+    
+    
+    # ============ /import COMMAND ============
+    @app.on_message(filters.command("import") & filters.private & filters.user(Config.ADMIN_ID))
+    async def import_cmd(bot: Client, message: Message):
+        """
+        Bulk import movies from an NDJSON file
+        Usage: reply to the file with /import (or /import ordered)
+        """
+        replied = message.reply_to_message
+        if not replied or not replied.document:
+            await message.reply_text(
+                "📥 **How to Import:**\n\n"
+                "1️⃣ Send an NDJSON file (one movie per line, same format as /export)\n"
+                "2️⃣ Reply to it with `/import`\n\n"
+                "Use `/import ordered` to stop at the first write error.",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            return
         
-        for user in users:
-            try:
-                await message.reply_to_message.copy(user["user_id"])
-                sent += 1
-            except:
-                failed += 1
+        ordered = "ordered" in message.text.lower()
+        status = await message.reply_text("📥 Importing catalog...")
+        progress = throttled_progress(status)
+        
+        async def on_progress(result):
+            await progress(
+                f"📥 Importing...\n\n"
+                f"Read: {result['read']}\n"
+                f"Written: {result['written']}\n"
+                f"Invalid: {result['invalid']}"
+            )
         
-        await status.edit_text(f"📢 **Done!**\n\n✅ Sent: {sent}\n❌ Failed: {failed}", parse_mode=ParseMode.MARKDOWN)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = await replied.download(file_name=os.path.join(tmp, "catalog.ndjson"))
+            with open(path, encoding="utf-8") as fp:
+                result = await import_catalog(fp, ordered=ordered, progress=on_progress)
+        
+        errors = "\n".join(f"`{e}`" for e in result["errors"])
+        await status.edit_text(
+            f"📥 **Import Done!**\n\n"
+            f"📄 Read: {result['read']}\n"
+            f"✅ Written: {result['written']}\n"
+            f"❌ Invalid: {result['invalid']}"
+            + (f"\n\n{errors}" if errors else ""),
+            parse_mode=ParseMode.MARKDOWN
+        )
+    
+    
+    # ============ /index COMMAND ============
+    @app.on_message(filters.command("index") & filters.private & filters.user(Config.ADMIN_ID))
+    async def index_cmd(bot: Client, message: Message):
+        """
+        Catalog files from the backup channel history
+        Usage: /index (continue where the last scan stopped)
+               /index 0 (scan from the first message)
+        """
+        if not Config.BACKUP_CHANNEL_ID:
+            await message.reply_text("❌ BACKUP_CHANNEL_ID is not set!")
+            return
+        
+        if is_scanning():
+            await message.reply_text("❌ An index scan is already running!")
+            return
+        
+        args = message.text.split()
+        start_id = int(args[1]) if len(args) > 1 and args[1].isdigit() else None
+        
+        status = await message.reply_text("🔎 Indexing channel...")
+        progress = throttled_progress(status, interval=5)
+        
+        def report(result, title):
+            return (
+                f"{title}\n\n"
+                f"📨 Scanned: {result['scanned']}\n"
+                f"✅ Indexed: {result['indexed']}\n"
+                f"⚠️ Skipped: {result['skipped']}\n"
+                f"🔖 Last message: {result['last_message_id']}"
+            )
+        
+        async def on_progress(result):
+            await progress(report(result, "🔎 **Indexing channel...**"))
+        
+        async def run():
+            try:
+                result = await start_scan(bot, Config.BACKUP_CHANNEL_ID, start_id, on_progress)
+                await status.edit_text(report(result, "🔎 **Index Done!**"), parse_mode=ParseMode.MARKDOWN)
+            except Exception as e:
+                logger.error(f"Index scan error: {e}")
+                await status.edit_text(f"❌ Index scan stopped: `{e}`", parse_mode=ParseMode.MARKDOWN)
+        
+        task = asyncio.create_task(run())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
     
     
     # ============ /checksub COMMAND ============
     @app.on_message(filters.command("checksub") & filters.private & filters.user(Config.ADMIN_ID))
     async def checksub(bot: Client, message: Message):
         user_id = message.from_user.id
-        is_sub = await check_subscription(bot, user_id)
+        is_sub = await check_subscription(bot, user_id, use_cache=False)
         
         await message.reply_text(
             f"🔍 **Debug Info**\n\n"
@@ -421,3 +512,71 @@ def register_admin_handlers(app: Client):
             f"Your Status: {'✅ Subscribed' if is_sub else '❌ Not Subscribed'}",
             parse_mode=ParseMode.MARKDOWN
         )
+
+
+# ============ HELPER FUNCTIONS ============
+
+def throttled_progress(status: Message, interval: float = 3):
+    """Progress updater that edits `status` at most every `interval` seconds"""
+    last = 0.0
+    
+    async def update(text: str):
+        nonlocal last
+        if time.monotonic() - last < interval:
+            return
+        last = time.monotonic()
+        try:
+            await status.edit_text(text, parse_mode=ParseMode.MARKDOWN)
+        except Exception:
+            pass
+    
+    return update
+
+
+def trim_list_prefix(prefix: str) -> str:
+    """Cut a /list prefix to the bytes its page buttons have room for, never inside a character"""
+    return prefix.encode("utf-8")[:LIST_PREFIX_BYTES].decode("utf-8", errors="ignore")
+
+
+async def render_movie_list(prefix: str, after_id=None, before_id=None, page: int = 1) -> tuple:
+    """Build one /list page, returns (text, keyboard) or (None, None) if empty"""
+    movies, has_more = await db.list_movies(
+        after_id=after_id,
+        before_id=before_id,
+        prefix=prefix,
+        limit=LIST_PAGE_SIZE
+    )
+    
+    if not movies:
+        return None, None
+    
+    title = f"📽️ **Movies starting with** `{prefix}`**:**" if prefix else "📽️ **All Movies:**"
+    text = f"{title}\n\n"
+    
+    start = (page - 1) * LIST_PAGE_SIZE + 1
+    for i, m in enumerate(movies, start):
+        qualities = m.get("qualities", {})
+        quality_list = ", ".join(qualities.keys()) if qualities else "No qualities"
+        parts = m.get("parts", 1)
+        parts_text = f" ({parts} parts)" if parts > 1 else ""
+        
+        text += f"{i}. **{m['title']}**{parts_text}\n"
+        text += f"   Code: `{m['code']}`\n"
+        text += f"   Qualities: {quality_list}\n\n"
+    
+    if before_id is not None:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after_id is not None, has_more
+    
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(
+            "◀️ Prev", callback_data=f"list:p:{movies[0]['_id']}:{page - 1}:{prefix}"
+        ))
+    if has_next:
+        buttons.append(InlineKeyboardButton(
+            "Next ▶️", callback_data=f"list:n:{movies[-1]['_id']}:{page + 1}:{prefix}"
+        ))
+    
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
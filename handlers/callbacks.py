@@ -8,6 +8,8 @@ from pyrogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardBu
 from config import Config
 from database import db
 from helpers import check_subscription
+from utils.metrics import timed
+from utils.render import parts_screen, quality_screen, part_qualities
 from utils.monetize import create_ad_link, is_monetization_enabled
 
 logger = logging.getLogger(__name__)
@@ -17,6 +19,7 @@ def register_callback_handlers(app: Client):
     
     # ============ MOVIE SELECTION ============
     @app.on_callback_query(filters.regex(r"^movie:"))
+    @timed
     async def movie_cb(bot: Client, query: CallbackQuery):
         code = query.data.split(":")[1]
         movie = await db.get_movie(code)
@@ -26,19 +29,9 @@ def register_callback_handlers(app: Client):
             return
         
         if movie.get("parts", 1) > 1:
-            buttons = []
-            for i in range(1, movie["parts"] + 1):
-                buttons.append(InlineKeyboardButton(f"📦 Part {i}", callback_data=f"part:{code}:{i}"))
-            
-            keyboard = [buttons[i:i+3] for i in range(0, len(buttons), 3)]
-            
-            await query.message.edit_text(
-                f"🎬 **{movie['title']}**\n\n"
-                f"This movie has {movie['parts']} parts.\n"
-                f"Select one:",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode=ParseMode.MARKDOWN
-            )
+            db.prefetch_tokens(query.from_user.id, movie)
+            text, markup = parts_screen(movie)
+            await query.message.edit_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
         else:
             await show_quality_buttons(query, movie, 1)
         
@@ -47,6 +40,7 @@ def register_callback_handlers(app: Client):
     
     # ============ PART SELECTION ============
     @app.on_callback_query(filters.regex(r"^part:"))
+    @timed
     async def part_cb(bot: Client, query: CallbackQuery):
         _, code, part = query.data.split(":")
         part = int(part)
@@ -62,6 +56,7 @@ def register_callback_handlers(app: Client):
     
     # ============ QUALITY SELECTION ============
     @app.on_callback_query(filters.regex(r"^quality:"))
+    @timed
     async def quality_cb(bot: Client, query: CallbackQuery):
         user_id = query.from_user.id
         parts = query.data.split(":")
@@ -79,15 +74,11 @@ def register_callback_handlers(app: Client):
             await query.answer("❌ Not found!", show_alert=True)
             return
         
-        # Create token
-        token = await db.create_token(user_id, code, part, quality)
+        # Create token (or take the one minted when the screen was shown)
+        token = await db.take_token(user_id, code, part, quality, movie_id=movie.get("_id"))
         
         # Get file size
-        if part > 1 and "parts_data" in movie:
-            part_key = f"part_{part}"
-            size = movie["parts_data"].get(part_key, {}).get("qualities", {}).get(quality, {}).get("size", "")
-        else:
-            size = movie.get("qualities", {}).get(quality, {}).get("size", "")
+        size = part_qualities(movie, part).get(quality, {}).get("size", "")
         
         size_text = f"\n📁 Size: {size}" if size else ""
         
@@ -131,6 +122,7 @@ def register_callback_handlers(app: Client):
     
     # ============ BACK TO QUALITY SELECTION ============
     @app.on_callback_query(filters.regex(r"^backq:"))
+    @timed
     async def back_quality_cb(bot: Client, query: CallbackQuery):
         _, code, part = query.data.split(":")
         part = int(part)
@@ -148,35 +140,15 @@ def register_callback_handlers(app: Client):
 
 async def show_quality_buttons(query: CallbackQuery, movie: dict, part: int):
     """Show quality selection buttons"""
+    screen = quality_screen(movie, part, back=True)
     
-    if part > 1 and "parts_data" in movie:
-        part_key = f"part_{part}"
-        qualities = movie["parts_data"].get(part_key, {}).get("qualities", {})
-    else:
-        qualities = movie.get("qualities", {})
-    
-    if not qualities:
+    if not screen:
         await query.message.edit_text(
             f"❌ No files available for **{movie['title']}** Part {part}",
             parse_mode=ParseMode.MARKDOWN
         )
         return
     
-    buttons = []
-    for quality, data in qualities.items():
-        size = data.get("size", "")
-        btn_text = f"🎞️ {quality}" + (f" ({size})" if size else "")
-        buttons.append([
-            InlineKeyboardButton(btn_text, callback_data=f"quality:{movie['code']}:{part}:{quality}")
-        ])
-    
-    if movie.get("parts", 1) > 1:
-        buttons.append([InlineKeyboardButton("◀️ Back to Parts", callback_data=f"movie:{movie['code']}")])
-    
-    await query.message.edit_text(
-        f"🎬 **{movie['title']}**\n\n"
-        f"📦 Part: {part}\n\n"
-        f"Select quality:",
-        reply_markup=InlineKeyboardMarkup(buttons),
-        parse_mode=ParseMode.MARKDOWN
-    )
+    db.prefetch_tokens(query.from_user.id, movie)
+    text, markup = screen
+    await query.message.edit_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
@@ -0,0 +1,21 @@
+if __name__ == "__main__":
+    exit("Run bot.py instead!")
+
+import logging
+from pyrogram import Client, filters
+from pyrogram.types import Message
+from config import Config
+from utils.channel_indexer import live_indexer
+
+logger = logging.getLogger(__name__)
+
+
+def register_channel_handlers(app: Client):
+    
+    if not (Config.BACKUP_CHANNEL_ID and Config.AUTO_INDEX):
+        return
+    
+    # ============ NEW CHANNEL FILES ============
+    @app.on_message(filters.chat(Config.BACKUP_CHANNEL_ID) & (filters.video | filters.document))
+    async def channel_file(bot: Client, message: Message):
+        live_indexer.add(message)
@@ -0,0 +1,104 @@
+if __name__ == "__main__":
+    exit("Run bot.py instead!")
+
+import logging
+from pyrogram import Client, filters
+from pyrogram.enums import ParseMode
+from pyrogram.types import Message, CallbackQuery
+from config import Config
+from database import db
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# action -> (tokens refilled per second, burst)
+ACTION_LIMITS = {
+    "search": (1 / 3, 5),
+    "download": (1 / 5, 4),
+    "browse": (1, 10),
+    "command": (1 / 2, 5)
+}
+
+# Callback data prefix -> action
+CALLBACK_ACTIONS = {
+    "quality": "download",
+    "movie": "browse",
+    "part": "browse",
+    "backq": "browse"
+}
+
+# Users already told to slow down, a flood gets one reply instead of one per message
+_warned = TTLCache(maxsize=10000, ttl=10)
+
+
+def message_action(message: Message) -> str:
+    text = message.text or ""
+    if not text.startswith("/"):
+        return "search" if text else "command"
+    
+    # /start with a payload redeems a token or opens a movie
+    if text.startswith("/start ") and text.split(maxsplit=1)[1:]:
+        return "download"
+    return "command"
+
+
+async def is_allowed(user_id: int, action: str) -> bool:
+    rate, burst = ACTION_LIMITS[action]
+    try:
+        return await db.rate_limits.hit(f"{user_id}:{action}", rate, burst)
+    except Exception as e:
+        # Never lock users out because the shared store is unavailable
+        logger.error(f"Rate limit store error: {e}")
+        return True
+
+
+def should_warn(user_id: int, action: str) -> bool:
+    key = (user_id, action)
+    if key in _warned:
+        return False
+    _warned.set(key, True)
+    return True
+
+
+def register_ratelimit_handlers(app: Client):
+    if not Config.RATE_LIMIT:
+        return
+    
+    # Group -1 runs before every other handler and can stop the update there
+    
+    # ============ MESSAGES ============
+    @app.on_message(filters.private & filters.incoming & ~filters.user(Config.ADMIN_ID), group=-1)
+    async def limit_messages(bot: Client, message: Message):
+        if not message.from_user:
+            return
+        
+        user_id = message.from_user.id
+        action = message_action(message)
+        if await is_allowed(user_id, action):
+            return
+        
+        logger.info(f"Rate limited {user_id} ({action})")
+        if should_warn(user_id, action):
+            try:
+                await message.reply_text(
+                    "⏳ **Slow down!**\n\nToo many requests, please wait a few seconds.",
+                    parse_mode=ParseMode.MARKDOWN
+                )
+            except Exception as e:
+                logger.debug(f"Rate limit reply failed: {e}")
+        message.stop_propagation()
+    
+    
+    # ============ CALLBACKS ============
+    @app.on_callback_query(~filters.user(Config.ADMIN_ID), group=-1)
+    async def limit_callbacks(bot: Client, query: CallbackQuery):
+        action = CALLBACK_ACTIONS.get((query.data or "").split(":", 1)[0])
+        if not action or await is_allowed(query.from_user.id, action):
+            return
+        
+        logger.info(f"Rate limited {query.from_user.id} ({action})")
+        try:
+            await query.answer("⏳ Slow down! Please wait a few seconds.")
+        except Exception as e:
+            logger.debug(f"Rate limit answer failed: {e}")
+        query.stop_propagation()
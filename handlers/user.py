@@ -4,16 +4,21 @@ if __name__ == "__main__":
 import logging
 from pyrogram import Client, filters
 from pyrogram.enums import ParseMode
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.types import Message, ChatMemberUpdated, InlineKeyboardMarkup, InlineKeyboardButton
 from config import Config
 from database import db
 from helpers import (
     check_subscription,
+    invalidate_subscription,
     get_movie_info,
     encode_payload,
     decode_payload,
     normalize_name
 )
+from utils.delivery import delivery
+from utils.metrics import timed
+from utils.tracing import traced
+from utils.render import parts_screen, quality_screen, part_qualities
 from utils.monetize import create_ad_link, is_monetization_enabled
 
 logger = logging.getLogger(__name__)
@@ -23,6 +28,7 @@ def register_user_handlers(app: Client):
     
     # ============ /start COMMAND ============
     @app.on_message(filters.command("start") & filters.private)
+    @timed
     async def start_cmd(bot: Client, message: Message):
         user_id = message.from_user.id
         username = message.from_user.username
@@ -86,19 +92,9 @@ def register_user_handlers(app: Client):
         
         # Multi-part movie
         if movie.get("parts", 1) > 1:
-            buttons = []
-            for i in range(1, movie["parts"] + 1):
-                buttons.append(InlineKeyboardButton(f"📦 Part {i}", callback_data=f"part:{movie_code}:{i}"))
-            
-            keyboard = [buttons[i:i+3] for i in range(0, len(buttons), 3)]
-            
-            await message.reply_text(
-                f"🎬 **{movie['title']}**\n\n"
-                f"This movie has {movie['parts']} parts.\n"
-                f"Select one:",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode=ParseMode.MARKDOWN
-            )
+            db.prefetch_tokens(user_id, movie)
+            text, markup = parts_screen(movie)
+            await message.reply_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
             return
         
         # Single part - show quality selection
@@ -140,7 +136,10 @@ def register_user_handlers(app: Client):
                 "`/delete Movie Name | quality`\n"
                 "`/list` - List all movies\n"
                 "`/stats` - Statistics\n"
-                "`/broadcast` - Send to all"
+                "`/broadcast` - Send to all\n"
+                "`/export` - Download catalog\n"
+                "`/import` - Bulk import (reply to file)\n"
+                "`/index` - Index backup channel"
             )
         
         await message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
@@ -148,6 +147,7 @@ def register_user_handlers(app: Client):
     
     # ============ SEARCH (any text) ============
     @app.on_message(filters.text & filters.private)
+    @timed
     async def search_cmd(bot: Client, message: Message):
         text = message.text.strip()
         
@@ -199,10 +199,20 @@ def register_user_handlers(app: Client):
             reply_markup=InlineKeyboardMarkup(buttons),
             parse_mode=ParseMode.MARKDOWN
         )
+    
+    
+    # ============ CHANNEL MEMBERSHIP UPDATES ============
+    if Config.BACKUP_CHANNEL_ID:
+        @app.on_chat_member_updated(filters.chat(Config.BACKUP_CHANNEL_ID))
+        async def member_updated(bot: Client, update: ChatMemberUpdated):
+            member = update.new_chat_member or update.old_chat_member
+            if member and member.user:
+                invalidate_subscription(member.user.id)
 
 
 # ============ TOKEN VERIFICATION ============
 
+@traced
 async def handle_token_verification(bot: Client, message: Message, token: str, user_id: int):
     """Handle token verification from ad page and send file"""
     
@@ -218,6 +228,9 @@ async def handle_token_verification(bot: Client, message: Message, token: str, u
     token_data = await db.verify_token(token, user_id)
     
     if not token_data:
+        # A token whose delivery failed stays good for retrying it
+        if await delivery.retry(bot, token, user_id, status):
+            return
         await status.edit_text(
             "❌ **Link expired or already used!**\n\n"
             "Please search for the movie again and get a new link.",
@@ -225,83 +238,7 @@ async def handle_token_verification(bot: Client, message: Message, token: str, u
         )
         return
     
-    # Get movie details from token
-    movie_code = token_data.get("movie_code")
-    part = token_data.get("part", 1)
-    quality = token_data.get("quality", "")
-    
-    # Fetch movie from database
-    movie = await db.get_movie(movie_code)
-    
-    if not movie:
-        await status.edit_text("❌ **Movie not found!** It may have been removed.")
-        return
-    
-    # Get correct file_id based on part and quality
-    file_id = None
-    file_size = ""
-    
-    if part > 1 and "parts_data" in movie:
-        part_key = f"part_{part}"
-        if part_key in movie["parts_data"]:
-            qualities = movie["parts_data"][part_key].get("qualities", {})
-            if quality in qualities:
-                file_id = qualities[quality].get("file_id")
-                file_size = qualities[quality].get("size", "")
-    else:
-        qualities = movie.get("qualities", {})
-        if quality in qualities:
-            file_id = qualities[quality].get("file_id")
-            file_size = qualities[quality].get("size", "")
-    
-    if not file_id:
-        await status.edit_text("❌ **File not available!** Please try searching again.")
-        return
-    
-    # Update status and send file
-    await status.edit_text("📤 **Sending your file...**")
-    
-    try:
-        caption = (
-            f"🎬 **{movie['title']}**\n\n"
-            f"📦 Part: {part}\n"
-            f"🎞️ Quality: {quality}\n"
-            f"📁 Size: {file_size}\n\n"
-            f"✅ Enjoy your movie!"
-        )
-        
-        # Send cached media (video/document)
-        await bot.send_cached_media(
-            chat_id=user_id,
-            file_id=file_id,
-            caption=caption,
-            parse_mode=ParseMode.MARKDOWN
-        )
-        
-        await status.delete()
-        logger.info(f"✅ File sent to {user_id}: {movie['title']} - {quality}")
-        
-    except Exception as e:
-        logger.error(f"❌ send_cached_media error: {e}")
-        
-        # Fallback: try sending as document
-        try:
-            await bot.send_document(
-                chat_id=user_id,
-                document=file_id,
-                caption=caption,
-                parse_mode=ParseMode.MARKDOWN
-            )
-            await status.delete()
-            logger.info(f"✅ File sent (document) to {user_id}")
-            
-        except Exception as e2:
-            logger.error(f"❌ Fallback error: {e2}")
-            await status.edit_text(
-                f"❌ **Error sending file!**\n\n"
-                f"Please try again or contact admin.",
-                parse_mode=ParseMode.MARKDOWN
-            )
+    await delivery.deliver(bot, token_data, status)
 
 
 # ============ HELPER FUNCTIONS ============
@@ -376,47 +313,26 @@ async def send_movie_card(bot: Client, message: Message, movie: dict):
 
 async def show_quality_selection(message: Message, movie: dict, part: int = 1):
     """Show quality selection buttons"""
+    screen = quality_screen(movie, part)
     
-    if part > 1 and "parts_data" in movie:
-        part_key = f"part_{part}"
-        qualities = movie["parts_data"].get(part_key, {}).get("qualities", {})
-    else:
-        qualities = movie.get("qualities", {})
-    
-    if not qualities:
+    if not screen:
         await message.reply_text("❌ No qualities available!")
         return
     
-    buttons = []
-    for quality, data in qualities.items():
-        size = data.get("size", "")
-        btn_text = f"🎞️ {quality}" + (f" ({size})" if size else "")
-        buttons.append([
-            InlineKeyboardButton(btn_text, callback_data=f"quality:{movie['code']}:{part}:{quality}")
-        ])
-    
-    await message.reply_text(
-        f"🎬 **{movie['title']}**\n\n"
-        f"📦 Part: {part}\n\n"
-        f"Select quality:",
-        reply_markup=InlineKeyboardMarkup(buttons),
-        parse_mode=ParseMode.MARKDOWN
-    )
+    db.prefetch_tokens(message.from_user.id, movie)
+    text, markup = screen
+    await message.reply_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
 
 
 async def generate_download_link(bot: Client, message: Message, movie: dict, part: int, quality: str):
     """Generate download link (through ad page if enabled)"""
     user_id = message.from_user.id
     
-    # Create token
-    token = await db.create_token(user_id, movie["code"], part, quality)
+    # Create token (or take the one minted when the screen was shown)
+    token = await db.take_token(user_id, movie["code"], part, quality, movie_id=movie.get("_id"))
     
     # Get file size
-    if part > 1 and "parts_data" in movie:
-        part_key = f"part_{part}"
-        size = movie["parts_data"].get(part_key, {}).get("qualities", {}).get(quality, {}).get("size", "")
-    else:
-        size = movie.get("qualities", {}).get(quality, {}).get("size", "")
+    size = part_qualities(movie, part).get(quality, {}).get("size", "")
     
     size_text = f"\n📁 Size: {size}" if size else ""
     
@@ -1,59 +1,138 @@
+import asyncio
 import logging
 import aiohttp
 import base64
 import re
 from config import Config
+from utils import metrics, tracing
+from utils.cache import TTLCache, MISSING
 
 logger = logging.getLogger(__name__)
 
+# Available quality options
+QUALITY_OPTIONS = ["360p", "480p", "720p", "1080p", "1440p", "2160p", "4K"]
+
+# Shared HTTP client (created lazily inside the running event loop)
+_session = None
+
+# Normalized title -> TMDB info, None for titles TMDB does not know
+_tmdb_cache = TTLCache(Config.TMDB_CACHE_SIZE, Config.TMDB_CACHE_TTL)
+metrics.track_cache("tmdb", _tmdb_cache)
+_tmdb_pending = {}
+
+# user_id -> joined backup channel?
+_subscription_cache = TTLCache(Config.SUB_CACHE_SIZE, Config.SUB_CACHE_TTL)
+metrics.track_cache("subscription", _subscription_cache)
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Shared HTTP session with a bounded keep-alive connection pool"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=Config.HTTP_POOL_SIZE,
+                keepalive_timeout=60,
+                ttl_dns_cache=300
+            ),
+            timeout=aiohttp.ClientTimeout(total=10),
+            trace_configs=tracing.http_trace_configs()
+        )
+    return _session
+
+
+async def close_http_session():
+    """Close the shared HTTP session"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
 
 async def get_movie_info(query: str) -> dict:
-    """Get movie info from TMDB"""
+    """Get movie info from TMDB (cached)"""
     if not Config.TMDB_API_KEY or not query:
         return None
     
+    key = normalize_name(query)
+    info = _tmdb_cache.get(key, MISSING)
+    if info is not MISSING:
+        return info
+    
+    # Identical lookups in flight share one request
+    task = _tmdb_pending.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_movie_info(query, key))
+        _tmdb_pending[key] = task
+        task.add_done_callback(lambda _: _tmdb_pending.pop(key, None))
+    return await asyncio.shield(task)
+
+
+async def _fetch_movie_info(query: str, key: str) -> dict:
     try:
         url = "https://api.themoviedb.org/3/search/movie"
         params = {"api_key": Config.TMDB_API_KEY, "query": query}
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    if data.get("results"):
-                        m = data["results"][0]
-                        poster = f"https://image.tmdb.org/t/p/w500{m['poster_path']}" if m.get("poster_path") else None
-                        overview = m.get("overview", "")[:300]
-                        return {
-                            "title": m.get("title", "Unknown"),
-                            "year": m.get("release_date", "")[:4],
-                            "rating": m.get("vote_average", "N/A"),
-                            "overview": overview,
-                            "poster": poster
-                        }
-        return None
+        session = await get_http_session()
+        with metrics.TMDB_LATENCY.time():
+            async with session.get(url, params=params) as resp:
+                if resp.status != 200:
+                    return None
+                data = await resp.json()
+        
+        if not data.get("results"):
+            _tmdb_cache.set(key, None, ttl=Config.TMDB_NEGATIVE_TTL)
+            return None
+        
+        m = data["results"][0]
+        poster = f"https://image.tmdb.org/t/p/w500{m['poster_path']}" if m.get("poster_path") else None
+        overview = (m.get("overview") or "")[:300]
+        info = {
+            "title": m.get("title", "Unknown"),
+            "year": (m.get("release_date") or "")[:4],
+            "rating": m.get("vote_average", "N/A"),
+            "overview": overview,
+            "poster": poster
+        }
+        _tmdb_cache.set(key, info)
+        return info
     except Exception as e:
         logger.error(f"TMDB error: {e}")
         return None
 
 
-async def check_subscription(bot, user_id: int) -> bool:
+@tracing.traced
+async def check_subscription(bot, user_id: int, use_cache: bool = True) -> bool:
     """Check if user joined channel"""
     if not Config.BACKUP_CHANNEL_ID:
         return True
     
+    if use_cache:
+        cached = _subscription_cache.get(user_id)
+        if cached is not None:
+            return cached
+    
     try:
         member = await bot.get_chat_member(Config.BACKUP_CHANNEL_ID, user_id)
         status = str(member.status).lower()
-        return any(s in status for s in ["member", "administrator", "creator", "owner"])
+        subscribed = any(s in status for s in ["member", "administrator", "creator", "owner"])
     except Exception as e:
         error = str(e).lower()
-        if "user_not_participant" in error:
-            return False
         if "chat_admin_required" in error:
             logger.warning("Bot is not admin in channel!")
             return True
-        return True
+        if "user_not_participant" not in error:
+            return True
+        subscribed = False
+    
+    ttl = Config.SUB_CACHE_TTL if subscribed else Config.SUB_NEGATIVE_TTL
+    _subscription_cache.set(user_id, subscribed, ttl=ttl)
+    return subscribed
+
+
+def invalidate_subscription(user_id: int):
+    """Forget cached channel membership of a user"""
+    _subscription_cache.pop(user_id)
 
 
 def encode_payload(movie_code: str, part: int = 1, quality: str = "", token: str = "") -> str:
@@ -92,4 +171,49 @@ def normalize_name(text: str) -> str:
     text = re.sub(r'[^\w\s]', '', text)
     text = text.lower().strip()
     text = re.sub(r'\s+', ' ', text)
-    return text
\ No newline at end of file
+    return text
+
+
+def search_tokens(text: str) -> list:
+    """Split a title or code into unique normalized search tokens"""
+    tokens = []
+    for token in normalize_name(text.replace("_", " ")).split(" "):
+        if token and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def normalize_quality(quality: str) -> str:
+    """Canonical quality name, or empty string if it is not available"""
+    quality = quality.strip()
+    if quality.upper() == "4K":
+        return "4K"
+    quality = quality.lower()
+    return quality if quality in QUALITY_OPTIONS else ""
+
+
+def format_size(size: int) -> str:
+    """Human readable file size"""
+    size_mb = round(size / (1024 * 1024), 2) if size else 0
+    return f"{size_mb} MB" if size_mb < 1024 else f"{round(size_mb / 1024, 2)} GB"
+
+
+def extract_media(message) -> dict:
+    """File details of a video or document message, None for anything else"""
+    media = message.video or message.document
+    if not media:
+        return None
+    
+    return {
+        "file_id": media.file_id,
+        "file_unique_id": media.file_unique_id,
+        "file_size": media.file_size or 0,
+        "file_name": media.file_name or "",
+        "mime_type": media.mime_type or "",
+        "duration": getattr(media, "duration", 0) or 0
+    }
+
+
+def message_source(message) -> dict:
+    """Where a file was posted, used to fetch a fresh file_id later"""
+    return {"chat_id": message.chat.id, "message_id": message.id}
@@ -0,0 +1,11 @@
+from config import Config
+from storage.base import Storage
+from storage.mongo import MongoStorage
+from storage.sqlite import SQLiteStorage
+
+
+def create_storage() -> Storage:
+    """Storage backend selected by STORAGE_BACKEND"""
+    if Config.STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(Config.SQLITE_PATH)
+    return MongoStorage(Config.MONGO_DB_URL, Config.DB_NAME)
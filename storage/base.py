@@ -0,0 +1,187 @@
+"""
+Storage interface - the data access Database needs from a backend
+"""
+
+
+class Storage:
+    """Base class for storage backends
+
+    Documents are plain dicts shaped like the Mongo ones. Movies and broadcasts
+    carry an ObjectId `_id`; user `_id`s only need to sort in insertion order.
+    """
+
+    # Lifecycle
+    async def setup(self):
+        """Create tables and indexes, migrate older data"""
+
+    async def close(self):
+        pass
+
+    async def ping(self) -> bool:
+        raise NotImplementedError
+
+    async def purge_expired(self):
+        """Remove expired tokens, deliveries and stats, for engines without TTL indexes"""
+
+    # Movies
+    async def get_movie(self, code: str) -> dict:
+        raise NotImplementedError
+
+    async def get_movie_by_id(self, movie_id) -> dict:
+        raise NotImplementedError
+
+    async def get_movies(self, codes: list) -> list:
+        """Movies with any of the codes, in no particular order"""
+        raise NotImplementedError
+
+    async def find_movies(self, tokens: list, prefix: bool = False, exclude_ids: list = (), limit: int = 50) -> list:
+        """Movies having every token (or a token starting with each), including search_tokens"""
+        raise NotImplementedError
+
+    async def iter_titles(self):
+        """Stream code, title and parts of every movie"""
+        raise NotImplementedError
+        yield
+
+    async def iter_movies(self):
+        """Stream every movie without _id and search_tokens"""
+        raise NotImplementedError
+        yield
+
+    async def iter_embedded_files(self):
+        """Stream movies that still embed file_ids instead of registry references"""
+        return
+        yield
+
+    async def upsert_movie(self, movie: dict):
+        """Set the given fields on the movie with this code, creating it if needed"""
+        raise NotImplementedError
+
+    async def upsert_movies(self, movies: list, ordered: bool = False) -> tuple:
+        """upsert_movie for many movies, returns (written, [(index, error)])"""
+        raise NotImplementedError
+
+    async def add_file(self, code: str, title: str, quality: str, entry: dict, part: int = None, tokens: list = None) -> dict:
+        """Atomically set one quality entry, returns the movie before (None if created)"""
+        raise NotImplementedError
+
+    async def add_files(self, items: list) -> int:
+        """add_file for many (code, title, quality, entry, part, tokens) items"""
+        raise NotImplementedError
+
+    async def remove_quality(self, code: str, quality: str) -> dict:
+        """Atomically remove a main quality, returns the movie before (None if absent)"""
+        raise NotImplementedError
+
+    async def delete_movie(self, code: str) -> dict:
+        """Delete a movie, returns it (None if absent)"""
+        raise NotImplementedError
+
+    async def list_movies(self, after_id=None, before_id=None, prefix: str = "", limit: int = 20) -> tuple:
+        """One page of movies in _id order, returns (movies, has_more)"""
+        raise NotImplementedError
+
+    async def catalog_stats(self) -> dict:
+        """{"movies", "files", "qualities": [(quality, count)]}"""
+        raise NotImplementedError
+
+    # Users
+    async def upsert_users(self, users: dict):
+        """Write user_id -> (username, last_seen), clearing the blocked flag"""
+        raise NotImplementedError
+
+    async def user_count(self) -> int:
+        raise NotImplementedError
+
+    async def active_user_count(self, since: float) -> int:
+        raise NotImplementedError
+
+    async def iter_users(self, after_id=None):
+        """Stream reachable users in _id order, starting after after_id"""
+        raise NotImplementedError
+        yield
+
+    async def mark_users_blocked(self, user_ids: list):
+        raise NotImplementedError
+
+    # Tokens
+    async def insert_tokens(self, tokens: list):
+        """Store new tokens in one write"""
+        raise NotImplementedError
+
+    async def redeem_token(self, token: str, user_id: int, valid_since: float) -> dict:
+        """Mark an unused, unexpired token used, returns it or None"""
+        raise NotImplementedError
+
+    async def delete_tokens(self, created_before: float):
+        raise NotImplementedError
+
+    # Deliveries
+    async def save_delivery(self, delivery: dict):
+        """Write a delivery, keyed by its token"""
+        raise NotImplementedError
+
+    async def get_delivery(self, token: str) -> dict:
+        raise NotImplementedError
+
+    async def claim_delivery(self, token: str, now: float, until: float) -> dict:
+        """Take a pending delivery that is due by moving its next_at to until, returns it or None"""
+        raise NotImplementedError
+
+    async def due_deliveries(self, now: float, limit: int) -> list:
+        """Pending deliveries whose next_at has passed, earliest first"""
+        raise NotImplementedError
+
+    # Stats
+    async def add_counts(self, counters: dict):
+        """Add (event, hour) -> amount to the hourly counters"""
+        raise NotImplementedError
+
+    async def get_counts(self, event: str, hours: list) -> int:
+        """Total of an event's counters over the given hours"""
+        raise NotImplementedError
+
+    # Files
+    async def upsert_files(self, files: list):
+        """Write (file_unique_id, fields) pairs, new files start with no references"""
+        raise NotImplementedError
+
+    async def adjust_file_refs(self, delta: dict):
+        """Add file_unique_id -> n to reference counts, removing released files left at zero"""
+        raise NotImplementedError
+
+    async def get_file(self, unique_id: str) -> dict:
+        raise NotImplementedError
+
+    async def get_files(self, unique_ids: list) -> dict:
+        raise NotImplementedError
+
+    async def update_file(self, unique_id: str, fields: dict, inc: dict = None):
+        raise NotImplementedError
+
+    async def stale_files(self, now: float, limit: int) -> list:
+        """file_unique_ids of stale files that know their source message and are due
+        for a refresh, least recently tried first"""
+        raise NotImplementedError
+
+    async def file_counts(self) -> tuple:
+        """(total, stale)"""
+        raise NotImplementedError
+
+    # Channel indexer
+    async def get_index_state(self, channel_id: int) -> dict:
+        raise NotImplementedError
+
+    async def set_index_state(self, channel_id: int, fields: dict):
+        raise NotImplementedError
+
+    # Broadcasts
+    async def create_broadcast(self, job: dict):
+        """Store a new job, returns its _id"""
+        raise NotImplementedError
+
+    async def update_broadcast(self, broadcast_id, fields: dict):
+        raise NotImplementedError
+
+    async def get_running_broadcasts(self) -> list:
+        raise NotImplementedError
@@ -0,0 +1,456 @@
+"""
+MongoDB storage backend (Motor)
+"""
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from helpers import search_tokens
+from storage.base import Storage
+from utils import tracing
+
+logger = logging.getLogger(__name__)
+
+# Hourly counters are kept this long
+STATS_RETENTION = timedelta(days=30)
+
+
+def _file_update(code: str, title: str, quality: str, entry: dict, part: int = None, tokens: list = None) -> dict:
+    """Targeted update adding one file; part=None means the main qualities"""
+    if part is None:
+        path = f"qualities.{quality}"
+    else:
+        path = f"parts_data.part_{part}.qualities.{quality}"
+
+    return {
+        "$set": {path: entry},
+        "$max": {"parts": part or 1},
+        "$setOnInsert": {"code": code, "title": title, "search_tokens": tokens or []}
+    }
+
+
+def _delivery(doc: dict) -> dict:
+    if doc:
+        doc.pop("_id")
+        doc["expires_at"] = doc["expires_at"].replace(tzinfo=timezone.utc).timestamp()
+    return doc
+
+
+@tracing.traced_methods("mongo")
+class MongoStorage(Storage):
+    def __init__(self, url: str, name: str):
+        self.client = AsyncIOMotorClient(url)
+        self.db = self.client[name]
+        self.movies = self.db["movies"]
+        self.users = self.db["users"]
+        self.tokens = self.db["tokens"]
+        self.broadcasts = self.db["broadcasts"]
+        self.stats = self.db["stats"]
+        self.indexer = self.db["indexer"]
+        self.files = self.db["files"]
+        self.deliveries = self.db["deliveries"]
+
+    @staticmethod
+    async def create_index(collection, keys, **kwargs):
+        try:
+            await collection.create_index(keys, **kwargs)
+        except Exception as e:
+            logger.error(f"Index error on {collection.name} {keys}: {e}")
+
+    async def _duplicate_codes(self, limit: int = 20) -> list:
+        pipeline = [
+            {"$group": {"_id": "$code", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$limit": limit}
+        ]
+        return [group["_id"] async for group in self.movies.aggregate(pipeline, allowDiskUse=True)]
+
+    async def setup(self):
+        """Create indexes and backfill search tokens on older movies"""
+        try:
+            await self.movies.create_index("code", unique=True)
+        except DuplicateKeyError:
+            codes = await self._duplicate_codes()
+            raise RuntimeError(
+                f"Movie codes must be unique, remove or rename the duplicates first: {', '.join(map(str, codes))}"
+            )
+        await self.create_index(self.movies, "search_tokens")
+        await self.create_index(self.users, "user_id", unique=True)
+        await self.create_index(self.users, "last_seen")
+        await self.create_index(self.stats, "expires_at", expireAfterSeconds=0)
+        await self.create_index(self.tokens, "token", unique=True)
+        # Mongo removes tokens on its own once expires_at has passed
+        await self.create_index(self.tokens, "expires_at", expireAfterSeconds=0)
+        await self.create_index(self.files, "stale")
+        await self.create_index(self.deliveries, [("state", 1), ("next_at", 1)])
+        await self.create_index(self.deliveries, "expires_at", expireAfterSeconds=0)
+
+        cursor = self.movies.find({"search_tokens": {"$exists": False}}, {"code": 1, "title": 1})
+        ops = []
+        async for movie in cursor:
+            ops.append(UpdateOne(
+                {"_id": movie["_id"]},
+                {"$set": {"search_tokens": search_tokens(f"{movie.get('title', '')} {movie.get('code', '')}")}}
+            ))
+            if len(ops) >= 500:
+                await self.movies.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            await self.movies.bulk_write(ops, ordered=False)
+
+    async def close(self):
+        self.client.close()
+
+    async def ping(self) -> bool:
+        await self.client.admin.command("ping")
+        return True
+
+    # Movies
+    async def get_movie(self, code: str) -> dict:
+        return await self.movies.find_one({"code": code})
+
+    async def get_movie_by_id(self, movie_id) -> dict:
+        return await self.movies.find_one({"_id": movie_id})
+
+    async def get_movies(self, codes: list) -> list:
+        cursor = self.movies.find({"code": {"$in": list(set(codes))}}, {"search_tokens": 0})
+        return await cursor.to_list(length=None)
+
+    async def find_movies(self, tokens: list, prefix: bool = False, exclude_ids: list = (), limit: int = 50) -> list:
+        if not prefix:
+            query = {"search_tokens": {"$all": tokens}}
+        else:
+            # Longest token first so the index scan is as narrow as possible
+            query = {"$and": [
+                {"search_tokens": {"$regex": f"^{re.escape(t)}"}}
+                for t in sorted(tokens, key=len, reverse=True)
+            ]}
+        if exclude_ids:
+            query["_id"] = {"$nin": list(exclude_ids)}
+        return await self.movies.find(query).limit(limit).to_list(length=limit)
+
+    async def iter_titles(self):
+        async for movie in self.movies.find({}, {"code": 1, "title": 1, "parts": 1}):
+            yield movie
+
+    async def iter_movies(self):
+        cursor = self.movies.find({}, {"_id": 0, "search_tokens": 0}).batch_size(500)
+        async for movie in cursor:
+            yield movie
+
+    async def iter_embedded_files(self):
+        def embedded(qualities):
+            return {"$anyElementTrue": [{"$map": {
+                "input": {"$objectToArray": {"$ifNull": [qualities, {}]}},
+                "as": "q",
+                "in": {"$ne": [{"$type": "$$q.v.file_id"}, "missing"]}
+            }}]}
+
+        cursor = self.movies.find(
+            {"$expr": {"$or": [
+                embedded("$qualities"),
+                {"$anyElementTrue": [{"$map": {
+                    "input": {"$objectToArray": {"$ifNull": ["$parts_data", {}]}},
+                    "as": "p",
+                    "in": embedded("$$p.v.qualities")
+                }}]}
+            ]}},
+            {"_id": 0, "search_tokens": 0}
+        )
+        async for movie in cursor:
+            yield movie
+
+    async def upsert_movie(self, movie: dict):
+        await self.movies.update_one({"code": movie["code"]}, {"$set": movie}, upsert=True)
+
+    async def upsert_movies(self, movies: list, ordered: bool = False) -> tuple:
+        ops = [UpdateOne({"code": movie["code"]}, {"$set": movie}, upsert=True) for movie in movies]
+        try:
+            result = await self.movies.bulk_write(ops, ordered=ordered)
+            return result.matched_count + result.upserted_count, []
+        except BulkWriteError as e:
+            details = e.details
+            written = details.get("nMatched", 0) + details.get("nUpserted", 0)
+            failed = [(err["index"], err.get("errmsg", "write error")) for err in details.get("writeErrors", [])]
+            return written, failed
+
+    async def add_file(self, code: str, title: str, quality: str, entry: dict, part: int = None, tokens: list = None) -> dict:
+        return await self.movies.find_one_and_update(
+            {"code": code},
+            _file_update(code, title, quality, entry, part, tokens),
+            projection={"search_tokens": 0},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+
+    async def add_files(self, items: list) -> int:
+        ops = [UpdateOne({"code": item[0]}, _file_update(*item), upsert=True) for item in items]
+        try:
+            result = await self.movies.bulk_write(ops, ordered=False)
+            return result.matched_count + result.upserted_count
+        except BulkWriteError as e:
+            logger.error(f"Bulk add files error: {e.details.get('writeErrors', [])[:3]}")
+            return e.details.get("nMatched", 0) + e.details.get("nUpserted", 0)
+
+    async def remove_quality(self, code: str, quality: str) -> dict:
+        return await self.movies.find_one_and_update(
+            {"code": code, f"qualities.{quality}": {"$exists": True}},
+            {"$unset": {f"qualities.{quality}": ""}},
+            projection={"search_tokens": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+
+    async def delete_movie(self, code: str) -> dict:
+        return await self.movies.find_one_and_delete({"code": code}, {"qualities": 1, "parts_data": 1})
+
+    async def list_movies(self, after_id=None, before_id=None, prefix: str = "", limit: int = 20) -> tuple:
+        direction = -1 if before_id is not None else 1
+        cursor_id = before_id if before_id is not None else after_id
+
+        if prefix:
+            # Pages under a prefix walk the code index, keyed on the code of the cursor movie
+            key = "code"
+            bounds = {"$gte": prefix, "$lt": prefix + "\U0010ffff"}
+            cursor_movie = None
+            if cursor_id is not None:
+                cursor_movie = await self.movies.find_one({"_id": cursor_id}, {"code": 1})
+            if cursor_movie and direction < 0:
+                bounds["$lt"] = cursor_movie["code"]
+            elif cursor_movie:
+                del bounds["$gte"]
+                bounds["$gt"] = cursor_movie["code"]
+            query = {"code": bounds}
+        else:
+            key = "_id"
+            query = {}
+            if cursor_id is not None:
+                query["_id"] = {"$lt" if direction < 0 else "$gt": cursor_id}
+
+        cursor = self.movies.find(
+            query,
+            {"title": 1, "code": 1, "qualities": 1, "parts": 1}
+        ).sort(key, direction).limit(limit + 1)
+        movies = await cursor.to_list(length=limit + 1)
+
+        has_more = len(movies) > limit
+        movies = movies[:limit]
+        if direction < 0:
+            movies.reverse()
+        return movies, has_more
+
+    async def catalog_stats(self) -> dict:
+        """Movie, file and per-quality totals computed inside Mongo"""
+        part_files = {
+            "$reduce": {
+                "input": {"$objectToArray": {"$ifNull": ["$parts_data", {}]}},
+                "initialValue": [],
+                "in": {"$concatArrays": [
+                    "$$value",
+                    {"$map": {
+                        "input": {"$objectToArray": {"$ifNull": ["$$this.v.qualities", {}]}},
+                        "as": "q",
+                        "in": "$$q.k"
+                    }}
+                ]}
+            }
+        }
+        pipeline = [
+            {"$project": {
+                "_id": 0,
+                "files": {"$concatArrays": [
+                    {"$map": {
+                        "input": {"$objectToArray": {"$ifNull": ["$qualities", {}]}},
+                        "as": "q",
+                        "in": "$$q.k"
+                    }},
+                    part_files
+                ]}
+            }},
+            {"$facet": {
+                "totals": [{"$group": {
+                    "_id": None,
+                    "movies": {"$sum": 1},
+                    "files": {"$sum": {"$size": "$files"}}
+                }}],
+                "qualities": [
+                    {"$unwind": "$files"},
+                    {"$group": {"_id": "$files", "count": {"$sum": 1}}},
+                    {"$sort": {"count": -1}}
+                ]
+            }}
+        ]
+        result = await self.movies.aggregate(pipeline).to_list(length=1)
+        facets = result[0] if result else {}
+        totals = facets.get("totals") or [{}]
+        return {
+            "movies": totals[0].get("movies", 0),
+            "files": totals[0].get("files", 0),
+            "qualities": [(q["_id"], q["count"]) for q in facets.get("qualities", [])]
+        }
+
+    # Users
+    async def upsert_users(self, users: dict):
+        ops = [
+            UpdateOne(
+                {"user_id": user_id},
+                {"$set": {
+                    "user_id": user_id,
+                    "username": username,
+                    "last_seen": last_seen,
+                    "blocked": False
+                }},
+                upsert=True
+            )
+            for user_id, (username, last_seen) in users.items()
+        ]
+        await self.users.bulk_write(ops, ordered=False)
+
+    async def user_count(self) -> int:
+        return await self.users.estimated_document_count()
+
+    async def active_user_count(self, since: float) -> int:
+        return await self.users.count_documents({"last_seen": {"$gte": since}})
+
+    async def iter_users(self, after_id=None):
+        query = {"blocked": {"$ne": True}}
+        if after_id is not None:
+            query["_id"] = {"$gt": after_id}
+        cursor = self.users.find(query, {"user_id": 1}).sort("_id", 1).batch_size(1000)
+        async for user in cursor:
+            yield user
+
+    async def mark_users_blocked(self, user_ids: list):
+        await self.users.update_many({"user_id": {"$in": user_ids}}, {"$set": {"blocked": True}})
+
+    # Tokens
+    async def insert_tokens(self, tokens: list):
+        await self.tokens.insert_many(
+            [dict(token, expires_at=datetime.fromtimestamp(token["expires_at"], timezone.utc)) for token in tokens],
+            ordered=False
+        )
+
+    async def redeem_token(self, token: str, user_id: int, valid_since: float) -> dict:
+        return await self.tokens.find_one_and_update(
+            {
+                "token": token,
+                "user_id": user_id,
+                "used": False,
+                "created_at": {"$gte": valid_since}
+            },
+            {"$set": {"used": True}}
+        )
+
+    async def delete_tokens(self, created_before: float):
+        await self.tokens.delete_many({"created_at": {"$lt": created_before}})
+
+    # Deliveries
+    async def save_delivery(self, delivery: dict):
+        await self.deliveries.replace_one(
+            {"_id": delivery["token"]},
+            dict(delivery, expires_at=datetime.fromtimestamp(delivery["expires_at"], timezone.utc)),
+            upsert=True
+        )
+
+    async def get_delivery(self, token: str) -> dict:
+        return _delivery(await self.deliveries.find_one({"_id": token}))
+
+    async def claim_delivery(self, token: str, now: float, until: float) -> dict:
+        return _delivery(await self.deliveries.find_one_and_update(
+            {"_id": token, "state": "pending", "next_at": {"$lte": now}},
+            {"$set": {"next_at": until}},
+            return_document=ReturnDocument.AFTER
+        ))
+
+    async def due_deliveries(self, now: float, limit: int) -> list:
+        cursor = self.deliveries.find({"state": "pending", "next_at": {"$lte": now}}).sort("next_at", 1).limit(limit)
+        return [_delivery(doc) async for doc in cursor]
+
+    # Stats
+    async def add_counts(self, counters: dict):
+        ops = [
+            UpdateOne(
+                {"_id": f"{event}:{hour}"},
+                {
+                    "$inc": {"count": amount},
+                    "$setOnInsert": {
+                        "event": event,
+                        "hour": hour,
+                        "expires_at": datetime.fromtimestamp(hour * 3600, timezone.utc) + STATS_RETENTION
+                    }
+                },
+                upsert=True
+            )
+            for (event, hour), amount in counters.items()
+        ]
+        await self.stats.bulk_write(ops, ordered=False)
+
+    async def get_counts(self, event: str, hours: list) -> int:
+        cursor = self.stats.find({"_id": {"$in": [f"{event}:{hour}" for hour in hours]}}, {"count": 1})
+        return sum([doc["count"] async for doc in cursor])
+
+    # Files
+    async def upsert_files(self, files: list):
+        ops = [
+            UpdateOne(
+                {"_id": unique_id},
+                {"$set": fields, "$setOnInsert": {"refs": 0, "failures": 0, "last_sent_at": None}},
+                upsert=True
+            )
+            for unique_id, fields in files
+        ]
+        await self.files.bulk_write(ops, ordered=False)
+
+    async def adjust_file_refs(self, delta: dict):
+        await self.files.bulk_write(
+            [UpdateOne({"_id": uid}, {"$inc": {"refs": n}}) for uid, n in delta.items()],
+            ordered=False
+        )
+        released = [uid for uid, n in delta.items() if n < 0]
+        if released:
+            await self.files.delete_many({"_id": {"$in": released}, "refs": {"$lte": 0}})
+
+    async def get_file(self, unique_id: str) -> dict:
+        return await self.files.find_one({"_id": unique_id})
+
+    async def get_files(self, unique_ids: list) -> dict:
+        cursor = self.files.find({"_id": {"$in": list(set(unique_ids))}})
+        return {file["_id"]: file async for file in cursor}
+
+    async def update_file(self, unique_id: str, fields: dict, inc: dict = None):
+        update = {"$set": fields}
+        if inc:
+            update["$inc"] = inc
+        await self.files.update_one({"_id": unique_id}, update)
+
+    async def stale_files(self, now: float, limit: int) -> list:
+        cursor = self.files.find(
+            {"stale": True, "source": {"$exists": True}, "refresh_at": {"$not": {"$gt": now}}},
+            {"_id": 1}
+        ).sort("refresh_attempted_at", 1).limit(limit)
+        return [file["_id"] async for file in cursor]
+
+    async def file_counts(self) -> tuple:
+        total = await self.files.estimated_document_count()
+        stale = await self.files.count_documents({"stale": True})
+        return total, stale
+
+    # Channel indexer
+    async def get_index_state(self, channel_id: int) -> dict:
+        return await self.indexer.find_one({"_id": channel_id})
+
+    async def set_index_state(self, channel_id: int, fields: dict):
+        await self.indexer.update_one({"_id": channel_id}, {"$set": fields}, upsert=True)
+
+    # Broadcasts
+    async def create_broadcast(self, job: dict):
+        result = await self.broadcasts.insert_one(job)
+        return result.inserted_id
+
+    async def update_broadcast(self, broadcast_id, fields: dict):
+        await self.broadcasts.update_one({"_id": broadcast_id}, {"$set": fields})
+
+    async def get_running_broadcasts(self) -> list:
+        cursor = self.broadcasts.find({"state": "running"})
+        return await cursor.to_list(length=100)
@@ -0,0 +1,670 @@
+"""
+Embedded SQLite storage backend - WAL journal and FTS5 search, no server needed
+"""
+import asyncio
+import functools
+import json
+import logging
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from storage.base import Storage
+from utils import tracing
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per query while streaming
+PAGE_SIZE = 500
+
+# Values bound per IN (...) list
+MAX_PARAMS = 500
+
+# Hourly counters are kept this long
+STATS_RETENTION = 30 * 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS movies (
+    pk INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    code TEXT NOT NULL UNIQUE,
+    doc TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS movie_search USING fts5(tokens, tokenize="unicode61 remove_diacritics 0");
+CREATE TABLE IF NOT EXISTS users (
+    pk INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL UNIQUE,
+    username TEXT,
+    last_seen REAL,
+    blocked INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS users_last_seen ON users (last_seen);
+CREATE TABLE IF NOT EXISTS tokens (
+    token TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    movie_code TEXT,
+    part INTEGER,
+    quality TEXT,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    used INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tokens_expires_at ON tokens (expires_at);
+CREATE TABLE IF NOT EXISTS deliveries (
+    token TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    next_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deliveries_due ON deliveries (state, next_at);
+CREATE TABLE IF NOT EXISTS stats (
+    id TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    doc TEXT NOT NULL,
+    refs INTEGER NOT NULL DEFAULT 0,
+    stale INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS files_stale ON files (stale);
+CREATE TABLE IF NOT EXISTS indexer (
+    channel_id INTEGER PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id TEXT PRIMARY KEY,
+    state TEXT,
+    doc TEXT NOT NULL
+);
+"""
+
+
+def _chunks(values: list):
+    values = list(values)
+    for i in range(0, len(values), MAX_PARAMS):
+        yield values[i:i + MAX_PARAMS]
+
+
+def _marks(values: list) -> str:
+    return ",".join("?" * len(values))
+
+
+def _movie(row, tokens: bool = False) -> dict:
+    movie = json.loads(row["doc"])
+    movie["_id"] = ObjectId(row["id"])
+    if not tokens:
+        movie.pop("search_tokens", None)
+    return movie
+
+
+def _file(row) -> dict:
+    file = json.loads(row["doc"])
+    file.update({"_id": row["id"], "refs": row["refs"], "stale": bool(row["stale"])})
+    return file
+
+
+def _delivery(row) -> dict:
+    delivery = json.loads(row["doc"])
+    delivery.update({"state": row["state"], "next_at": row["next_at"]})
+    return delivery
+
+
+def _match(tokens: list, prefix: bool) -> str:
+    """FTS5 query requiring every token, or a token starting with each"""
+    star = "*" if prefix else ""
+    return " AND ".join('"{}"{}'.format(t.replace('"', '""'), star) for t in tokens)
+
+
+@tracing.traced_methods("sqlite")
+class SQLiteStorage(Storage):
+    """Every query runs on one worker thread, so each call is a single transaction"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _transaction(self, write: bool, func, *args):
+        if self._conn is None:
+            self._conn = self._connect()
+        conn = self._conn
+        # IMMEDIATE takes the write lock up front, other processes wait instead of failing later
+        conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            result = func(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    async def _read(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self._transaction, False, func, *args))
+
+    async def _write(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self._transaction, True, func, *args))
+
+    async def _pages(self, query: str, params: tuple = (), after=None):
+        """Stream rows of a query ordered by pk, one page per transaction"""
+        def page(conn, after):
+            return conn.execute(query, (*params, after, PAGE_SIZE)).fetchall()
+
+        while True:
+            rows = await self._read(page, after)
+            for row in rows:
+                yield row
+            if len(rows) < PAGE_SIZE:
+                return
+            after = rows[-1]["pk"]
+
+    # Lifecycle
+    async def setup(self):
+        await self._write(lambda conn: None)
+
+    async def close(self):
+        def close(conn):
+            conn.close()
+            self._conn = None
+
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, close, self._conn)
+        self._executor.shutdown(wait=False)
+
+    async def ping(self) -> bool:
+        return await self._read(lambda conn: conn.execute("SELECT 1").fetchone()[0] == 1)
+
+    async def purge_expired(self):
+        def purge(conn, now):
+            conn.execute("DELETE FROM tokens WHERE expires_at < ?", (now,))
+            conn.execute("DELETE FROM deliveries WHERE expires_at < ?", (now,))
+            conn.execute("DELETE FROM stats WHERE expires_at < ?", (now,))
+
+        await self._write(purge, time.time())
+
+    # Movies
+    @staticmethod
+    def _row(conn, code: str):
+        return conn.execute("SELECT pk, id, doc FROM movies WHERE code = ?", (code,)).fetchone()
+
+    @staticmethod
+    def _save(conn, doc: dict, row=None):
+        """Insert or rewrite a movie and its search tokens"""
+        doc = {k: v for k, v in doc.items() if k != "_id"}
+        if row is None:
+            pk = conn.execute(
+                "INSERT INTO movies (id, code, doc) VALUES (?, ?, ?)",
+                (str(ObjectId()), doc["code"], json.dumps(doc))
+            ).lastrowid
+        else:
+            pk = row["pk"]
+            conn.execute("UPDATE movies SET doc = ? WHERE pk = ?", (json.dumps(doc), pk))
+            conn.execute("DELETE FROM movie_search WHERE rowid = ?", (pk,))
+        conn.execute(
+            "INSERT INTO movie_search (rowid, tokens) VALUES (?, ?)",
+            (pk, " ".join(doc.get("search_tokens") or []))
+        )
+
+    def _upsert(self, conn, movie: dict):
+        row = self._row(conn, movie["code"])
+        doc = json.loads(row["doc"]) if row else {}
+        doc.update(movie)
+        self._save(conn, doc, row)
+
+    def _add_file(self, conn, code: str, title: str, quality: str, entry: dict, part: int = None, tokens: list = None) -> dict:
+        row = self._row(conn, code)
+        if row:
+            doc = json.loads(row["doc"])
+        else:
+            doc = {"code": code, "title": title, "search_tokens": tokens or []}
+
+        if part is None:
+            qualities = doc.setdefault("qualities", {})
+        else:
+            part_data = doc.setdefault("parts_data", {}).setdefault(f"part_{part}", {})
+            qualities = part_data.setdefault("qualities", {})
+        qualities[quality] = entry
+        doc["parts"] = max(doc.get("parts", 0), part or 1)
+
+        self._save(conn, doc, row)
+        return _movie(row) if row else None
+
+    async def get_movie(self, code: str) -> dict:
+        row = await self._read(self._row, code)
+        return _movie(row) if row else None
+
+    async def get_movie_by_id(self, movie_id) -> dict:
+        def get(conn):
+            return conn.execute("SELECT id, doc FROM movies WHERE id = ?", (str(movie_id),)).fetchone()
+
+        row = await self._read(get)
+        return _movie(row) if row else None
+
+    async def get_movies(self, codes: list) -> list:
+        def get(conn):
+            rows = []
+            for chunk in _chunks(set(codes)):
+                rows += conn.execute(f"SELECT id, doc FROM movies WHERE code IN ({_marks(chunk)})", chunk).fetchall()
+            return rows
+
+        return [_movie(row) for row in await self._read(get)]
+
+    async def find_movies(self, tokens: list, prefix: bool = False, exclude_ids: list = (), limit: int = 50) -> list:
+        exclude = [str(i) for i in exclude_ids]
+
+        def find(conn):
+            return conn.execute(
+                "SELECT m.id, m.doc FROM movie_search JOIN movies m ON m.pk = movie_search.rowid "
+                f"WHERE movie_search MATCH ? AND m.id NOT IN ({_marks(exclude)}) LIMIT ?",
+                (_match(tokens, prefix), *exclude, limit)
+            ).fetchall()
+
+        return [_movie(row, tokens=True) for row in await self._read(find)]
+
+    async def iter_titles(self):
+        query = "SELECT pk, id, doc FROM movies WHERE pk > ? ORDER BY pk LIMIT ?"
+        async for row in self._pages(query, after=0):
+            movie = _movie(row)
+            yield {"_id": movie["_id"], "code": movie["code"], "title": movie.get("title"), "parts": movie.get("parts", 1)}
+
+    async def iter_movies(self):
+        query = "SELECT pk, id, doc FROM movies WHERE pk > ? ORDER BY pk LIMIT ?"
+        async for row in self._pages(query, after=0):
+            movie = _movie(row)
+            movie.pop("_id")
+            yield movie
+
+    async def upsert_movie(self, movie: dict):
+        await self._write(self._upsert, movie)
+
+    async def upsert_movies(self, movies: list, ordered: bool = False) -> tuple:
+        def upsert(conn):
+            written, failed = 0, []
+            for index, movie in enumerate(movies):
+                conn.execute("SAVEPOINT movie")
+                try:
+                    self._upsert(conn, movie)
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO movie")
+                    failed.append((index, str(e)))
+                    if ordered:
+                        break
+                else:
+                    written += 1
+                conn.execute("RELEASE movie")
+            return written, failed
+
+        return await self._write(upsert)
+
+    async def add_file(self, code: str, title: str, quality: str, entry: dict, part: int = None, tokens: list = None) -> dict:
+        return await self._write(self._add_file, code, title, quality, entry, part, tokens)
+
+    async def add_files(self, items: list) -> int:
+        def add(conn):
+            for item in items:
+                self._add_file(conn, *item)
+            return len(items)
+
+        return await self._write(add)
+
+    async def remove_quality(self, code: str, quality: str) -> dict:
+        def remove(conn):
+            row = self._row(conn, code)
+            if not row:
+                return None
+            doc = json.loads(row["doc"])
+            if quality not in doc.get("qualities", {}):
+                return None
+            del doc["qualities"][quality]
+            self._save(conn, doc, row)
+            return _movie(row)
+
+        return await self._write(remove)
+
+    async def delete_movie(self, code: str) -> dict:
+        def delete(conn):
+            row = self._row(conn, code)
+            if not row:
+                return None
+            conn.execute("DELETE FROM movies WHERE pk = ?", (row["pk"],))
+            conn.execute("DELETE FROM movie_search WHERE rowid = ?", (row["pk"],))
+            return _movie(row)
+
+        return await self._write(delete)
+
+    async def list_movies(self, after_id=None, before_id=None, prefix: str = "", limit: int = 20) -> tuple:
+        where, params = [], []
+        key, direction = "id", "ASC"
+        if prefix:
+            # Pages under a prefix go by code, keyed on the code of the cursor movie
+            key = "code"
+            upper = prefix + "\U0010ffff"
+            where.append("code >= ? AND code < ?")
+            params += [prefix, upper]
+            if before_id is not None:
+                where.append("code < coalesce((SELECT code FROM movies WHERE id = ?), ?)")
+                params += [str(before_id), upper]
+                direction = "DESC"
+            elif after_id is not None:
+                where.append("code > coalesce((SELECT code FROM movies WHERE id = ?), '')")
+                params.append(str(after_id))
+        # ObjectId hex strings sort like the ObjectIds themselves
+        elif before_id is not None:
+            where.append("id < ?")
+            params.append(str(before_id))
+            direction = "DESC"
+        elif after_id is not None:
+            where.append("id > ?")
+            params.append(str(after_id))
+
+        def page(conn):
+            return conn.execute(
+                f"SELECT id, doc FROM movies {'WHERE ' + ' AND '.join(where) if where else ''} "
+                f"ORDER BY {key} {direction} LIMIT ?",
+                (*params, limit + 1)
+            ).fetchall()
+
+        movies = [_movie(row) for row in await self._read(page)]
+        has_more = len(movies) > limit
+        movies = movies[:limit]
+        if direction == "DESC":
+            movies.reverse()
+        return movies, has_more
+
+    async def catalog_stats(self) -> dict:
+        def stats(conn):
+            movies = conn.execute("SELECT count(*) FROM movies").fetchone()[0]
+            rows = conn.execute(
+                "SELECT q.key, count(*) FROM movies, json_each(movies.doc, '$.qualities') q GROUP BY q.key"
+            ).fetchall()
+            rows += conn.execute(
+                "SELECT q.key, count(*) FROM movies, json_each(movies.doc, '$.parts_data') p, "
+                "json_each(p.value, '$.qualities') q GROUP BY q.key"
+            ).fetchall()
+            return movies, rows
+
+        movies, rows = await self._read(stats)
+        qualities = Counter()
+        for quality, count in rows:
+            qualities[quality] += count
+        return {
+            "movies": movies,
+            "files": sum(qualities.values()),
+            "qualities": qualities.most_common()
+        }
+
+    # Users
+    async def upsert_users(self, users: dict):
+        def upsert(conn):
+            conn.executemany(
+                "INSERT INTO users (user_id, username, last_seen, blocked) VALUES (?, ?, ?, 0) "
+                "ON CONFLICT (user_id) DO UPDATE SET "
+                "username = excluded.username, last_seen = excluded.last_seen, blocked = 0",
+                [(user_id, username, last_seen) for user_id, (username, last_seen) in users.items()]
+            )
+
+        await self._write(upsert)
+
+    async def user_count(self) -> int:
+        return await self._read(lambda conn: conn.execute("SELECT count(*) FROM users").fetchone()[0])
+
+    async def active_user_count(self, since: float) -> int:
+        def count(conn):
+            return conn.execute("SELECT count(*) FROM users WHERE last_seen >= ?", (since,)).fetchone()[0]
+
+        return await self._read(count)
+
+    async def iter_users(self, after_id=None):
+        query = "SELECT pk, user_id FROM users WHERE blocked = 0 AND pk > ? ORDER BY pk LIMIT ?"
+        async for row in self._pages(query, after=after_id or 0):
+            yield {"_id": row["pk"], "user_id": row["user_id"]}
+
+    async def mark_users_blocked(self, user_ids: list):
+        def block(conn):
+            for chunk in _chunks(user_ids):
+                conn.execute(f"UPDATE users SET blocked = 1 WHERE user_id IN ({_marks(chunk)})", chunk)
+
+        await self._write(block)
+
+    # Tokens
+    async def insert_tokens(self, tokens: list):
+        def insert(conn):
+            conn.executemany(
+                "INSERT INTO tokens (token, user_id, movie_code, part, quality, created_at, expires_at, used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                [
+                    (
+                        token["token"], token["user_id"], token["movie_code"], token["part"],
+                        token["quality"], token["created_at"], token["expires_at"]
+                    )
+                    for token in tokens
+                ]
+            )
+
+        await self._write(insert)
+
+    async def redeem_token(self, token: str, user_id: int, valid_since: float) -> dict:
+        def redeem(conn):
+            row = conn.execute(
+                "SELECT * FROM tokens WHERE token = ? AND user_id = ? AND used = 0 "
+                "AND created_at >= ? AND expires_at >= ?",
+                (token, user_id, valid_since, time.time())
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE tokens SET used = 1 WHERE token = ?", (token,))
+            return row
+
+        row = await self._write(redeem)
+        return dict(row, used=False) if row else None
+
+    async def delete_tokens(self, created_before: float):
+        await self._write(lambda conn: conn.execute("DELETE FROM tokens WHERE created_at < ?", (created_before,)))
+
+    # Deliveries
+    async def save_delivery(self, delivery: dict):
+        def save(conn):
+            conn.execute(
+                "INSERT INTO deliveries (token, state, next_at, expires_at, doc) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (token) DO UPDATE SET state = excluded.state, next_at = excluded.next_at, "
+                "expires_at = excluded.expires_at, doc = excluded.doc",
+                (
+                    delivery["token"], delivery["state"], delivery["next_at"],
+                    delivery["expires_at"], json.dumps(delivery)
+                )
+            )
+
+        await self._write(save)
+
+    async def get_delivery(self, token: str) -> dict:
+        def get(conn):
+            return conn.execute("SELECT * FROM deliveries WHERE token = ?", (token,)).fetchone()
+
+        row = await self._read(get)
+        return _delivery(row) if row else None
+
+    async def claim_delivery(self, token: str, now: float, until: float) -> dict:
+        def claim(conn):
+            claimed = conn.execute(
+                "UPDATE deliveries SET next_at = ? WHERE token = ? AND state = 'pending' AND next_at <= ?",
+                (until, token, now)
+            ).rowcount
+            if claimed:
+                return conn.execute("SELECT * FROM deliveries WHERE token = ?", (token,)).fetchone()
+
+        row = await self._write(claim)
+        return _delivery(row) if row else None
+
+    async def due_deliveries(self, now: float, limit: int) -> list:
+        def due(conn):
+            return conn.execute(
+                "SELECT * FROM deliveries WHERE state = 'pending' AND next_at <= ? ORDER BY next_at LIMIT ?",
+                (now, limit)
+            ).fetchall()
+
+        return [_delivery(row) for row in await self._read(due)]
+
+    # Stats
+    async def add_counts(self, counters: dict):
+        def add(conn):
+            conn.executemany(
+                "INSERT INTO stats (id, count, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET count = count + excluded.count",
+                [
+                    (f"{event}:{hour}", amount, hour * 3600 + STATS_RETENTION)
+                    for (event, hour), amount in counters.items()
+                ]
+            )
+
+        await self._write(add)
+
+    async def get_counts(self, event: str, hours: list) -> int:
+        keys = [f"{event}:{hour}" for hour in hours]
+
+        def total(conn):
+            return conn.execute(f"SELECT sum(count) FROM stats WHERE id IN ({_marks(keys)})", keys).fetchone()[0]
+
+        return await self._read(total) or 0
+
+    # Files
+    async def upsert_files(self, files: list):
+        def upsert(conn):
+            for unique_id, fields in files:
+                row = conn.execute("SELECT doc FROM files WHERE id = ?", (unique_id,)).fetchone()
+                doc = json.loads(row["doc"]) if row else {"failures": 0, "last_sent_at": None}
+                doc.update(fields)
+                conn.execute(
+                    "INSERT INTO files (id, doc, stale) VALUES (?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET doc = excluded.doc, stale = excluded.stale",
+                    (unique_id, json.dumps(doc), int(bool(doc.get("stale"))))
+                )
+
+        await self._write(upsert)
+
+    async def adjust_file_refs(self, delta: dict):
+        released = [uid for uid, n in delta.items() if n < 0]
+
+        def adjust(conn):
+            conn.executemany("UPDATE files SET refs = refs + ? WHERE id = ?", [(n, uid) for uid, n in delta.items()])
+            for chunk in _chunks(released):
+                conn.execute(f"DELETE FROM files WHERE refs <= 0 AND id IN ({_marks(chunk)})", chunk)
+
+        await self._write(adjust)
+
+    async def get_file(self, unique_id: str) -> dict:
+        def get(conn):
+            return conn.execute("SELECT * FROM files WHERE id = ?", (unique_id,)).fetchone()
+
+        row = await self._read(get)
+        return _file(row) if row else None
+
+    async def get_files(self, unique_ids: list) -> dict:
+        def get(conn):
+            rows = []
+            for chunk in _chunks(set(unique_ids)):
+                rows += conn.execute(f"SELECT * FROM files WHERE id IN ({_marks(chunk)})", chunk).fetchall()
+            return rows
+
+        return {row["id"]: _file(row) for row in await self._read(get)}
+
+    async def update_file(self, unique_id: str, fields: dict, inc: dict = None):
+        def update(conn):
+            row = conn.execute("SELECT doc FROM files WHERE id = ?", (unique_id,)).fetchone()
+            if not row:
+                return
+            doc = json.loads(row["doc"])
+            doc.update(fields)
+            for key, amount in (inc or {}).items():
+                doc[key] = doc.get(key, 0) + amount
+            conn.execute(
+                "UPDATE files SET doc = ?, stale = ? WHERE id = ?",
+                (json.dumps(doc), int(bool(doc.get("stale"))), unique_id)
+            )
+
+        await self._write(update)
+
+    async def stale_files(self, now: float, limit: int) -> list:
+        def stale(conn):
+            return conn.execute(
+                "SELECT id FROM files WHERE stale = 1 AND json_extract(doc, '$.source') IS NOT NULL "
+                "AND coalesce(json_extract(doc, '$.refresh_at'), 0) <= ? "
+                "ORDER BY coalesce(json_extract(doc, '$.refresh_attempted_at'), 0) LIMIT ?",
+                (now, limit)
+            ).fetchall()
+
+        return [row["id"] for row in await self._read(stale)]
+
+    async def file_counts(self) -> tuple:
+        def counts(conn):
+            return conn.execute("SELECT count(*), coalesce(sum(stale), 0) FROM files").fetchone()
+
+        total, stale = await self._read(counts)
+        return total, stale
+
+    # Channel indexer
+    async def get_index_state(self, channel_id: int) -> dict:
+        def get(conn):
+            return conn.execute("SELECT doc FROM indexer WHERE channel_id = ?", (channel_id,)).fetchone()
+
+        row = await self._read(get)
+        return dict(json.loads(row["doc"]), _id=channel_id) if row else None
+
+    async def set_index_state(self, channel_id: int, fields: dict):
+        def update(conn):
+            row = conn.execute("SELECT doc FROM indexer WHERE channel_id = ?", (channel_id,)).fetchone()
+            doc = json.loads(row["doc"]) if row else {}
+            doc.update(fields)
+            conn.execute(
+                "INSERT INTO indexer (channel_id, doc) VALUES (?, ?) "
+                "ON CONFLICT (channel_id) DO UPDATE SET doc = excluded.doc",
+                (channel_id, json.dumps(doc))
+            )
+
+        await self._write(update)
+
+    # Broadcasts
+    async def create_broadcast(self, job: dict):
+        broadcast_id = ObjectId()
+        doc = {k: v for k, v in job.items() if k != "_id"}
+
+        def insert(conn):
+            conn.execute(
+                "INSERT INTO broadcasts (id, state, doc) VALUES (?, ?, ?)",
+                (str(broadcast_id), doc.get("state"), json.dumps(doc))
+            )
+
+        await self._write(insert)
+        return broadcast_id
+
+    async def update_broadcast(self, broadcast_id, fields: dict):
+        def update(conn):
+            row = conn.execute("SELECT doc FROM broadcasts WHERE id = ?", (str(broadcast_id),)).fetchone()
+            if not row:
+                return
+            doc = json.loads(row["doc"])
+            doc.update(fields)
+            conn.execute(
+                "UPDATE broadcasts SET state = ?, doc = ? WHERE id = ?",
+                (doc.get("state"), json.dumps(doc), str(broadcast_id))
+            )
+
+        await self._write(update)
+
+    async def get_running_broadcasts(self) -> list:
+        def get(conn):
+            return conn.execute("SELECT id, doc FROM broadcasts WHERE state = 'running'").fetchall()
+
+        return [dict(json.loads(row["doc"]), _id=ObjectId(row["id"])) for row in await self._read(get)]
@@ -0,0 +1,49 @@
+"""
+Shared fixtures - every test runs against a throwaway SQLite database
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+# Config is read when first imported, point it at SQLite before anything loads it
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="moviebot-tests-"), "bot.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from pyrogram.file_id import FileId, FileType
+from config import Config
+from database import Database
+
+
+def make_file_id(media_id: int) -> str:
+    """A video file_id that decodes like a real one"""
+    return FileId(
+        file_type=FileType.VIDEO,
+        dc_id=2,
+        media_id=media_id,
+        access_hash=media_id * 7,
+        file_reference=b""
+    ).encode()
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A Database on its own SQLite file"""
+    monkeypatch.setattr(Config, "SQLITE_PATH", str(tmp_path / "bot.db"))
+    return Database()
+
+
+@pytest.fixture
+def run(database):
+    """Run a coroutine with the test database open"""
+    def run(coro):
+        async def main():
+            await database.storage.setup()
+            try:
+                return await coro
+            finally:
+                await database.storage.close()
+        return asyncio.run(main())
+    return run
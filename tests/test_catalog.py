@@ -0,0 +1,104 @@
+import io
+import json
+import pytest
+from utils import catalog
+from utils.catalog import export_catalog, import_catalog, validate_movie
+from conftest import make_file_id
+
+
+@pytest.fixture
+def catalog_db(database, monkeypatch):
+    monkeypatch.setattr(catalog, "db", database)
+    return database
+
+
+def movie_line(code: str, media_id: int, **fields) -> str:
+    doc = {"code": code, "title": code.title(), "qualities": {"720p": {"file_id": make_file_id(media_id), "size": "1 GB"}}}
+    doc.update(fields)
+    return json.dumps(doc)
+
+
+def test_validate_normalizes():
+    movie = validate_movie({
+        "title": "  Kill Bill: Vol. 1 ",
+        "qualities": {"720P": {"file_id": "abc", "size": "1 GB", "file_size": "1024", "mime_type": "video/mp4"}},
+        "parts_data": {"part_2": {"qualities": {"4k": {"file_id": "def"}}}}
+    })
+    assert movie == {
+        "code": "kill_bill_vol_1",
+        "title": "Kill Bill: Vol. 1",
+        "qualities": {"720p": {"file_id": "abc", "size": "1 GB", "file_size": 1024, "mime_type": "video/mp4"}},
+        "parts_data": {"part_2": {"qualities": {"4K": {"file_id": "def", "size": ""}}}},
+        "parts": 2
+    }
+
+
+@pytest.mark.parametrize("doc, error", [
+    ([], "not an object"),
+    ({"code": "x"}, "missing title"),
+    ({"title": "!!!"}, "missing code"),
+    ({"title": "X"}, "no files"),
+    ({"title": "X", "qualities": "720p"}, "qualities must be an object"),
+    ({"title": "X", "qualities": {"999p": {"file_id": "a"}}}, "invalid quality"),
+    ({"title": "X", "qualities": {"720p": {}}}, "has no file_id"),
+    ({"title": "X", "qualities": {"720p": {"file_id": "a", "duration": "long"}}}, "invalid duration"),
+    ({"title": "X", "parts_data": {"part_0": {}}}, "invalid part"),
+    ({"title": "X", "parts_data": {"part_2": []}}, "must be an object"),
+    ({"title": "X", "qualities": {"720p": {"file_id": "a"}}, "parts": "two"}, "parts must be a number"),
+])
+def test_validate_rejects(doc, error):
+    with pytest.raises(ValueError, match=error):
+        validate_movie(doc)
+
+
+def test_import_reports_invalid_lines(catalog_db, run):
+    lines = [
+        movie_line("alpha", 1),
+        "",
+        "{not json",
+        json.dumps({"title": "No Files"}),
+        movie_line("beta", 2)
+    ]
+    result = run(import_catalog(lines, chunk_size=1))
+    assert result["read"] == 4
+    assert result["written"] == 2
+    assert result["invalid"] == 2
+    assert result["errors"][0].startswith("line 3: ")
+    assert result["errors"][1] == "line 4: no files"
+
+
+def test_import_links_files_and_export_restores_them(catalog_db, run):
+    lines = [movie_line("alpha", 1), movie_line("beta", 1)]
+
+    async def scenario():
+        await import_catalog(lines)
+        stored = await catalog_db.get_movie("alpha")
+        unique_id = stored["qualities"]["720p"]["file"]
+        file = await catalog_db.file_registry.get(unique_id)
+
+        out = io.StringIO()
+        count = await export_catalog(out)
+        return stored, file, count, [json.loads(line) for line in out.getvalue().splitlines()]
+
+    stored, file, count, exported = run(scenario())
+    assert "file_id" not in stored["qualities"]["720p"]
+    # Both movies point to the same file
+    assert file["file_id"] == make_file_id(1)
+    assert file["refs"] == 2
+    assert count == 2
+    assert {m["code"]: m["qualities"]["720p"]["file_id"] for m in exported} == {
+        "alpha": make_file_id(1),
+        "beta": make_file_id(1)
+    }
+
+
+def test_import_is_idempotent(catalog_db, run):
+    lines = [movie_line("alpha", 1)]
+
+    async def scenario():
+        await import_catalog(lines)
+        await import_catalog(lines)
+        movie = await catalog_db.get_movie("alpha")
+        return await catalog_db.file_registry.get(movie["qualities"]["720p"]["file"])
+
+    assert run(scenario())["refs"] == 1
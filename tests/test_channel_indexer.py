@@ -0,0 +1,43 @@
+import pytest
+from utils.channel_indexer import parse_release
+
+
+@pytest.mark.parametrize("text, expected", [
+    (
+        "Kill.Bill.Part.2.2004.720p.WEB-DL.mkv",
+        {"code": "kill_bill", "title": "Kill Bill", "part": 2, "quality": "720p"}
+    ),
+    (
+        "The Matrix (1999) 1080p BluRay x264",
+        {"code": "the_matrix_1999", "title": "The Matrix 1999", "part": 1, "quality": "1080p"}
+    ),
+    (
+        "[@channel] Inception 2010 480p HEVC.mp4",
+        {"code": "inception_2010", "title": "Inception 2010", "part": 1, "quality": "480p"}
+    ),
+    (
+        "Avatar 4k",
+        {"code": "avatar", "title": "Avatar", "part": 1, "quality": "4K"}
+    ),
+    (
+        "2012 (2009) 720p",
+        {"code": "2012_2009", "title": "2012 2009", "part": 1, "quality": "720p"}
+    ),
+    (
+        "Dune Vol 3 2160p\nUploaded by someone",
+        {"code": "dune", "title": "Dune", "part": 3, "quality": "2160p"}
+    ),
+])
+def test_parse_release(text, expected):
+    assert parse_release(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    None,
+    "Some movie without a quality.mkv",
+    "Movie 7200p",
+    "720p",
+])
+def test_unparsable_release(text):
+    assert parse_release(text) is None
@@ -0,0 +1,118 @@
+from conftest import make_file_id
+from utils.file_registry import unique_id_for
+
+
+def item(code: str, quality: str, unique_id: str, part: int = 1) -> dict:
+    return {
+        "code": code,
+        "title": code.title(),
+        "part": part,
+        "quality": quality,
+        "media": {"file_id": f"file_{unique_id}", "file_unique_id": unique_id, "file_size": 1024 ** 3},
+        "source": {"chat_id": -1001, "message_id": 1}
+    }
+
+
+def movie(code: str, qualities: dict, parts_data: dict = None) -> dict:
+    doc = {
+        "code": code,
+        "title": code.title(),
+        "qualities": {q: {"file_id": make_file_id(m), "size": "1 GB"} for q, m in qualities.items()}
+    }
+    if parts_data:
+        doc["parts_data"] = {
+            part: {"qualities": {q: {"file_id": make_file_id(m)} for q, m in qualities.items()}}
+            for part, qualities in parts_data.items()
+        }
+        doc["parts"] = len(parts_data) + 1
+    return doc
+
+
+async def refs(database, *unique_ids) -> list:
+    """Reference count of each file, None once it was dropped"""
+    files = [await database.storage.get_file(uid) for uid in unique_ids]
+    return [file["refs"] if file else None for file in files]
+
+
+def test_bulk_add_files_counts_each_slot(database, run):
+    async def scenario():
+        written = await database.bulk_add_files([
+            item("alpha", "720p", "a720"),
+            item("alpha", "1080p", "shared"),
+            item("beta", "720p", "shared"),
+            item("beta", "720p", "b720", part=2)
+        ])
+        return written, await refs(database, "a720", "shared", "b720")
+
+    written, counts = run(scenario())
+    assert written == 4
+    assert counts == [1, 2, 1]
+
+
+def test_bulk_add_files_replacing_a_file_releases_the_old_one(database, run):
+    async def scenario():
+        await database.bulk_add_files([item("alpha", "720p", "old"), item("beta", "720p", "old")])
+        await database.bulk_add_files([item("alpha", "720p", "new")])
+        after_one = await refs(database, "old", "new")
+        await database.bulk_add_files([item("beta", "720p", "new")])
+        return after_one, await refs(database, "old", "new")
+
+    after_one, after_both = run(scenario())
+    assert after_one == [1, 1]
+    assert after_both == [None, 2]
+
+
+def test_bulk_add_files_same_file_again_changes_nothing(database, run):
+    async def scenario():
+        await database.bulk_add_files([item("alpha", "720p", "a720")])
+        await database.bulk_add_files([item("alpha", "720p", "a720")])
+        return await refs(database, "a720")
+
+    assert run(scenario()) == [1]
+
+
+def test_bulk_add_files_last_item_for_a_slot_wins(database, run):
+    async def scenario():
+        await database.bulk_add_files([item("alpha", "720p", "first"), item("alpha", "720p", "second")])
+        stored = await database.get_movie("alpha")
+        return stored["qualities"]["720p"]["file"], await refs(database, "first", "second")
+
+    linked, counts = run(scenario())
+    assert linked == "second"
+    assert counts == [None, 1]
+
+
+def test_bulk_upsert_movies_replaces_qualities_and_keeps_parts(database, run):
+    a, b, c, d = (unique_id_for(make_file_id(n)) for n in (1, 2, 3, 4))
+
+    async def scenario():
+        await database.bulk_upsert_movies([movie("alpha", {"720p": 1, "1080p": 2}, {"part_2": {"720p": 3}})])
+        before = await refs(database, a, b, c)
+        # qualities are replaced, parts_data is left alone when the import has none
+        await database.bulk_upsert_movies([movie("alpha", {"720p": 1, "480p": 4})])
+        return before, await refs(database, a, b, c, d)
+
+    before, after = run(scenario())
+    assert before == [1, 1, 1]
+    assert after == [1, None, 1, 1]
+
+
+def test_bulk_upsert_movies_counts_repeats_within_a_batch_once(database, run):
+    a = unique_id_for(make_file_id(1))
+
+    async def scenario():
+        await database.bulk_upsert_movies([movie("alpha", {"720p": 1}), movie("alpha", {"720p": 1})])
+        return await refs(database, a)
+
+    assert run(scenario()) == [1]
+
+
+def test_removing_a_quality_releases_its_file(database, run):
+    async def scenario():
+        await database.bulk_add_files([item("alpha", "720p", "a720"), item("alpha", "1080p", "shared"),
+                                       item("beta", "720p", "shared")])
+        await database.remove_quality("alpha", "720p")
+        await database.remove_quality("alpha", "1080p")
+        return await refs(database, "a720", "shared")
+
+    assert run(scenario()) == [None, 1]
@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+from utils import ratelimit
+from utils.ratelimit import MemoryRateStore, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    time = monotonic
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+
+def test_bucket_starts_full_and_runs_dry(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_bucket_refills_at_rate_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.try_acquire()
+
+    clock.now += 0.5
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+    clock.now += 60
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_capacity_defaults_to_rate(clock):
+    bucket = TokenBucket(rate=5)
+    assert sum(bucket.try_acquire() for _ in range(10)) == 5
+
+
+def test_paused_bucket_refuses_until_the_pause_ends(clock):
+    bucket = TokenBucket(rate=10)
+    bucket.pause(5)
+    assert not bucket.try_acquire()
+
+    clock.now += 4.9
+    assert not bucket.try_acquire()
+
+    clock.now += 0.2
+    assert bucket.try_acquire()
+
+
+def test_acquire_waits_for_a_token():
+    bucket = TokenBucket(rate=50, capacity=1)
+
+    async def take_two():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await bucket.acquire()
+        await bucket.acquire()
+        return loop.time() - start
+
+    assert asyncio.run(take_two()) >= 0.015
+
+
+def test_memory_store_limits_each_key(clock):
+    store = MemoryRateStore()
+
+    async def hits(key: str, n: int) -> list:
+        return [await store.hit(key, rate=1, capacity=2) for _ in range(n)]
+
+    assert asyncio.run(hits("a", 3)) == [True, True, False]
+    assert asyncio.run(hits("b", 1)) == [True]
+
+    clock.now += 1
+    assert asyncio.run(hits("a", 2)) == [True, False]
+
+
+def test_memory_store_drops_least_recently_used_keys(clock):
+    store = MemoryRateStore(max_keys=2)
+
+    async def hit(key: str) -> bool:
+        return await store.hit(key, rate=1, capacity=1)
+
+    asyncio.run(hit("a"))
+    asyncio.run(hit("b"))
+    asyncio.run(hit("a"))    # "a" is now the most recently used
+    asyncio.run(hit("c"))
+    assert list(store.buckets) == ["a", "c"]
+    # "b" was forgotten, so it starts over with a full bucket
+    assert asyncio.run(hit("b")) is True
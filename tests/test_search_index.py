@@ -0,0 +1,92 @@
+import pytest
+from utils.search_index import SearchIndex, edit_distance, trigrams
+
+MOVIES = [
+    ("the_matrix", "The Matrix"),
+    ("matrix_reloaded", "The Matrix Reloaded"),
+    ("interstellar", "Interstellar"),
+    ("inception", "Inception"),
+    ("it", "It")
+]
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    for code, title in MOVIES:
+        index.add({"code": code, "title": title})
+    return index
+
+
+def test_trigrams_are_padded():
+    assert trigrams("ab") == {"$$a", "$ab", "ab$", "b$$"}
+
+
+@pytest.mark.parametrize("a, b, distance", [
+    ("matrix", "matrix", 0),
+    ("matrix", "matirx", 1),      # adjacent swap counts once
+    ("matrix", "matrx", 1),
+    ("kitten", "sitting", 3),
+])
+def test_edit_distance(a, b, distance):
+    assert edit_distance(a, b, 5) == distance
+
+
+def test_edit_distance_stops_past_limit():
+    assert edit_distance("abc", "abcdef", 1) == 2
+    assert edit_distance("interstellar", "inception", 2) == 3
+
+
+def test_exact_match_ranks_shorter_titles_first(index):
+    assert index.search("matrix") == ["the_matrix", "matrix_reloaded"]
+
+
+def test_all_words_must_match(index):
+    assert index.search("matrix reloaded") == ["matrix_reloaded"]
+
+
+def test_typos_are_tolerated(index):
+    assert index.search("matirx") == ["the_matrix", "matrix_reloaded"]
+    assert index.search("intersteller") == ["interstellar"]
+
+
+def test_exact_words_skip_fuzzy_matches(index):
+    index.add({"code": "inceptio", "title": "Inceptio"})
+    assert index.search("inception") == ["inception"]
+    assert index.search("inceptoin") == ["inception", "inceptio"]
+
+
+def test_short_words_need_an_exact_match(index):
+    assert index.search("it") == ["it"]
+    assert index.search("ix") == []
+
+
+def test_unknown_words_find_nothing(index):
+    assert index.search("xyzzy") == []
+    assert index.search("matrix xyzzy") == []
+
+
+def test_limit(index):
+    assert index.search("the matrix", limit=1) == ["the_matrix"]
+
+
+def test_remove_and_refresh(index):
+    index.remove("the_matrix")
+    assert index.search("matrix") == ["matrix_reloaded"]
+    assert "matrix" in index.words
+
+    index.add({"code": "it", "title": "It Chapter Two"})
+    assert index.search("chapter") == ["it"]
+    index.add({"code": "it", "title": "It"})
+    assert index.search("chapter") == []
+    assert "chapter" not in index.words
+    assert not any("chapter" in words for words in index.grams.values())
+
+
+def test_full_index_skips_new_movies():
+    index = SearchIndex(max_movies=1)
+    index.add({"code": "a_movie", "title": "A Movie"})
+    index.add({"code": "another", "title": "Another"})
+    assert len(index) == 1
+    assert index.full
+    assert index.search("another") == []
@@ -0,0 +1,66 @@
+import asyncio
+import base64
+from bson import ObjectId
+from utils.signed_token import (
+    MAX_TOKEN_LENGTH,
+    SpentTokens,
+    is_signed_token,
+    read_token,
+    sign_token
+)
+
+SECRET = b"s" * 32
+MOVIE = ObjectId()
+
+
+def sign(quality: str = "720p", ttl: int = 3600, **kwargs) -> str:
+    args = {"secret": SECRET, "movie_id": MOVIE.binary, "part": 2, "quality": quality, "user_id": 123456789, "ttl": ttl}
+    args.update(kwargs)
+    return sign_token(**args)
+
+
+def test_round_trip():
+    token = sign()
+    data = read_token(SECRET, token)
+    assert ObjectId(data["movie_id"]) == MOVIE
+    assert data["part"] == 2
+    assert data["quality"] == "720p"
+    assert data["user_id"] == 123456789
+    assert is_signed_token(token)
+    assert len(token) <= MAX_TOKEN_LENGTH
+
+
+def test_wrong_secret():
+    assert read_token(b"x" * 32, sign()) is None
+
+
+def test_tampered_token():
+    raw = bytearray(base64.urlsafe_b64decode(sign() + "=="))
+    raw[20] ^= 1    # user_id byte
+    tampered = base64.urlsafe_b64encode(bytes(raw)).rstrip(b"=").decode()
+    assert read_token(SECRET, tampered) is None
+
+
+def test_truncated_and_garbage_tokens():
+    token = sign()
+    assert read_token(SECRET, token[:-4]) is None
+    assert read_token(SECRET, "not a token!") is None
+    assert read_token(SECRET, "") is None
+
+
+def test_expired_token():
+    assert read_token(SECRET, sign(ttl=-1)) is None
+
+
+def test_data_that_does_not_fit():
+    assert sign(part=0) is None
+    assert sign(part=256) is None
+    assert sign(movie_id=b"short") is None
+    assert sign(quality="q" * 40) is None
+
+
+def test_spent_tokens_are_single_use():
+    spent = SpentTokens()
+    data = read_token(SECRET, sign())
+    assert asyncio.run(spent.spend(data["key"], data["expires_at"])) is True
+    assert asyncio.run(spent.spend(data["key"], data["expires_at"])) is False
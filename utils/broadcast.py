@@ -0,0 +1,186 @@
+"""
+Broadcast engine - concurrent, rate limited and resumable
+"""
+import asyncio
+import logging
+import time
+from pyrogram import Client
+from pyrogram.enums import ParseMode
+from pyrogram.errors import (
+    FloodWait,
+    UserIsBlocked,
+    InputUserDeactivated,
+    UserDeactivated,
+    UserDeactivatedBan,
+    PeerIdInvalid
+)
+from config import Config
+from database import db
+from utils.metrics import raise_flood_waits
+from utils.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning the user will never receive our messages
+GONE_ERRORS = (UserIsBlocked, InputUserDeactivated, UserDeactivated, UserDeactivatedBan, PeerIdInvalid)
+
+# FloodWaits tolerated for a single user before counting it as failed
+MAX_FLOOD_RETRIES = 3
+
+# Seconds between progress message edits
+PROGRESS_INTERVAL = 5
+
+# Errors in a row (without finishing a chunk) before a broadcast is stopped
+MAX_ERRORS = 5
+
+# Seconds before retrying after the first error, doubled after every further one
+ERROR_RETRY_DELAY = 5
+
+# broadcast _id -> running task
+_running = {}
+
+
+def is_broadcasting() -> bool:
+    return any(not task.done() for task in _running.values())
+
+
+async def start_broadcast(bot: Client, source, status) -> None:
+    """Start broadcasting `source` message, reporting progress on `status`"""
+    job = {
+        "from_chat_id": source.chat.id,
+        "message_id": source.id,
+        "status_chat_id": status.chat.id,
+        "status_message_id": status.id,
+        "last_id": None,
+        "sent": 0,
+        "failed": 0,
+        "blocked": 0,
+        "state": "running",
+        "started_at": time.time()
+    }
+    job["_id"] = await db.create_broadcast(job)
+    _spawn(bot, job)
+
+
+async def resume_broadcasts(bot: Client) -> None:
+    """Continue broadcasts interrupted by a restart"""
+    for job in await db.get_running_broadcasts():
+        logger.info(f"Resuming broadcast {job['_id']} after {job.get('last_id')}")
+        _spawn(bot, job)
+
+
+def _spawn(bot: Client, job: dict):
+    if job["_id"] in _running and not _running[job["_id"]].done():
+        return
+    _running[job["_id"]] = asyncio.create_task(Broadcast(bot, job).run())
+
+
+class Broadcast:
+    def __init__(self, bot: Client, job: dict):
+        self.bot = bot
+        self.job = job
+        self.bucket = TokenBucket(Config.BROADCAST_RATE)
+        self.workers = asyncio.Semaphore(Config.BROADCAST_WORKERS)
+        self.last_progress = 0.0
+
+    async def run(self):
+        job = self.job
+        errors = 0
+        while job["state"] == "running":
+            last_id = job["last_id"]
+            try:
+                await self._send_all()
+                job["state"] = "done"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Errors only count as consecutive while no chunk gets through
+                errors = errors + 1 if job["last_id"] == last_id else 1
+                if errors >= MAX_ERRORS:
+                    logger.error(f"Broadcast {job['_id']} stopped after {errors} errors in a row: {e}")
+                    job["state"] = "failed"
+                    break
+                delay = ERROR_RETRY_DELAY * 2 ** (errors - 1)
+                logger.warning(f"Broadcast {job['_id']} error: {e}, retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+        await db.update_broadcast(job["_id"], {"state": job["state"]})
+        await self._report(final=True)
+        _running.pop(job["_id"], None)
+
+    async def _send_all(self):
+        """Send to every user after the last finished chunk"""
+        chunk = []
+        async for user in db.iter_users(after_id=self.job["last_id"]):
+            chunk.append(user)
+            if len(chunk) >= Config.BROADCAST_WORKERS * 10:
+                await self._send_chunk(chunk)
+                chunk = []
+        if chunk:
+            await self._send_chunk(chunk)
+
+    async def _send_chunk(self, users: list):
+        results = await asyncio.gather(*(self._send(u["user_id"]) for u in users))
+
+        # Counted before any write, a retry after a failed write must not send the chunk again
+        blocked = [u["user_id"] for u, r in zip(users, results) if r == "blocked"]
+        job = self.job
+        job["last_id"] = users[-1]["_id"]
+        job["sent"] += results.count("sent")
+        job["failed"] += results.count("failed")
+        job["blocked"] += len(blocked)
+
+        if blocked:
+            await db.mark_users_blocked(blocked)
+
+        # Checkpoint, a restart continues after the last finished chunk
+        await db.update_broadcast(job["_id"], {
+            "last_id": job["last_id"],
+            "sent": job["sent"],
+            "failed": job["failed"],
+            "blocked": job["blocked"]
+        })
+
+        if time.monotonic() - self.last_progress >= PROGRESS_INTERVAL:
+            await self._report()
+
+    async def _send(self, user_id: int) -> str:
+        async with self.workers:
+            for _ in range(MAX_FLOOD_RETRIES + 1):
+                await self.bucket.acquire()
+                try:
+                    # A FloodWait has to pause the shared bucket, not just this send
+                    with raise_flood_waits():
+                        await self.bot.copy_message(user_id, self.job["from_chat_id"], self.job["message_id"])
+                    return "sent"
+                except FloodWait as e:
+                    logger.warning(f"Broadcast FloodWait {e.value}s")
+                    self.bucket.pause(e.value + 1)
+                except GONE_ERRORS:
+                    return "blocked"
+                except Exception as e:
+                    logger.debug(f"Broadcast to {user_id} failed: {e}")
+                    return "failed"
+            return "failed"
+
+    async def _report(self, final: bool = False):
+        job = self.job
+        self.last_progress = time.monotonic()
+
+        if final:
+            title = "📢 **Done!**" if job["state"] == "done" else "📢 **Broadcast stopped!**"
+        else:
+            title = "📢 **Broadcasting...**"
+
+        try:
+            await self.bot.edit_message_text(
+                job["status_chat_id"],
+                job["status_message_id"],
+                f"{title}\n\n"
+                f"✅ Sent: {job['sent']}\n"
+                f"❌ Failed: {job['failed']}\n"
+                f"🚫 Blocked: {job['blocked']}",
+                parse_mode=ParseMode.MARKDOWN
+            )
+        except Exception as e:
+            logger.debug(f"Broadcast progress edit failed: {e}")
@@ -0,0 +1,221 @@
+"""
+Catalog import/export - streams movie documents as NDJSON
+
+Run from the project folder:
+    python -m utils.catalog export movies.ndjson
+    python -m utils.catalog import movies.ndjson [--ordered] [--chunk 500]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from coordination import create_store
+from database import db
+from helpers import normalize_name, normalize_quality
+from utils.invalidation import InvalidationBus
+
+logger = logging.getLogger(__name__)
+
+# Documents written per bulk_write
+CHUNK_SIZE = 500
+
+# Invalid lines reported back in detail
+MAX_REPORTED_ERRORS = 10
+
+# Exported quality field -> file registry field
+FILE_FIELDS = {"file_size": "size", "mime_type": "mime_type", "duration": "duration"}
+
+
+def _clean_qualities(qualities) -> dict:
+    if not isinstance(qualities, dict):
+        raise ValueError("qualities must be an object")
+
+    clean = {}
+    for quality, data in qualities.items():
+        name = normalize_quality(str(quality))
+        if not name:
+            raise ValueError(f"invalid quality {quality!r}")
+        if not isinstance(data, dict) or not data.get("file_id"):
+            raise ValueError(f"quality {quality!r} has no file_id")
+        clean[name] = {"file_id": str(data["file_id"]), "size": str(data.get("size", ""))}
+
+        # Optional file details kept by the file registry
+        for key in ("file_size", "duration"):
+            if data.get(key):
+                try:
+                    clean[name][key] = int(data[key])
+                except (TypeError, ValueError):
+                    raise ValueError(f"quality {quality!r} has an invalid {key}")
+        if data.get("mime_type"):
+            clean[name]["mime_type"] = str(data["mime_type"])
+    return clean
+
+
+def validate_movie(doc) -> dict:
+    """Check and normalize one movie document, raises ValueError if invalid"""
+    if not isinstance(doc, dict):
+        raise ValueError("not an object")
+
+    title = str(doc.get("title") or "").strip()
+    if not title:
+        raise ValueError("missing title")
+
+    code = normalize_name(str(doc.get("code") or title)).replace(" ", "_")
+    if not code:
+        raise ValueError("missing code")
+
+    movie = {
+        "code": code,
+        "title": title,
+        "qualities": _clean_qualities(doc.get("qualities") or {})
+    }
+
+    parts = 1
+    if doc.get("parts_data"):
+        if not isinstance(doc["parts_data"], dict):
+            raise ValueError("parts_data must be an object")
+
+        movie["parts_data"] = {}
+        for part_key, part in doc["parts_data"].items():
+            number = str(part_key).replace("part_", "", 1)
+            if not number.isdigit() or int(number) < 1:
+                raise ValueError(f"invalid part {part_key!r}")
+            if not isinstance(part, dict):
+                raise ValueError(f"part {part_key!r} must be an object")
+            movie["parts_data"][f"part_{int(number)}"] = {
+                "qualities": _clean_qualities(part.get("qualities") or {})
+            }
+            parts = max(parts, int(number))
+
+    try:
+        movie["parts"] = max(parts, int(doc.get("parts", 1)))
+    except (TypeError, ValueError):
+        raise ValueError("parts must be a number")
+
+    if not movie["qualities"] and not movie.get("parts_data"):
+        raise ValueError("no files")
+    return movie
+
+
+def _entries(movie: dict) -> list:
+    groups = [movie.get("qualities") or {}]
+    groups += [p.get("qualities") or {} for p in (movie.get("parts_data") or {}).values()]
+    return [entry for qualities in groups for entry in qualities.values()]
+
+
+async def _write_chunk(fp, movies: list):
+    """Write movies with registry references expanded back into file_ids"""
+    files = await db.file_registry.resolve(
+        entry["file"] for movie in movies for entry in _entries(movie) if entry.get("file")
+    )
+    for movie in movies:
+        for entry in _entries(movie):
+            file = files.get(entry.pop("file", None))
+            if file:
+                entry["file_id"] = file["file_id"]
+                entry.update({k: file[v] for k, v in FILE_FIELDS.items() if file.get(v)})
+        fp.write(json.dumps(movie, ensure_ascii=False) + "\n")
+
+
+async def export_catalog(fp, progress=None) -> int:
+    """Write every movie to fp, one JSON document per line"""
+    count = 0
+    chunk = []
+    async for movie in db.iter_movies():
+        chunk.append(movie)
+        if len(chunk) >= CHUNK_SIZE:
+            await _write_chunk(fp, chunk)
+            count += len(chunk)
+            chunk = []
+            if progress:
+                await progress(count)
+    if chunk:
+        await _write_chunk(fp, chunk)
+        count += len(chunk)
+    return count
+
+
+async def import_catalog(lines, ordered: bool = False, chunk_size: int = CHUNK_SIZE, progress=None) -> dict:
+    """Validate NDJSON lines and upsert them in chunks"""
+    result = {"read": 0, "written": 0, "invalid": 0, "errors": []}
+    chunk, line_numbers = [], []
+
+    def reject(line_no, error):
+        result["invalid"] += 1
+        if len(result["errors"]) < MAX_REPORTED_ERRORS:
+            result["errors"].append(f"line {line_no}: {error}")
+
+    async def write() -> bool:
+        written, failed = await db.bulk_upsert_movies(chunk, ordered=ordered)
+        result["written"] += written
+        for index, error in failed:
+            reject(line_numbers[index], error)
+        chunk.clear()
+        line_numbers.clear()
+        if progress:
+            await progress(result)
+        return not failed
+
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        result["read"] += 1
+
+        try:
+            movie = validate_movie(json.loads(line))
+        except ValueError as e:    # includes JSONDecodeError
+            reject(line_no, e)
+            continue
+
+        chunk.append(movie)
+        line_numbers.append(line_no)
+        if len(chunk) >= chunk_size:
+            # Ordered imports stop at the first failed write
+            if not await write() and ordered:
+                return result
+
+    if chunk:
+        await write()
+    return result
+
+
+async def _cli(args):
+    store = create_store()
+    # Workers sharing the database reload the movies an import changes
+    bus = InvalidationBus(store, db, origin="catalog")
+    await store.setup()
+    await db.start()
+    try:
+        if args.action == "export":
+            async def progress(count):
+                print(f"Exported {count}", file=sys.stderr)
+
+            with open(args.file, "w", encoding="utf-8") as fp:
+                count = await export_catalog(fp, progress)
+            print(f"✅ Exported {count} movies to {args.file}")
+        else:
+            async def progress(result):
+                print(f"Read {result['read']}, written {result['written']}, invalid {result['invalid']}", file=sys.stderr)
+
+            bus.start()
+            with open(args.file, encoding="utf-8") as fp:
+                result = await import_catalog(fp, ordered=args.ordered, chunk_size=args.chunk, progress=progress)
+            print(f"✅ Imported {result['written']} of {result['read']} movies ({result['invalid']} invalid)")
+            for error in result["errors"]:
+                print(f"   {error}")
+    finally:
+        await bus.stop()
+        await db.stop()
+        await store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import or export the movie catalog as NDJSON")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("file")
+    parser.add_argument("--ordered", action="store_true", help="stop at the first write error")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="documents per bulk write")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(_cli(parser.parse_args()))
@@ -0,0 +1,200 @@
+"""
+Channel indexer - catalogs files posted in the backup channel
+"""
+import asyncio
+import logging
+import re
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+from config import Config
+from database import db
+from helpers import normalize_name, normalize_quality, extract_media, message_source
+
+logger = logging.getLogger(__name__)
+
+# Message ids fetched per get_messages call (Telegram maximum)
+HISTORY_BATCH = 200
+
+# Consecutive empty batches that mark the end of the channel
+EMPTY_BATCHES_TO_STOP = 5
+
+QUALITY_RE = re.compile(r"(?<![a-z0-9])(360p|480p|720p|1080p|1440p|2160p|4k)(?![a-z0-9])", re.I)
+PART_RE = re.compile(r"(?<![a-z0-9])(?:part|pt|vol)[\s._-]*(\d{1,3})(?![0-9])", re.I)
+YEAR_RE = re.compile(r"(?<![0-9])(?:19|20)\d{2}(?![0-9])")
+EXTENSION_RE = re.compile(r"\.(mkv|mp4|avi|mov|webm|m4v|ts)$", re.I)
+TAG_RE = re.compile(
+    r"(?<![a-z0-9])(web[\s-]?dl|web[\s-]?rip|blu[\s-]?ray|br[\s-]?rip|hd[\s-]?rip|dvd[\s-]?rip|"
+    r"hdtv|hdcam|x264|x265|h264|h265|hevc|10bit|aac|dual[\s-]?audio|esubs?|hindi|english)(?![a-z0-9])",
+    re.I
+)
+
+# One indexer scan at a time
+_scan_task = None
+
+
+def parse_release(text: str) -> dict:
+    """
+    Title, part and quality from a caption or file name
+    Example: "Kill.Bill.Part.2.2004.720p.WEB-DL.mkv" -> Kill Bill 2004, part 2, 720p
+    """
+    if not text:
+        return None
+
+    name = EXTENSION_RE.sub("", text.strip().splitlines()[0])
+    name = re.sub(r"@\w+|\[[^\]]*\]", " ", name)
+    name = re.sub(r"[._]+", " ", name)
+
+    quality_match = QUALITY_RE.search(name)
+    if not quality_match:
+        return None
+    quality = normalize_quality(quality_match.group(1))
+
+    part = 1
+    part_match = PART_RE.search(name)
+    if part_match:
+        part = max(1, int(part_match.group(1)))
+
+    # Title ends at the first quality / part / release tag
+    end = quality_match.start()
+    for match in (part_match, TAG_RE.search(name)):
+        if match:
+            end = min(end, match.start())
+
+    # ...or right after the release year, dropping anything in between
+    years = [y for y in YEAR_RE.finditer(name, 0, end) if y.start() > 0]
+    if years:
+        end = years[-1].end()
+
+    title = re.sub(r"[()\[\]]", " ", name[:end])
+    title = re.sub(r"\s+", " ", title).strip(" -")
+    code = normalize_name(title).replace(" ", "_")
+    if not code:
+        return None
+
+    return {"code": code, "title": title, "part": part, "quality": quality}
+
+
+def message_to_file(message) -> dict:
+    """Catalog entry for a channel post, None if it cannot be parsed"""
+    media = extract_media(message)
+    if not media:
+        return None
+
+    release = parse_release(message.caption or "") or parse_release(media["file_name"])
+    if not release:
+        return None
+
+    release["media"] = media
+    release["source"] = message_source(message)
+    return release
+
+
+class LiveIndexer:
+    """Buffers new channel posts and writes them in small batches"""
+
+    def __init__(self, delay: float = 3, batch_size: int = 50):
+        self.delay = delay
+        self.batch_size = batch_size
+        self.buffer = []
+        self._flush_task = None
+        # Running flushes, kept so they are not garbage collected mid-write
+        self._tasks = set()
+
+    def add(self, message):
+        entry = message_to_file(message)
+        if not entry:
+            logger.info(f"Indexer skipped message {message.id}: no title/quality found")
+            return
+
+        self.buffer.append(entry)
+        if len(self.buffer) >= self.batch_size:
+            self._spawn(self.flush())
+        else:
+            self._flush_soon()
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _flush_soon(self):
+        if self._flush_task is None or self._flush_task.done() or self._flush_task is asyncio.current_task():
+            self._flush_task = self._spawn(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        try:
+            await db.bulk_add_files(batch)
+        except Exception as e:
+            # Put the batch back ahead of newer posts and try again later
+            logger.error(f"Indexer write of {len(batch)} files failed, retrying in {self.delay}s: {e}")
+            self.buffer[:0] = batch
+            self._flush_soon()
+            return
+        logger.info(f"Indexed {len(batch)} new channel files")
+
+
+live_indexer = LiveIndexer()
+
+
+def is_scanning() -> bool:
+    return _scan_task is not None and not _scan_task.done()
+
+
+def start_scan(bot: Client, channel_id: int, start_id: int = None, progress=None):
+    """Scan channel history in the background from the saved high-water mark"""
+    global _scan_task
+    _scan_task = asyncio.create_task(scan_history(bot, channel_id, start_id, progress))
+    return _scan_task
+
+
+async def scan_history(bot: Client, channel_id: int, start_id: int = None, progress=None) -> dict:
+    """Walk channel messages by id and catalog every parsable file"""
+    state = await db.get_index_state(channel_id)
+    next_id = (start_id if start_id is not None else state["last_message_id"]) + 1
+    result = {"scanned": 0, "indexed": 0, "skipped": 0, "last_message_id": next_id - 1}
+    empty_batches = 0
+
+    while empty_batches < EMPTY_BATCHES_TO_STOP:
+        ids = list(range(next_id, next_id + HISTORY_BATCH))
+        try:
+            messages = await bot.get_messages(channel_id, ids)
+        except FloodWait as e:
+            logger.warning(f"Indexer FloodWait {e.value}s")
+            await asyncio.sleep(e.value + 1)
+            continue
+
+        found = [m for m in messages if m and not m.empty]
+        empty_batches = 0 if found else empty_batches + 1
+
+        entries = []
+        for message in found:
+            result["scanned"] += 1
+            entry = message_to_file(message)
+            if entry:
+                entries.append(entry)
+            elif message.video or message.document:
+                result["skipped"] += 1
+
+        if entries:
+            await db.bulk_add_files(entries)
+            result["indexed"] += len(entries)
+
+        next_id += HISTORY_BATCH
+        if found:
+            # High-water mark: a rerun continues after the last seen message
+            result["last_message_id"] = max(m.id for m in found)
+            await db.set_index_state(channel_id, {"last_message_id": result["last_message_id"]})
+
+        if progress:
+            await progress(result)
+        await asyncio.sleep(Config.INDEX_DELAY)
+
+    return result
@@ -0,0 +1,295 @@
+"""
+Delivery - sends redeemed files, retrying failed sends from a persistent queue
+
+A send that fails for a reason that may pass (a FloodWait, a Telegram hiccup,
+a file_id that needs refreshing) is stored under its token and retried with
+doubling delays. Opening the same token link again retries that delivery
+instead of reporting the token as used. Files that keep failing are reported
+to the admin.
+"""
+import asyncio
+import logging
+import random
+import time
+from pyrogram import Client
+from pyrogram.enums import ParseMode
+from pyrogram.errors import FloodWait, InternalServerError, ServiceUnavailable
+from config import Config
+from database import db
+from utils.broadcast import GONE_ERRORS
+from utils.file_registry import DEAD_FILE_ERRORS, quality_entry
+
+logger = logging.getLogger(__name__)
+
+# Errors that say nothing about the file being sent
+NOT_THE_FILE = (FloodWait, InternalServerError, ServiceUnavailable, OSError, asyncio.TimeoutError, *GONE_ERRORS)
+
+# Seconds a claimed delivery is kept from other senders
+CLAIM_SECONDS = 120
+
+# Seconds between looks at the queue
+POLL_INTERVAL = 5
+
+# Due deliveries taken per look
+RETRY_BATCH = 50
+
+
+def backoff(attempts: int) -> float:
+    """Delay before the next try after `attempts` failed ones"""
+    delay = min(Config.DELIVERY_RETRY_MAX, Config.DELIVERY_RETRY_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class DeliveryQueue:
+    def __init__(self):
+        # FloodWaits hold up every send of the bot, not just one delivery
+        self.paused_until = 0
+        self._task = None
+
+    async def deliver(self, bot: Client, token_data: dict, status):
+        """Send the file of a freshly redeemed token, queueing it if that fails"""
+        now = time.time()
+        job = {
+            "token": token_data["token"],
+            "user_id": token_data["user_id"],
+            "movie_code": token_data.get("movie_code"),
+            "part": token_data.get("part", 1),
+            "quality": token_data.get("quality", ""),
+            "state": "pending",
+            "attempts": 0,
+            "next_at": now,
+            "status_id": status.id,
+            "created_at": now,
+            "expires_at": now + Config.DELIVERY_KEEP
+        }
+        if now < self.paused_until:
+            # A send now would only hit the same FloodWait
+            db.count("deliveries_queued")
+            await self._queue(bot, job, status, self.paused_until)
+            return
+        await self._attempt(bot, job, status, stored=False)
+
+    async def retry(self, bot: Client, token: str, user_id: int, status) -> bool:
+        """Retry the queued delivery of a token opened again, False if it has none"""
+        job = await db.get_delivery(token)
+        if not job or job["user_id"] != user_id:
+            return False
+
+        if job["state"] == "sent":
+            await status.edit_text("✅ **This file was already sent to you!** Check the messages above.")
+            return True
+
+        if job["state"] == "failed":
+            # The user asked again, start over
+            job.update({"state": "pending", "attempts": 0, "next_at": time.time()})
+            await db.save_delivery(job)
+
+        claimed = None
+        if time.time() >= self.paused_until:
+            claimed = await db.claim_delivery(token, CLAIM_SECONDS)
+        if not claimed:
+            wait = max(1, int(max(job["next_at"], self.paused_until) - time.time()))
+            await status.edit_text(
+                f"⏳ **Your file is on its way!**\n\n"
+                f"It will be sent automatically in about {wait}s, no need to search again."
+            )
+            return True
+
+        claimed["status_id"] = status.id
+        await self._attempt(bot, claimed, status)
+        return True
+
+    async def _attempt(self, bot: Client, job: dict, status=None, stored: bool = True):
+        """Try to send a delivery once, stored=False for one not in the queue yet"""
+        part, quality = job["part"], job["quality"]
+        try:
+            movie = await db.get_movie(job["movie_code"])
+            entry = quality_entry(movie, quality, part if part > 1 else None)
+
+            # Older movies embed the file_id, newer ones point to the file registry
+            unique_id = entry.get("file")
+            file_id = entry.get("file_id")
+            if unique_id:
+                file = await db.file_registry.get(unique_id)
+                file_id = file["file_id"] if file else None
+        except Exception as e:
+            # The token is already spent, a storage hiccup must not lose the delivery
+            await self._failed(bot, job, status, stored, None, None, e)
+            return
+
+        if not movie:
+            await self._give_up(bot, job, status, stored, "❌ **Movie not found!** It may have been removed.")
+            return
+
+        if not file_id:
+            await self._give_up(bot, job, status, stored, "❌ **File not available!** Please try searching again.")
+            return
+
+        await self._status(bot, job, status, "📤 **Sending your file...**")
+
+        caption = (
+            f"🎬 **{movie['title']}**\n\n"
+            f"📦 Part: {part}\n"
+            f"🎞️ Quality: {quality}\n"
+            f"📁 Size: {entry.get('size', '')}\n\n"
+            f"✅ Enjoy your movie!"
+        )
+        try:
+            await self._send(bot, job["user_id"], file_id, unique_id, caption)
+        except Exception as e:
+            await self._failed(bot, job, status, stored, movie, unique_id, e)
+            return
+
+        await self._delete_status(bot, job, status)
+        if unique_id:
+            await db.file_registry.mark_sent(unique_id)
+        if stored:
+            job.update({"state": "sent", "attempts": job["attempts"] + 1})
+            await db.save_delivery(job)
+            db.count("deliveries_retried")
+        logger.info(f"✅ File sent to {job['user_id']}: {movie['title']} - {quality}")
+
+    async def _send(self, bot: Client, user_id: int, file_id: str, unique_id: str, caption: str):
+        try:
+            await bot.send_cached_media(chat_id=user_id, file_id=file_id, caption=caption, parse_mode=ParseMode.MARKDOWN)
+            return
+        except DEAD_FILE_ERRORS as e:
+            if not unique_id:
+                raise
+            # Dead file_id: flag it and fetch a fresh one from the source message
+            await db.file_registry.mark_failed(unique_id, e)
+            file_id = await db.file_registry.refresh(bot, unique_id)
+            if not file_id:
+                raise
+        except NOT_THE_FILE:
+            raise
+        except Exception as e:
+            logger.error(f"❌ send_cached_media error: {e}")
+            # Fallback: try sending as document
+            await bot.send_document(chat_id=user_id, document=file_id, caption=caption, parse_mode=ParseMode.MARKDOWN)
+            return
+
+        await bot.send_cached_media(chat_id=user_id, file_id=file_id, caption=caption, parse_mode=ParseMode.MARKDOWN)
+
+    async def _failed(self, bot: Client, job: dict, status, stored: bool, movie: dict, unique_id: str, error: Exception):
+        now = time.time()
+        attempts = job["attempts"] + 1
+        job.update({"attempts": attempts, "last_error": f"{type(error).__name__}: {error}"[:200]})
+
+        if isinstance(error, GONE_ERRORS):
+            # The user blocked the bot, nothing to retry
+            if stored:
+                job.update({"state": "failed", "next_at": now})
+                await db.save_delivery(job)
+            return
+
+        if unique_id and not isinstance(error, NOT_THE_FILE):
+            failures = await db.file_registry.count_failure(unique_id, error)
+            if failures == Config.FILE_ALERT_FAILURES:
+                await self._alert(bot, movie, job, unique_id, failures, error)
+
+        if isinstance(error, FloodWait):
+            delay = error.value + 1
+            self.paused_until = max(self.paused_until, now + delay)
+        else:
+            delay = backoff(attempts)
+
+        if attempts >= Config.DELIVERY_MAX_ATTEMPTS:
+            logger.error(f"❌ Delivery to {job['user_id']} failed {attempts} times: {error}")
+            db.count("deliveries_failed")
+            await self._give_up(
+                bot, job, status, True,
+                "❌ **Error sending file!**\n\n"
+                "Open the same link again later to retry, or contact admin."
+            )
+            return
+
+        logger.warning(f"Delivery to {job['user_id']} failed ({error}), retrying in {delay:.0f}s")
+        if not stored:
+            db.count("deliveries_queued")
+        await self._queue(bot, job, status, now + delay)
+
+    async def _queue(self, bot: Client, job: dict, status, next_at: float):
+        """Store a delivery for the retry loop and tell the user when to expect it"""
+        job.update({"state": "pending", "next_at": next_at})
+        await db.save_delivery(job)
+        await self._status(
+            bot, job, status,
+            f"⏳ **Telegram is busy right now.**\n\n"
+            f"Your file will be sent automatically in about {max(1, int(next_at - time.time()))}s, "
+            f"no need to search again."
+        )
+
+    async def _give_up(self, bot: Client, job: dict, status, save: bool, text: str):
+        if save:
+            job.update({"state": "failed", "next_at": time.time()})
+            await db.save_delivery(job)
+        await self._status(bot, job, status, text)
+
+    async def _alert(self, bot: Client, movie: dict, job: dict, unique_id: str, failures: int, error: Exception):
+        try:
+            await bot.send_message(
+                Config.ADMIN_ID,
+                f"⚠️ **File keeps failing!**\n\n"
+                f"🎬 {movie['title']} (`{movie['code']}`)\n"
+                f"📦 Part {job['part']} - {job['quality']}\n"
+                f"🗂️ File: `{unique_id}`\n"
+                f"❌ {failures} failed sends in a row, last error: `{error}`\n\n"
+                f"Re-upload it with /add or /addpart if it does not recover.",
+                parse_mode=ParseMode.MARKDOWN
+            )
+        except Exception as e:
+            logger.error(f"Broken file alert failed: {e}")
+
+    async def _status(self, bot: Client, job: dict, status, text: str):
+        """Show text on the user's status message, the one the request started with"""
+        try:
+            if status is not None:
+                await status.edit_text(text)
+            elif job.get("status_id"):
+                await bot.edit_message_text(job["user_id"], job["status_id"], text)
+        except Exception as e:
+            logger.debug(f"Delivery status edit failed: {e}")
+
+    async def _delete_status(self, bot: Client, job: dict, status):
+        try:
+            if status is not None:
+                await status.delete()
+            elif job.get("status_id"):
+                await bot.delete_messages(job["user_id"], job["status_id"])
+        except Exception as e:
+            logger.debug(f"Delivery status delete failed: {e}")
+
+    # ============ RETRY LOOP ============
+
+    async def retry_due(self, bot: Client) -> int:
+        """Retry deliveries whose next try is due, returns how many were tried"""
+        tried = 0
+        for job in await db.due_deliveries(RETRY_BATCH):
+            if time.time() < self.paused_until:
+                break
+            claimed = await db.claim_delivery(job["token"], CLAIM_SECONDS)
+            if claimed:
+                await self._attempt(bot, claimed)
+                tried += 1
+        return tried
+
+    async def _run(self, bot: Client):
+        while True:
+            await asyncio.sleep(max(POLL_INTERVAL, self.paused_until - time.time()))
+            try:
+                await self.retry_due(bot)
+            except Exception as e:
+                logger.error(f"Delivery retry error: {e}")
+
+    def start(self, bot: Client):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+delivery = DeliveryQueue()
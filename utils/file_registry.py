@@ -0,0 +1,230 @@
+"""
+File registry - one document per Telegram file, referenced from movies by file_unique_id
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from pyrogram.errors import (
+    FileIdInvalid,
+    FileReferenceEmpty,
+    FileReferenceExpired,
+    FileReferenceInvalid,
+    MediaEmpty
+)
+from pyrogram.file_id import FileId, FileUniqueId, FileUniqueType
+from helpers import extract_media
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Send errors meaning the stored file_id no longer works
+DEAD_FILE_ERRORS = (FileIdInvalid, FileReferenceEmpty, FileReferenceExpired, FileReferenceInvalid, MediaEmpty)
+
+# A successful send is written back at most once per interval per file
+SENT_WRITE_INTERVAL = 3600
+
+# Stale files retried per refresh round
+REFRESH_BATCH = 100
+
+# Longest wait between refresh attempts of a file that keeps failing
+REFRESH_BACKOFF_MAX = 7 * 86400
+
+
+def unique_id_for(file_id: str) -> str:
+    """file_unique_id of a video or document file_id, None if it cannot be decoded"""
+    try:
+        media_id = FileId.decode(file_id).media_id
+        return FileUniqueId(file_unique_type=FileUniqueType.DOCUMENT, media_id=media_id).encode()
+    except Exception:
+        return None
+
+
+def quality_entry(movie: dict, quality: str, part: int = None) -> dict:
+    """Quality entry of a movie, part=None means the main qualities"""
+    if not movie:
+        return {}
+    if part is None:
+        qualities = movie.get("qualities", {})
+    else:
+        qualities = movie.get("parts_data", {}).get(f"part_{part}", {}).get("qualities", {})
+    return qualities.get(quality) or {}
+
+
+def movie_refs(movie: dict) -> Counter:
+    """How often each registered file is referenced by a movie"""
+    refs = Counter()
+    if not movie:
+        return refs
+
+    groups = [movie.get("qualities") or {}]
+    groups += [p.get("qualities") or {} for p in (movie.get("parts_data") or {}).values()]
+    for qualities in groups:
+        for entry in qualities.values():
+            if entry.get("file"):
+                refs[entry["file"]] += 1
+    return refs
+
+
+class FileRegistry:
+    """Stores file_id, size and delivery health for every file a movie points to"""
+
+    def __init__(self, storage, cache_size: int = 5000, cache_ttl: float = 600, refresh_interval: float = 3600):
+        self.storage = storage
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.refresh_interval = refresh_interval
+        self._sent = TTLCache(cache_size, SENT_WRITE_INTERVAL)
+        self._task = None
+        # Called with the file_unique_id of every changed file, set when workers share the registry
+        self.on_change = None
+
+    @staticmethod
+    def _fields(media: dict, source: dict = None) -> dict:
+        fields = {"file_id": media["file_id"], "stale": False, "updated_at": time.time(), "refresh_attempts": 0}
+        # Files known only by file_id (catalog imports) keep their stored details
+        if media.get("file_size"):
+            fields["size"] = media["file_size"]
+        if media.get("mime_type"):
+            fields["mime_type"] = media["mime_type"]
+        if media.get("duration"):
+            fields["duration"] = media["duration"]
+        if source:
+            fields["source"] = source
+        return fields
+
+    async def register(self, media: dict, source: dict = None) -> str:
+        """Add or update one file, returns its file_unique_id"""
+        await self.register_many([(media, source)])
+        return media["file_unique_id"]
+
+    async def register_many(self, files: list):
+        """Add or update (media, source) pairs in one write"""
+        if not files:
+            return
+        await self.storage.upsert_files([(m["file_unique_id"], self._fields(m, s)) for m, s in files])
+        for media, _ in files:
+            self._changed(media["file_unique_id"])
+
+    async def adjust(self, added: Counter = None, removed: Counter = None):
+        """Apply reference count changes, dropping files nothing points to anymore"""
+        delta = Counter(added or {})
+        delta.subtract(removed or {})
+        delta = {uid: n for uid, n in delta.items() if n}
+        if not delta:
+            return
+
+        await self.storage.adjust_file_refs(delta)
+        for uid, n in delta.items():
+            if n < 0:
+                self._changed(uid)
+
+    def _changed(self, unique_id: str):
+        self.cache.pop(unique_id)
+        if self.on_change:
+            self.on_change(unique_id)
+
+    async def get(self, unique_id: str) -> dict:
+        file = self.cache.get(unique_id)
+        if file is None:
+            file = await self.storage.get_file(unique_id)
+            if file:
+                self.cache.set(unique_id, file)
+        return file
+
+    async def resolve(self, unique_ids) -> dict:
+        """file_unique_id -> file document for many files in one query"""
+        return await self.storage.get_files(list(unique_ids))
+
+    async def mark_sent(self, unique_id: str):
+        if unique_id in self._sent:
+            return
+        self._sent.set(unique_id, True)
+        await self.storage.update_file(unique_id, {"last_sent_at": time.time(), "failures": 0, "stale": False})
+        self._changed(unique_id)
+
+    async def mark_failed(self, unique_id: str, error: Exception):
+        """Flag a file whose file_id was rejected by Telegram"""
+        self._sent.pop(unique_id)
+        self._changed(unique_id)
+        await self.storage.update_file(
+            unique_id,
+            {"stale": True, "last_error": str(error)[:200], "failed_at": time.time()}
+        )
+
+    async def count_failure(self, unique_id: str, error: Exception) -> int:
+        """Count a delivery of the file that failed, returns the failures since its last successful send"""
+        self._sent.pop(unique_id)
+        await self.storage.update_file(
+            unique_id,
+            {"last_error": str(error)[:200], "failed_at": time.time()},
+            inc={"failures": 1}
+        )
+        self._changed(unique_id)
+        file = await self.storage.get_file(unique_id)
+        return file.get("failures", 0) if file else 0
+
+    async def refresh(self, bot, unique_id: str) -> str:
+        """Fetch a fresh file_id from the message the file came from"""
+        file = await self.storage.get_file(unique_id)
+        source = (file or {}).get("source")
+        if not source:
+            return None
+
+        try:
+            message = await bot.get_messages(source["chat_id"], source["message_id"])
+        except Exception as e:
+            logger.warning(f"File refresh {unique_id} failed: {e}")
+            await self._refresh_failed(unique_id, file)
+            return None
+
+        media = extract_media(message) if message and not message.empty else None
+        if not media or media["file_unique_id"] != unique_id:
+            logger.warning(f"File refresh {unique_id}: source message no longer has the file")
+            await self._refresh_failed(unique_id, file)
+            return None
+
+        await self.register(media, source)
+        logger.info(f"Refreshed file_id of {unique_id}")
+        return media["file_id"]
+
+    async def _refresh_failed(self, unique_id: str, file: dict):
+        """Put off the next refresh of a file, twice as long after every failed one"""
+        now = time.time()
+        attempts = file.get("refresh_attempts", 0) + 1
+        delay = min(REFRESH_BACKOFF_MAX, self.refresh_interval * 2 ** (attempts - 1))
+        await self.storage.update_file(
+            unique_id,
+            {"refresh_attempted_at": now, "refresh_at": now + delay},
+            inc={"refresh_attempts": 1}
+        )
+
+    async def refresh_stale(self, bot) -> int:
+        """Refresh stale files that have a known source message and are due for another try"""
+        refreshed = 0
+        for unique_id in await self.storage.stale_files(time.time(), REFRESH_BATCH):
+            if await self.refresh(bot, unique_id):
+                refreshed += 1
+        return refreshed
+
+    async def get_counts(self) -> tuple:
+        """(total, stale) number of registered files"""
+        return await self.storage.file_counts()
+
+    async def _run(self, bot):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                refreshed = await self.refresh_stale(bot)
+                if refreshed:
+                    logger.info(f"Refreshed {refreshed} stale files")
+            except Exception as e:
+                logger.error(f"Stale file refresh error: {e}")
+
+    def start(self, bot):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,74 @@
+"""
+Invalidation bus - keeps per-process caches coherent when several workers share a database
+"""
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "invalidate"
+
+# Keys per published message
+BATCH = 1000
+
+
+class InvalidationBus:
+    """Publishes this worker's movie and file changes and applies everyone else's"""
+
+    def __init__(self, store, database, origin: str = None):
+        self.store = store
+        self.db = database
+        self.origin = origin or f"{os.getpid()}"
+        self.pending = {"movies": set(), "files": set()}
+        self._flush = None
+        self._task = None
+
+    def announce(self, kind: str, key: str):
+        """Queue a change, everything changed in the same loop iteration goes out together"""
+        self.pending[kind].add(key)
+        if self._flush is None:
+            self._flush = asyncio.ensure_future(self._publish())
+
+    async def _publish(self):
+        await asyncio.sleep(0)
+        pending, self.pending = self.pending, {"movies": set(), "files": set()}
+        self._flush = None
+
+        for kind, keys in pending.items():
+            keys = list(keys)
+            for i in range(0, len(keys), BATCH):
+                try:
+                    await self.store.publish(CHANNEL, {"origin": self.origin, kind: keys[i:i + BATCH]})
+                except Exception as e:
+                    logger.error(f"Invalidation publish error: {e}")
+
+    async def _listen(self):
+        while True:
+            try:
+                async for message in self.store.subscribe(CHANNEL):
+                    if message.get("origin") == self.origin:
+                        continue
+                    if message.get("movies"):
+                        await self.db.reload_movies(message["movies"])
+                    for unique_id in message.get("files", []):
+                        self.db.file_registry.cache.pop(unique_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Invalidation listener error: {e}")
+            await asyncio.sleep(1)
+
+    def start(self):
+        self.db.on_invalidate = self.announce
+        self.db.file_registry.on_change = lambda unique_id: self.announce("files", unique_id)
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        self.db.on_invalidate = None
+        self.db.file_registry.on_change = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._flush is not None:
+            await self._flush
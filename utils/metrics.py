@@ -0,0 +1,113 @@
+"""
+Prometheus metrics - served by the web server on /metrics
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import time
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from pyrogram import Client
+from pyrogram.errors import FloodWait, RPCError
+from pyrogram.session import Session
+from utils import tracing
+
+logger = logging.getLogger(__name__)
+
+# False while Telegram calls should raise every FloodWait instead of sleeping through it
+_flood_sleep = contextvars.ContextVar("flood_sleep", default=True)
+
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Time spent in update handlers", ["handler"])
+DB_LATENCY = Histogram("bot_db_seconds", "Time spent in Database methods", ["method"])
+TMDB_LATENCY = Histogram("bot_tmdb_seconds", "TMDB request latency")
+CACHE_HIT_RATIO = Gauge("bot_cache_hit_ratio", "Hit ratio of in-process caches", ["cache"])
+TELEGRAM_ERRORS = Counter("bot_telegram_errors_total", "Telegram API errors", ["error"])
+FLOOD_WAITS = Counter("bot_telegram_flood_waits_total", "FloodWait errors from Telegram")
+FLOOD_WAIT_SECONDS = Counter("bot_telegram_flood_wait_seconds_total", "Seconds Telegram asked us to wait")
+EVENTS = Counter("bot_events_total", "Counted bot events such as issued and redeemed tokens", ["event"])
+
+
+def render() -> bytes:
+    """Current metrics in the Prometheus text format"""
+    return generate_latest()
+
+
+def timed(func):
+    """Record a handler's latency under its function name, each call is a trace root"""
+    traced = tracing.wrap(func, f"handler.{func.__name__}", root=True, attributes=tracing.update_attributes)
+    return _timed(traced, HANDLER_LATENCY.labels(handler=func.__name__))
+
+
+def timed_methods(histogram):
+    """Class decorator recording every public coroutine method by name"""
+    def decorate(cls):
+        for name, func in list(vars(cls).items()):
+            if name.startswith("_") or not inspect.iscoroutinefunction(func):
+                continue
+            traced = tracing.wrap(func, f"{cls.__name__.lower()}.{name}")
+            setattr(cls, name, _timed(traced, histogram.labels(method=name)))
+        return cls
+    return decorate
+
+
+def _timed(func, histogram):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    return wrapper
+
+
+def track_cache(name: str, cache):
+    """Export the hit ratio of a TTLCache"""
+    CACHE_HIT_RATIO.labels(cache=name).set_function(lambda: cache.hit_ratio)
+
+
+@contextlib.contextmanager
+def raise_flood_waits():
+    """Raise FloodWaits of calls made inside at once, for callers that pace themselves"""
+    token = _flood_sleep.set(False)
+    try:
+        yield
+    finally:
+        _flood_sleep.reset(token)
+
+
+class InstrumentedClient(Client):
+    """Client counting every Telegram API error raised to the bot, and tracing its calls
+
+    FloodWaits below the sleep threshold are slept through here rather than in
+    the session, which would wait them out without the client seeing them.
+    """
+
+    async def invoke(self, query, retries: int = Session.MAX_RETRIES, timeout: float = Session.WAIT_TIMEOUT,
+                     sleep_threshold: float = None):
+        threshold = self.sleep_threshold if sleep_threshold is None else sleep_threshold
+        span = token = error = None
+        if tracing.ENABLED:
+            span, token = tracing.start_span(f"telegram.{type(query).__name__}", tracing.CLIENT)
+        try:
+            while True:
+                try:
+                    return await super().invoke(query, retries, timeout, 0)
+                except FloodWait as e:
+                    FLOOD_WAITS.inc()
+                    FLOOD_WAIT_SECONDS.inc(e.value)
+                    TELEGRAM_ERRORS.labels(error="FloodWait").inc()
+                    if e.value > threshold >= 0 or not _flood_sleep.get():
+                        raise
+                    logger.warning(f"Waiting {e.value}s before continuing (required by {type(query).__name__})")
+                    await asyncio.sleep(e.value)
+        except RPCError as e:
+            if not isinstance(e, FloodWait):
+                TELEGRAM_ERRORS.labels(error=type(e).__name__).inc()
+            error = e
+            raise
+        finally:
+            if tracing.ENABLED:
+                tracing.end_span(span, token, error)
@@ -0,0 +1,85 @@
+"""
+Render cache - captions and keyboards of the movie screens, built once per movie version
+"""
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from config import Config
+from utils import metrics
+from utils.cache import TTLCache
+
+# code -> (movie, {(part, screen): (text, markup)})
+_cache = TTLCache(Config.MOVIE_CACHE_SIZE, Config.MOVIE_CACHE_TTL)
+metrics.track_cache("render", _cache)
+
+
+def _screens(movie: dict) -> dict:
+    """Rendered screens of this exact movie document, a changed movie starts empty"""
+    cached = _cache.get(movie["code"])
+    if cached is None or cached[0] is not movie:
+        cached = (movie, {})
+        _cache.set(movie["code"], cached)
+    return cached[1]
+
+
+def invalidate(code: str):
+    """Drop the screens of a movie after it changed"""
+    _cache.pop(code)
+
+
+def part_qualities(movie: dict, part: int) -> dict:
+    """Qualities of one part, part 1 lives in the main qualities"""
+    if part > 1 and "parts_data" in movie:
+        return movie["parts_data"].get(f"part_{part}", {}).get("qualities", {})
+    return movie.get("qualities", {})
+
+
+def parts_screen(movie: dict) -> tuple:
+    """(text, markup) of the part picker"""
+    screens = _screens(movie)
+    rendered = screens.get((0, "parts"))
+    if rendered is None:
+        buttons = [
+            InlineKeyboardButton(f"📦 Part {i}", callback_data=f"part:{movie['code']}:{i}")
+            for i in range(1, movie["parts"] + 1)
+        ]
+        rendered = screens[(0, "parts")] = (
+            f"🎬 **{movie['title']}**\n\n"
+            f"This movie has {movie['parts']} parts.\n"
+            f"Select one:",
+            InlineKeyboardMarkup([buttons[i:i+3] for i in range(0, len(buttons), 3)])
+        )
+    return rendered
+
+
+def quality_screen(movie: dict, part: int, back: bool = False) -> tuple:
+    """(text, markup) of the quality picker, None if the part has no files
+
+    back adds a "Back to Parts" button on multi-part movies.
+    """
+    screen = "qualities_back" if back else "qualities"
+    screens = _screens(movie)
+    if (part, screen) in screens:
+        return screens[(part, screen)]
+
+    qualities = part_qualities(movie, part)
+    rendered = None
+    if qualities:
+        buttons = []
+        for quality, data in qualities.items():
+            size = data.get("size", "")
+            btn_text = f"🎞️ {quality}" + (f" ({size})" if size else "")
+            buttons.append([
+                InlineKeyboardButton(btn_text, callback_data=f"quality:{movie['code']}:{part}:{quality}")
+            ])
+
+        if back and movie.get("parts", 1) > 1:
+            buttons.append([InlineKeyboardButton("◀️ Back to Parts", callback_data=f"movie:{movie['code']}")])
+
+        rendered = (
+            f"🎬 **{movie['title']}**\n\n"
+            f"📦 Part: {part}\n\n"
+            f"Select quality:",
+            InlineKeyboardMarkup(buttons)
+        )
+
+    screens[(part, screen)] = rendered
+    return rendered
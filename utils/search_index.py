@@ -0,0 +1,165 @@
+"""
+In-memory fuzzy search index - typo tolerant title lookups
+"""
+import logging
+from helpers import search_tokens
+
+logger = logging.getLogger(__name__)
+
+# Shortest word that is matched fuzzily (shorter words must match exactly)
+MIN_FUZZY_LENGTH = 3
+
+# Candidate words verified with edit distance per query word
+MAX_CANDIDATES = 20
+
+
+def trigrams(word: str) -> set:
+    """Padded character trigrams of a word"""
+    padded = f"$${word}$$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Edit distance counting adjacent swaps as one edit, stops early past limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb)
+            )
+            if before and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit and min(previous) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+class SearchIndex:
+    """Inverted index of catalog titles with trigram candidate generation"""
+
+    def __init__(self, max_movies: int = 50000):
+        self.max_movies = max_movies
+        self.movies = {}      # code -> {"code", "title", "parts", "words"}
+        self.words = {}       # word -> set of codes
+        self.grams = {}       # trigram -> set of words
+        self.full = False
+
+    def __len__(self):
+        return len(self.movies)
+
+    def clear(self):
+        self.movies.clear()
+        self.words.clear()
+        self.grams.clear()
+        self.full = False
+
+    def add(self, movie: dict):
+        """Add or refresh a movie"""
+        code = movie.get("code")
+        if not code:
+            return
+
+        if code in self.movies:
+            self.remove(code)
+        elif len(self.movies) >= self.max_movies:
+            if not self.full:
+                logger.warning(f"Search index full ({self.max_movies} movies), new titles are not indexed")
+                self.full = True
+            return
+
+        words = search_tokens(f"{movie.get('title', '')} {code}")
+        self.movies[code] = {
+            "code": code,
+            "title": movie.get("title", code),
+            "parts": movie.get("parts", 1),
+            "words": words
+        }
+
+        for word in words:
+            if word not in self.words:
+                self.words[word] = set()
+                for gram in trigrams(word):
+                    self.grams.setdefault(gram, set()).add(word)
+            self.words[word].add(code)
+
+    def remove(self, code: str):
+        """Drop a movie from the index"""
+        movie = self.movies.pop(code, None)
+        if not movie:
+            return
+
+        self.full = False
+        for word in movie["words"]:
+            codes = self.words.get(word)
+            if codes is None:
+                continue
+            codes.discard(code)
+            if not codes:
+                del self.words[word]
+                for gram in trigrams(word):
+                    grams = self.grams.get(gram)
+                    if grams is not None:
+                        grams.discard(word)
+                        if not grams:
+                            del self.grams[gram]
+
+    def _similar_words(self, word: str) -> dict:
+        """Indexed words close to word, with a 0-1 similarity"""
+        if word in self.words:
+            return {word: 1.0}
+        if len(word) < MIN_FUZZY_LENGTH:
+            return {}
+
+        shared = {}
+        for gram in trigrams(word):
+            for candidate in self.grams.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        limit = 1 if len(word) <= 5 else 2
+        best = sorted(shared, key=shared.get, reverse=True)[:MAX_CANDIDATES]
+
+        similar = {}
+        for candidate in best:
+            distance = edit_distance(word, candidate, limit)
+            if distance <= limit:
+                similar[candidate] = 1 - distance / max(len(word), len(candidate))
+        return similar
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """Return codes of the best fuzzy matches for query"""
+        scores = None
+
+        for token in search_tokens(query):
+            similar = self._similar_words(token)
+            if not similar:
+                if len(token) < MIN_FUZZY_LENGTH:
+                    continue
+                return []
+
+            token_scores = {}
+            for word, similarity in similar.items():
+                for code in self.words[word]:
+                    if similarity > token_scores.get(code, 0):
+                        token_scores[code] = similarity
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {c: s + token_scores[c] for c, s in scores.items() if c in token_scores}
+            if not scores:
+                return []
+
+        if not scores:
+            return []
+
+        ranked = sorted(scores, key=lambda c: (-scores[c], len(self.movies[c]["words"])))
+        return ranked[:limit]
@@ -0,0 +1,111 @@
+"""
+Signed download tokens - HMAC protected, issued without a database write
+"""
+import base64
+import hashlib
+import hmac
+import struct
+import time
+from datetime import datetime, timezone
+from pymongo.errors import DuplicateKeyError
+
+VERSION = 1
+MAC_SIZE = 10
+
+# Telegram allows 64 characters in a start parameter, "token_" takes 6
+MAX_TOKEN_LENGTH = 58
+
+# Database tokens are secrets.token_urlsafe(16), anything longer is signed
+DB_TOKEN_LENGTH = 22
+
+# version, movie _id, part, user_id, expires_at - quality follows as text
+_HEADER = struct.Struct(">B12sBqI")
+
+
+def _mac(secret: bytes, body: bytes) -> bytes:
+    return hmac.new(secret, body, hashlib.sha256).digest()[:MAC_SIZE]
+
+
+def sign_token(secret: bytes, movie_id: bytes, part: int, quality: str, user_id: int, ttl: int) -> str:
+    """Build a signed token, or None if the data does not fit"""
+    quality = quality.encode()
+    if len(movie_id) != 12 or not 0 < part < 256:
+        return None
+
+    body = _HEADER.pack(VERSION, movie_id, part, user_id, int(time.time()) + ttl) + quality
+    token = base64.urlsafe_b64encode(body + _mac(secret, body)).rstrip(b"=").decode()
+    return token if len(token) <= MAX_TOKEN_LENGTH else None
+
+
+def is_signed_token(token: str) -> bool:
+    return len(token) > DB_TOKEN_LENGTH
+
+
+def read_token(secret: bytes, token: str) -> dict:
+    """Check signature and expiry, returns the token data or None"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except Exception:
+        return None
+
+    if len(raw) < _HEADER.size + MAC_SIZE or raw[0] != VERSION:
+        return None
+
+    body, mac = raw[:-MAC_SIZE], raw[-MAC_SIZE:]
+    if not hmac.compare_digest(mac, _mac(secret, body)):
+        return None
+
+    _, movie_id, part, user_id, expires_at = _HEADER.unpack_from(body)
+    if expires_at < time.time():
+        return None
+
+    try:
+        quality = body[_HEADER.size:].decode()
+    except UnicodeDecodeError:
+        return None
+
+    return {
+        "movie_id": movie_id,
+        "part": part,
+        "quality": quality,
+        "user_id": user_id,
+        "expires_at": expires_at,
+        "key": mac.hex()
+    }
+
+
+class SpentTokens:
+    """In-memory single-use guard, keeps only tokens that are not yet expired"""
+
+    def __init__(self):
+        self._spent = {}    # key -> expires_at
+        self._next_sweep = 1024
+
+    async def spend(self, key: str, expires_at: int) -> bool:
+        """Mark a token used, False if it already was"""
+        if key in self._spent:
+            return False
+
+        self._spent[key] = expires_at
+        if len(self._spent) >= self._next_sweep:
+            now = time.time()
+            self._spent = {k: e for k, e in self._spent.items() if e >= now}
+            self._next_sweep = max(1024, len(self._spent) * 2)
+        return True
+
+
+class MongoSpentTokens:
+    """Single-use guard shared between processes through a TTL collection"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def spend(self, key: str, expires_at: int) -> bool:
+        try:
+            await self.collection.insert_one({
+                "_id": key,
+                "expires_at": datetime.fromtimestamp(expires_at, timezone.utc)
+            })
+            return True
+        except DuplicateKeyError:
+            return False
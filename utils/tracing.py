@@ -0,0 +1,362 @@
+"""
+Tracing - opt-in span trees per update, exported to a JSON lines file or OTLP
+
+Handlers open a trace, and Database methods, storage calls, Telegram API
+calls and HTTP requests made while it runs become its spans. Finished traces
+are sampled (TRACE_SAMPLE_RATE), filtered by duration (TRACE_SLOW_MS) and
+exported in the background. With TRACING off nothing is wrapped.
+"""
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import time
+from urllib.parse import urlsplit
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+ENABLED = Config.TRACING
+
+# Spans kept per trace, later ones are counted as dropped
+MAX_SPANS = 500
+
+# Finished traces buffered for export, older ones are dropped when full
+MAX_PENDING = 5000
+
+# Seconds between exports
+EXPORT_INTERVAL = 5
+
+# Traces per OTLP request
+OTLP_BATCH = 200
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+_current = contextvars.ContextVar("span", default=None)
+
+# Marks the context of an update that was not sampled
+_UNSAMPLED = object()
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "attributes", "start", "end", "error")
+
+    def __init__(self, trace, parent_id: str, name: str, kind: int, attributes: dict):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.start = time.time_ns()
+        self.end = None
+        self.error = None
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def finish(self, error: BaseException = None):
+        self.end = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"[:300]
+        self.trace.finished(self)
+
+    def as_dict(self) -> dict:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start / 1e9,
+            "duration_ms": round((self.end - self.start) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+
+class Trace:
+    __slots__ = ("trace_id", "root", "spans", "dropped", "done")
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.root = None
+        self.spans = []
+        self.dropped = 0
+        self.done = False
+
+    def finished(self, span: Span):
+        # Spans of tasks that outlive the update are not reported
+        if self.done:
+            return
+        if len(self.spans) < MAX_SPANS or span is self.root:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+        if span is self.root:
+            self.done = True
+            if (span.end - span.start) / 1e6 >= Config.TRACE_SLOW_MS:
+                _exporter.submit(self)
+
+    def as_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "start": self.root.start / 1e9,
+            "duration_ms": round((self.root.end - self.root.start) / 1e6, 3),
+            "dropped_spans": self.dropped,
+            "spans": [span.as_dict() for span in self.spans]
+        }
+
+
+def start_span(name: str, kind: int = INTERNAL, root: bool = False, **attributes):
+    """Open a span under the current one and make it current
+
+    root=True starts a new trace when none is running. Returns (span, token)
+    for end_span, span is None when nothing is being traced.
+    """
+    parent = _current.get()
+    if parent is _UNSAMPLED:
+        return None, None
+    if parent is None:
+        if not root:
+            return None, None
+        if random.random() >= Config.TRACE_SAMPLE_RATE:
+            return None, _current.set(_UNSAMPLED)
+        trace = Trace()
+        span = trace.root = Span(trace, None, name, SERVER, attributes)
+    else:
+        span = Span(parent.trace, parent.span_id, name, kind, attributes)
+    return span, _current.set(span)
+
+
+def end_span(span: Span, token, error: BaseException = None):
+    if token is not None:
+        _current.reset(token)
+    if span is not None:
+        span.finish(error)
+
+
+def current() -> Span:
+    """Span of the running code, None outside traces"""
+    span = _current.get()
+    return None if span is _UNSAMPLED else span
+
+
+def wrap(func, name: str, kind: int = INTERNAL, root: bool = False, attributes=None):
+    """Run a coroutine function in a span, attributes(*args) adds attributes from its arguments"""
+    if not ENABLED:
+        return func
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        span, token = start_span(name, kind, root)
+        error = None
+        try:
+            if span is not None and attributes is not None:
+                span.attributes.update(attributes(*args))
+            return await func(*args, **kwargs)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            end_span(span, token, error)
+    return wrapper
+
+
+def traced(func):
+    """Decorator adding a span named after the function to traces it runs in"""
+    return wrap(func, func.__name__)
+
+
+def traced_methods(prefix: str):
+    """Class decorator adding a "prefix.method" span for every public coroutine method"""
+    def decorate(cls):
+        if not ENABLED:
+            return cls
+        for name, func in list(vars(cls).items()):
+            if name.startswith("_") or not inspect.iscoroutinefunction(func):
+                continue
+            setattr(cls, name, wrap(func, f"{prefix}.{name}", CLIENT))
+        return cls
+    return decorate
+
+
+def update_attributes(client, update=None, *args) -> dict:
+    """user_id and chat_id of the update a handler got"""
+    attributes = {}
+    user = getattr(update, "from_user", None)
+    if user is not None:
+        attributes["user_id"] = user.id
+    chat = getattr(update, "chat", None) or getattr(getattr(update, "message", None), "chat", None)
+    if chat is not None:
+        attributes["chat_id"] = chat.id
+    return attributes
+
+
+def http_trace_configs() -> list:
+    """aiohttp trace configs turning requests made inside traces into spans"""
+    if not ENABLED:
+        return []
+
+    import aiohttp
+
+    async def on_start(session, context, params):
+        url = urlsplit(str(params.url))
+        # The query string is left out, it carries API keys
+        context.span, token = start_span(
+            f"http.{params.method} {url.netloc}", CLIENT,
+            method=params.method, url=f"{url.scheme}://{url.netloc}{url.path}"
+        )
+        # Nothing runs inside a request span, leave the caller's span current
+        if token is not None:
+            _current.reset(token)
+
+    async def on_end(session, context, params):
+        if context.span is not None:
+            context.span.set("status", params.response.status)
+        end_span(context.span, None)
+
+    async def on_error(session, context, params):
+        end_span(context.span, None, params.exception)
+
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(on_start)
+    config.on_request_end.append(on_end)
+    config.on_request_exception.append(on_error)
+    return [config]
+
+
+# ============ EXPORT ============
+
+class JsonExporter:
+    """One JSON object per trace, appended to a file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, lines: list):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+
+    async def export(self, traces: list):
+        lines = [json.dumps(trace.as_dict(), default=str) + "\n" for trace in traces]
+        await asyncio.get_running_loop().run_in_executor(None, self._write, lines)
+
+    async def close(self):
+        pass
+
+
+class OtlpExporter:
+    """OTLP/HTTP with the JSON encoding, as accepted by collectors and Jaeger on port 4318"""
+
+    def __init__(self, endpoint: str, service: str):
+        self.endpoint = endpoint
+        self.service = service
+        self._session = None
+
+    @staticmethod
+    def _value(value) -> dict:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def _span(self, trace: Trace, span: Span) -> dict:
+        otlp = {
+            "traceId": trace.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": str(span.start),
+            "endTimeUnixNano": str(span.end),
+            "attributes": [{"key": k, "value": self._value(v)} for k, v in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1}
+        }
+        if span.parent_id:
+            otlp["parentSpanId"] = span.parent_id
+        return otlp
+
+    async def export(self, traces: list):
+        import aiohttp
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+
+        for i in range(0, len(traces), OTLP_BATCH):
+            body = {"resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}}]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [self._span(t, s) for t in traces[i:i + OTLP_BATCH] for s in t.spans]
+                }]
+            }]}
+            async with self._session.post(self.endpoint, json=body) as resp:
+                if resp.status >= 300:
+                    logger.warning(f"OTLP export rejected: {resp.status} {(await resp.text())[:200]}")
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class Exporter:
+    """Buffers finished traces and exports them every EXPORT_INTERVAL seconds"""
+
+    def __init__(self):
+        self.pending = []
+        self.dropped = 0
+        self.backend = None
+        self._task = None
+
+    def submit(self, trace: Trace):
+        if len(self.pending) >= MAX_PENDING:
+            self.pending.pop(0)
+            self.dropped += 1
+        self.pending.append(trace)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(EXPORT_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        traces, self.pending = self.pending, []
+        if self.backend is None:
+            if Config.TRACE_EXPORT == "otlp":
+                self.backend = OtlpExporter(Config.TRACE_OTLP_ENDPOINT, Config.TRACE_SERVICE)
+            else:
+                self.backend = JsonExporter(Config.TRACE_FILE)
+        try:
+            await self.backend.export(traces)
+        except Exception as e:
+            logger.error(f"Trace export error: {e}")
+        if self.dropped:
+            logger.warning(f"Dropped {self.dropped} traces, export is falling behind")
+            self.dropped = 0
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self.backend is not None:
+            await self.backend.close()
+
+
+_exporter = Exporter()
+
+
+async def shutdown():
+    """Export what is still buffered"""
+    await _exporter.close()
@@ -0,0 +1,83 @@
+"""
+User registry - skips writes for known users and batches the rest
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_UNSEEN = object()
+
+
+class UserRegistry:
+    """Remembers stored users and flushes new or changed ones in batches
+
+    A known user is written again at most once a day to refresh last_seen.
+    """
+
+    def __init__(self, storage, max_known: int = 200000, flush_interval: float = 10, batch_size: int = 1000):
+        self.storage = storage
+        self.max_known = max_known
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.known = OrderedDict()    # user_id -> (username, day) already in the database
+        self.pending = {}             # user_id -> (username, last_seen) waiting for a flush
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def touch(self, user_id: int, username: str = None):
+        """Record a user, queueing a write only if they are new or changed"""
+        now = time.time()
+        if self.known.get(user_id, _UNSEEN) == (username, int(now // 86400)):
+            self.known.move_to_end(user_id)
+            return
+
+        self.pending[user_id] = (username, now)
+        if len(self.pending) >= self.batch_size and not self._lock.locked():
+            asyncio.ensure_future(self.flush())
+
+    def forget(self, user_id: int):
+        """Make the next touch of this user write again"""
+        self.known.pop(user_id, None)
+
+    def _remember(self, user_id: int, username: str, last_seen: float):
+        self.known[user_id] = (username, int(last_seen // 86400))
+        self.known.move_to_end(user_id)
+        while len(self.known) > self.max_known:
+            self.known.popitem(last=False)
+
+    async def flush(self):
+        """Write pending users in one batched upsert"""
+        async with self._lock:
+            if not self.pending:
+                return
+
+            batch, self.pending = self.pending, {}
+            try:
+                await self.storage.upsert_users(batch)
+            except Exception as e:
+                logger.error(f"User flush error: {e}")
+                # Keep newer values queued since the failed batch was taken
+                for user_id, item in batch.items():
+                    self.pending.setdefault(user_id, item)
+                return
+
+            for user_id, (username, last_seen) in batch.items():
+                self._remember(user_id, username, last_seen)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
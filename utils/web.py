@@ -0,0 +1,78 @@
+"""
+Web server - health and metrics endpoints on the bot's event loop
+"""
+import asyncio
+import logging
+import time
+from aiohttp import web
+from pyrogram import Client
+from pyrogram.handlers import RawUpdateHandler
+from database import db
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds the Mongo ping may take before the bot counts as unhealthy
+PING_TIMEOUT = 3
+
+
+class WebServer:
+    def __init__(self, bot: Client, port: int):
+        self.bot = bot
+        self.port = port
+        self.started_at = time.time()
+        self.last_update = None
+        self._runner = None
+
+        # Group -2 sees every update first and never stops it
+        bot.add_handler(RawUpdateHandler(self._on_update), group=-2)
+
+    async def _on_update(self, client, update, users, chats):
+        self.mark_update()
+
+    def mark_update(self):
+        """Record an update, for clients whose updates skip the handlers"""
+        self.last_update = time.time()
+
+    async def home(self, request):
+        return web.Response(text="Bot is running!")
+
+    async def health(self, request):
+        try:
+            mongo = await asyncio.wait_for(db.ping(), PING_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Health check Mongo ping failed: {e!r}")
+            mongo = False
+
+        connected = bool(self.bot.is_connected)
+        now = time.time()
+        return web.json_response(
+            {
+                "status": "ok" if connected and mongo else "unavailable",
+                "connected": connected,
+                "mongo": mongo,
+                "uptime": int(now - self.started_at),
+                "last_update": self.last_update,
+                "seconds_since_update": int(now - self.last_update) if self.last_update else None
+            },
+            status=200 if connected and mongo else 503
+        )
+
+    async def metrics(self, request):
+        return web.Response(body=metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE_LATEST})
+
+    async def start(self):
+        server = web.Application()
+        server.router.add_get("/", self.home)
+        server.router.add_get("/health", self.health)
+        server.router.add_get("/metrics", self.metrics)
+
+        self._runner = web.AppRunner(server, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "0.0.0.0", self.port).start()
+        logger.info(f"✅ Web server on port {self.port}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,194 @@
+"""
+Sharded workers - one process receives updates, N worker processes handle them
+
+The receiver owns the bot's update stream and pushes every raw update to the
+work queue of one worker, picked by user (or chat) id so a user's updates stay
+in order and per-user state stays in one process. Each worker runs its own bot
+session that Telegram never pushes updates to, and feeds queued updates into
+its dispatcher as if they had arrived directly.
+"""
+import asyncio
+import inspect
+import logging
+from functools import lru_cache
+from io import BytesIO
+from pyrogram.raw.core import TLObject, Int
+from utils.metrics import InstrumentedClient
+
+logger = logging.getLogger(__name__)
+
+# Updates a worker takes off its queue per handler task before waiting for them
+PREFETCH_PER_HANDLER = 2
+
+
+def queue_name(index: int) -> str:
+    return f"updates:{index}"
+
+
+def shard_key(update) -> int:
+    """User id behind a raw update, else its chat or channel id"""
+    user_id = getattr(update, "user_id", None)
+    if user_id:
+        return user_id
+
+    message = getattr(update, "message", None)
+    peer = getattr(message, "peer_id", None) or getattr(update, "peer", None)
+    return getattr(peer, "user_id", None) or getattr(peer, "chat_id", None) or getattr(peer, "channel_id", 0)
+
+
+@lru_cache(maxsize=None)
+def _optional_fields(cls) -> frozenset:
+    return frozenset(
+        name for name, param in inspect.signature(cls.__init__).parameters.items()
+        if param.default is None
+    )
+
+
+def _normalize(obj):
+    """Turn empty optional vectors back into None
+
+    Objects read from Telegram hold [] for absent optional vectors, and write()
+    sets their flag by truthiness but writes them when not None, so they would
+    not read back. Required vectors are left alone.
+    """
+    if isinstance(obj, list):
+        for item in obj:
+            _normalize(item)
+        return
+    if not isinstance(obj, TLObject):
+        return
+    optional = _optional_fields(type(obj))
+    for name in obj.__slots__:
+        value = getattr(obj, name, None)
+        if isinstance(value, list) and not value and name in optional:
+            setattr(obj, name, None)
+        else:
+            _normalize(value)
+
+
+def encode_update(update, users: dict, chats: dict) -> bytes:
+    """Raw update with the users and chats it mentions, in Telegram's own wire format"""
+    for obj in (update, *users.values(), *chats.values()):
+        _normalize(obj)
+    return b"".join([
+        Int(len(users)),
+        Int(len(chats)),
+        update.write(),
+        *(user.write() for user in users.values()),
+        *(chat.write() for chat in chats.values())
+    ])
+
+
+def decode_update(payload: bytes) -> tuple:
+    data = BytesIO(payload)
+    user_count = Int.read(data)
+    chat_count = Int.read(data)
+    update = TLObject.read(data)
+    users = [TLObject.read(data) for _ in range(user_count)]
+    chats = [TLObject.read(data) for _ in range(chat_count)]
+    return update, {u.id: u for u in users}, {c.id: c for c in chats}
+
+
+class WorkerClient(InstrumentedClient):
+    """Bot session that only sends, its updates come from the work queue"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, no_updates=True, **kwargs)
+
+    # The dispatcher only runs handler tasks for clients that get updates, start them anyway
+    async def initialize(self):
+        self.no_updates = False
+        try:
+            await super().initialize()
+        finally:
+            self.no_updates = True
+
+    async def terminate(self):
+        self.no_updates = False
+        try:
+            await super().terminate()
+        finally:
+            self.no_updates = True
+
+
+class ReceiverClient(InstrumentedClient):
+    """Bot session whose updates stay on the dispatcher queue for the Receiver"""
+
+    async def initialize(self):
+        self.no_updates = True
+        try:
+            await super().initialize()
+        finally:
+            self.no_updates = False
+
+
+class Receiver:
+    """Moves updates from a ReceiverClient's dispatcher queue to the workers' queues"""
+
+    def __init__(self, bot, store, workers: int, on_update=None):
+        self.bot = bot
+        self.store = store
+        self.workers = workers
+        self.on_update = on_update
+        self._task = None
+
+    async def _run(self):
+        updates = self.bot.dispatcher.updates_queue
+        while True:
+            update, users, chats = await updates.get()
+            if self.on_update:
+                self.on_update()
+            try:
+                payload = encode_update(update, users, chats)
+                await self.store.push(queue_name(shard_key(update) % self.workers), payload)
+            except Exception as e:
+                logger.error(f"Forward error for {type(update).__name__}: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class Feeder:
+    """Feeds one worker's queue into its client's dispatcher"""
+
+    def __init__(self, bot, store, index: int):
+        self.bot = bot
+        self.store = store
+        self.queue = queue_name(index)
+        self._task = None
+
+    async def _run(self):
+        updates = self.bot.dispatcher.updates_queue
+        limit = self.bot.workers * PREFETCH_PER_HANDLER
+        while True:
+            while updates.qsize() >= limit:
+                await asyncio.sleep(0.01)
+            try:
+                payload = await self.store.pop(self.queue)
+                if payload is None:
+                    continue
+                update, users, chats = decode_update(payload)
+                # Access hashes are per bot, so peers seen by the receiver work here too
+                await self.bot.fetch_peers(list(users.values()))
+                await self.bot.fetch_peers(list(chats.values()))
+                updates.put_nowait((update, users, chats))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Feed error on {self.queue}: {e}")
+                await asyncio.sleep(1)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None